@@ -1,19 +1,34 @@
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
 from pathlib import Path
 import json
-from typing import Dict, List, Optional
+import os
+import time
+from typing import Callable, Dict, List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
 
 from mahjong.constants import EAST, SOUTH, WEST, NORTH
-from mj.calcHand import analyze_hand as calc_analyze_hand
-from mj.machi import machi_hai_13
+from mj.calcHand import (
+    analyze_hand_cached as calc_analyze_hand,
+    analyze_all_waits as calc_analyze_all_waits,
+    HAND_VALUE_CACHE,
+    HandValueCache,
+)
+from mj.hand_matrix import names_to_matrix, validate_matrix
+from mj.machi import INDEX_TO_TILE, machi_hai_13, machi_hai_34
+from mj.shanten_table import IncrementalHand
+from mj.tiles import BASE34, NAME_TO_ID, RED_IDS, TILE_NAMES, TileHand, names_to_34
 from mj.utils import ALL_TILES
 from mj.toMelds import convert_to_melds
 
+from .pool import PoolSaturated, PoolUnavailable, pool_from_env
+
 HONOR_MAP = {
     "E": "to",
     "S": "na",
@@ -25,6 +40,12 @@ HONOR_MAP = {
 }
 HONOR_MAP_REVERSE = {v: k for k, v in HONOR_MAP.items()}
 
+KIFU_SEATS = ("E", "S", "W", "N")
+
+# /kifu/analyze で34配列ごとの向聴数・待ちを覚えておく件数（使われていないものから捨てる）
+HAND_ANALYSIS_CACHE_SIZE = 65536
+_HAND_ANALYSIS_CACHE = HandValueCache(maxsize=HAND_ANALYSIS_CACHE_SIZE)
+
 WIND_MAP = {
     "E": EAST,
     "S": SOUTH,
@@ -67,7 +88,21 @@ class Kifu(BaseModel):
     rounds: List[Round]
 
 
-app = FastAPI(title="Kifu API", version="0.1.0")
+# 1回の batch リクエストで受け付ける件数の上限
+BATCH_MAX_ITEMS = int(os.environ.get("KIFU_BATCH_MAX_ITEMS", 2000))
+
+# KIFU_ANALYSIS_MODE=pool なら解析をプロセスプールで実行する（pool.pool_from_env を参照）
+ANALYSIS_POOL = pool_from_env()
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    yield
+    if ANALYSIS_POOL is not None:
+        ANALYSIS_POOL.shutdown()
+
+
+app = FastAPI(title="Kifu API", version="0.1.0", lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -103,6 +138,20 @@ def _validate_kifu(data: dict) -> tuple[bool, list[str]]:
         return False, [e.get("msg", "invalid") for e in exc.errors()]
 
 
+def _result_payload(result) -> dict:
+    yaku_list = []
+    if getattr(result, "yaku", None):
+        for y in result.yaku:
+            name = getattr(y, "name", None)
+            yaku_list.append(name if name is not None else str(y))
+    return {
+        "han": getattr(result, "han", 0),
+        "fu": getattr(result, "fu", 0),
+        "cost": getattr(result, "cost", None),
+        "yaku": yaku_list,
+    }
+
+
 @app.get("/health")
 def health() -> dict:
     return {"status": "ok"}
@@ -119,201 +168,495 @@ def validate_kifu(payload: dict) -> dict:
     return {"ok": ok, "errors": errors}
 
 
-@app.post("/analysis/hand")
-def analyze_hand_api(payload: dict) -> dict:
-    def normalize_tile(tile: str | None) -> str:
-        if not tile:
-            return ""
-        return HONOR_MAP.get(tile, tile)
-
-    def normalize_tiles(tiles: list[str]) -> list[str]:
-        return [normalize_tile(t) for t in tiles if t]
-
-    def has_aka(tiles: list[str]) -> bool:
-        return any(t.startswith("0") for t in tiles if t)
-
-    def dora_from_indicator(tile: str) -> str:
-        if not tile:
-            return ""
-        t = normalize_tile(tile)
-        if len(t) == 2 and t[1] in ("m", "p", "s"):
-            n = 5 if t[0] == "0" else int(t[0])
-            nxt = 1 if n == 9 else n + 1
-            return f"{nxt}{t[1]}"
-        honor_cycle = ["to", "na", "sh", "pe", "to"]
-        dragon_cycle = ["hk", "ht", "ty", "hk"]
-        if t in honor_cycle:
-            return honor_cycle[honor_cycle.index(t) + 1]
-        if t in dragon_cycle:
-            return dragon_cycle[dragon_cycle.index(t) + 1]
-        return t
+@app.get("/analysis/cache")
+def analysis_cache_stats() -> dict:
+    return HAND_VALUE_CACHE.stats()
 
-    try:
-        hand_tiles = normalize_tiles(payload.get("hand", []))
-        win_tile = normalize_tile(payload.get("winTile"))
-        melds_payload = payload.get("melds", [])
-        meld_tile_count = sum(len(m.get("tiles", [])) for m in melds_payload if isinstance(m, dict))
-        total_tiles = len(hand_tiles) + meld_tile_count + (1 if win_tile else 0)
-        if win_tile and total_tiles > 14:
-            # remove one instance of win tile if it's already inside the hand
-            for i, t in enumerate(hand_tiles):
-                if t == win_tile:
-                    hand_tiles.pop(i)
-                    break
-        all_tiles = [*hand_tiles, *([win_tile] if win_tile else [])]
-        actions = []
-        for meld in melds_payload:
-            kind = meld.get("kind", "").lower()
-            if kind not in ("chi", "pon", "kan"):
-                continue
-            tiles = [normalize_tile(t) for t in meld.get("tiles", []) if t]
-            called_tile = normalize_tile(meld.get("calledTile"))
-            called_from = meld.get("calledFrom")
-            target_tiles = []
-            used_called = False
-            for t in tiles:
-                from_other = False
-                if called_from and called_tile and t == called_tile and not used_called:
-                    from_other = True
-                    used_called = True
-                target_tiles.append({"tile": t, "fromOther": from_other})
-            if called_from and not used_called and target_tiles:
-                target_tiles[0]["fromOther"] = True
-            actions.append({"target_tiles": target_tiles, "action_type": kind})
-            all_tiles.extend([t for t in tiles if t])
 
-        # validate tiles before scoring to avoid server error
-        def _base_key(tile: str) -> str:
-            if not tile:
-                return ""
-            if len(tile) == 2 and tile[0] == "0" and tile[1] in ("m", "p", "s"):
-                return f"5{tile[1]}"
-            return tile
-
-        for t in all_tiles:
-            if t not in ALL_TILES:
-                return {"ok": False, "error": f"invalid tile: {t}"}
-        counts: dict[str, int] = {}
-        red_counts: dict[str, int] = {}
-        for t in all_tiles:
-            base = _base_key(t)
-            counts[base] = counts.get(base, 0) + 1
-            if t in ("0m", "0p", "0s"):
-                red_counts[t] = red_counts.get(t, 0) + 1
-        for base, cnt in counts.items():
-            if cnt > 4:
-                return {"ok": False, "error": f"tile overflow: {base} x{cnt}"}
-        for red, cnt in red_counts.items():
-            if cnt > 1:
-                return {"ok": False, "error": f"red overflow: {red} x{cnt}"}
-
-        melds = convert_to_melds(actions) if actions else []
-        dora_indicators = normalize_tiles(payload.get("doraIndicators", []))
-        dora_tiles = [dora_from_indicator(t) for t in dora_indicators if t]
-        seat_wind = payload.get("seatWind", "E")
-        round_wind = payload.get("roundWind", "E")
-        win_type = payload.get("winType", "ron")
-
-        _, _, result = calc_analyze_hand(
+def _normalize_tile(tile: str | None) -> str:
+    if not tile:
+        return ""
+    return HONOR_MAP.get(tile, tile)
+
+
+def _normalize_tiles(tiles: list[str]) -> list[str]:
+    return [_normalize_tile(t) for t in tiles if t]
+
+
+def _denormalize_tile(tile: str) -> str:
+    if not tile:
+        return ""
+    return HONOR_MAP_REVERSE.get(tile, tile)
+
+
+def _normalize_for_tenpai(tile: str) -> str:
+    if not tile:
+        return tile
+    if len(tile) == 2 and tile[0] == "0" and tile[1] in ("m", "p", "s"):
+        return f"5{tile[1]}"
+    return tile
+
+
+def _has_aka(tiles: list[str]) -> bool:
+    return any(t.startswith("0") for t in tiles if t)
+
+
+def _dora_from_indicator(tile: str) -> str:
+    if not tile:
+        return ""
+    t = _normalize_tile(tile)
+    if len(t) == 2 and t[1] in ("m", "p", "s"):
+        n = 5 if t[0] == "0" else int(t[0])
+        nxt = 1 if n == 9 else n + 1
+        return f"{nxt}{t[1]}"
+    honor_cycle = ["to", "na", "sh", "pe", "to"]
+    dragon_cycle = ["hk", "ht", "ty", "hk"]
+    if t in honor_cycle:
+        return honor_cycle[honor_cycle.index(t) + 1]
+    if t in dragon_cycle:
+        return dragon_cycle[dragon_cycle.index(t) + 1]
+    return t
+
+
+def _meld_actions(melds_payload: list, normalize: Callable[[str | None], str]) -> list[dict]:
+    actions = []
+    for meld in melds_payload:
+        kind = meld.get("kind", "").lower()
+        if kind not in ("chi", "pon", "kan"):
+            continue
+        tiles = [normalize(t) for t in meld.get("tiles", []) if t]
+        called_tile = normalize(meld.get("calledTile"))
+        called_from = meld.get("calledFrom")
+        target_tiles = []
+        used_called = False
+        for t in tiles:
+            from_other = False
+            if called_from and called_tile and t == called_tile and not used_called:
+                from_other = True
+                used_called = True
+            target_tiles.append({"tile": t, "fromOther": from_other})
+        if called_from and not used_called and target_tiles:
+            target_tiles[0]["fromOther"] = True
+        actions.append({"target_tiles": target_tiles, "action_type": kind})
+    return actions
+
+
+def _action_tiles(actions: list[dict]) -> list[str]:
+    return [info["tile"] for act in actions for info in act.get("target_tiles", []) if info.get("tile")]
+
+
+def _prepare_hand(payload: dict) -> dict:
+    hand_tiles = _normalize_tiles(payload.get("hand", []))
+    win_tile = _normalize_tile(payload.get("winTile"))
+    melds_payload = payload.get("melds", [])
+    meld_tile_count = sum(len(m.get("tiles", [])) for m in melds_payload if isinstance(m, dict))
+    total_tiles = len(hand_tiles) + meld_tile_count + (1 if win_tile else 0)
+    if win_tile and total_tiles > 14:
+        # remove one instance of win tile if it's already inside the hand
+        for i, t in enumerate(hand_tiles):
+            if t == win_tile:
+                hand_tiles.pop(i)
+                break
+    actions = _meld_actions(melds_payload, _normalize_tile)
+    all_tiles = [*hand_tiles, *([win_tile] if win_tile else []), *_action_tiles(actions)]
+    return {"hand_tiles": hand_tiles, "win_tile": win_tile, "actions": actions, "all_tiles": all_tiles}
+
+
+def _hand_tiles_error(all_tiles: list[str]) -> str | None:
+    for t in all_tiles:
+        if t not in ALL_TILES:
+            return f"invalid tile: {t}"
+    counted = TileHand.from_names(all_tiles)
+    for base, cnt in enumerate(counted.counts):
+        if cnt > 4:
+            return f"tile overflow: {TILE_NAMES[base]} x{cnt}"
+    for red, cnt in zip(RED_IDS, counted.reds):
+        if cnt > 1:
+            return f"red overflow: {TILE_NAMES[red]} x{cnt}"
+    return None
+
+
+def _score_hand(payload: dict, prepared: dict) -> dict:
+    hand_tiles = prepared["hand_tiles"]
+    win_tile = prepared["win_tile"]
+    actions = prepared["actions"]
+    all_tiles = prepared["all_tiles"]
+
+    melds = convert_to_melds(actions) if actions else []
+    dora_indicators = _normalize_tiles(payload.get("doraIndicators", []))
+    dora_tiles = [_dora_from_indicator(t) for t in dora_indicators if t]
+    seat_wind = payload.get("seatWind", "E")
+    round_wind = payload.get("roundWind", "E")
+    win_type = payload.get("winType", "ron")
+
+    config = dict(
+        is_riichi=payload.get("riichi", False),
+        is_ippatsu=payload.get("ippatsu", False),
+        player_wind=WIND_MAP.get(seat_wind, EAST),
+        round_wind=WIND_MAP.get(round_wind, EAST),
+        kyoutaku_number=payload.get("riichiSticks", 0),
+        tsumi_number=payload.get("honba", 0),
+    )
+
+    if not win_tile:
+        # アガリ牌の指定がなければ全ての待ちについてロン・ツモの結果を返す
+        shape, table = calc_analyze_all_waits(
             tiles=hand_tiles,
-            win=win_tile,
             melds=melds,
             doras=dora_tiles,
-            has_aka=has_aka(all_tiles),
-            is_tsumo=win_type == "tsumo",
-            is_riichi=payload.get("riichi", False),
-            is_ippatsu=payload.get("ippatsu", False),
-            player_wind=WIND_MAP.get(seat_wind, EAST),
-            round_wind=WIND_MAP.get(round_wind, EAST),
-            kyoutaku_number=payload.get("riichiSticks", 0),
-            tsumi_number=payload.get("honba", 0),
+            has_aka=_has_aka(all_tiles),
+            **config,
         )
-
-        yaku_list = []
-        if getattr(result, "yaku", None):
-            for y in result.yaku:
-                name = getattr(y, "name", None)
-                yaku_list.append(name if name is not None else str(y))
+        if isinstance(shape, str):
+            return {"ok": False, "error": f"not tenpai: {shape}"}
         return {
             "ok": True,
-            "result": {
-                "han": getattr(result, "han", 0),
-                "fu": getattr(result, "fu", 0),
-                "cost": getattr(result, "cost", None),
-                "yaku": yaku_list,
+            "waits": {
+                HONOR_MAP_REVERSE.get(tile, tile): {
+                    kind: _result_payload(res) for kind, res in by_kind.items()
+                }
+                for tile, by_kind in table.items()
             },
         }
+
+    _, _, result = calc_analyze_hand(
+        tiles=hand_tiles,
+        win=win_tile,
+        melds=melds,
+        doras=dora_tiles,
+        has_aka=_has_aka(all_tiles),
+        is_tsumo=win_type == "tsumo",
+        **config,
+    )
+    return {"ok": True, "result": _result_payload(result)}
+
+
+def _analyze_hand_payload(payload: dict) -> dict:
+    try:
+        prepared = _prepare_hand(payload)
+        # validate tiles before scoring to avoid server error
+        error = _hand_tiles_error(prepared["all_tiles"])
+        if error:
+            return {"ok": False, "error": error}
+        return _score_hand(payload, prepared)
     except Exception as exc:  # pragma: no cover - guard for unexpected input
         return {"ok": False, "error": str(exc)}
 
 
-@app.post("/analysis/tenpai")
-def analyze_tenpai(payload: dict) -> dict:
-    def normalize_tile(tile: str | None) -> str:
-        if not tile:
-            return ""
-        return HONOR_MAP.get(tile, tile)
-
-    def normalize_tiles(tiles: list[str]) -> list[str]:
-        return [normalize_tile(t) for t in tiles if t]
-
-    def denormalize_tile(tile: str) -> str:
-        if not tile:
-            return ""
-        return HONOR_MAP_REVERSE.get(tile, tile)
-
-    def normalize_for_tenpai(tile: str) -> str:
-        if not tile:
-            return tile
-        if len(tile) == 2 and tile[0] == "0" and tile[1] in ("m", "p", "s"):
-            return f"5{tile[1]}"
-        return tile
-
+def _tenpai_tiles(payload: dict) -> list[str]:
+    hand_tiles = [_normalize_for_tenpai(t) for t in _normalize_tiles(payload.get("hand", []))]
+    actions = _meld_actions(
+        payload.get("melds", []),
+        lambda t: _normalize_for_tenpai(_normalize_tile(t)),
+    )
+    # 鳴きの形の誤りは単発の /analysis/tenpai と同じくエラーにする
+    if actions:
+        convert_to_melds(actions)
+    combined_tiles = [*hand_tiles, *_action_tiles(actions)]
+    if len(combined_tiles) > 13:
+        combined_tiles = combined_tiles[:13]
+    return combined_tiles
+
+
+def _tenpai_response(result: List[str] | str) -> dict:
+    if isinstance(result, str):
+        if result == "agari":
+            return {"ok": True, "status": "agari", "shanten": -1, "waits": []}
+        if "shanten" in result:
+            try:
+                value = int(result.split()[0])
+                return {"ok": True, "status": "shanten", "shanten": value, "waits": []}
+            except ValueError:
+                return {"ok": True, "status": result, "waits": []}
+        return {"ok": True, "status": result, "waits": []}
+    waits = [_denormalize_tile(tile) for tile in result]
+    return {"ok": True, "status": "tenpai", "shanten": 0, "waits": waits}
+
+
+def _analyze_tenpai_payload(payload: dict) -> dict:
     try:
-        hand_tiles = [normalize_for_tenpai(t) for t in normalize_tiles(payload.get("hand", []))]
-        melds_payload = payload.get("melds", [])
-        actions = []
-        for meld in melds_payload:
-            kind = meld.get("kind", "").lower()
-            if kind not in ("chi", "pon", "kan"):
-                continue
-            tiles = [normalize_for_tenpai(normalize_tile(t)) for t in meld.get("tiles", []) if t]
-            called_tile = normalize_for_tenpai(normalize_tile(meld.get("calledTile")))
-            called_from = meld.get("calledFrom")
-            target_tiles = []
-            used_called = False
-            for t in tiles:
-                from_other = False
-                if called_from and called_tile and t == called_tile and not used_called:
-                    from_other = True
-                    used_called = True
-                target_tiles.append({"tile": t, "fromOther": from_other})
-            if called_from and not used_called and target_tiles:
-                target_tiles[0]["fromOther"] = True
-            actions.append({"target_tiles": target_tiles, "action_type": kind})
-
-        melds = convert_to_melds(actions) if actions else []
-        combined_tiles = [*hand_tiles]
-        for act in actions:
-            for info in act.get("target_tiles", []):
-                tile = info.get("tile")
-                if tile:
-                    combined_tiles.append(tile)
-        if len(combined_tiles) > 13:
-            combined_tiles = combined_tiles[:13]
-
-        result = machi_hai_13(combined_tiles)
-        if isinstance(result, str):
-            if result == "agari":
-                return {"ok": True, "status": "agari", "shanten": -1, "waits": []}
-            if "shanten" in result:
-                try:
-                    value = int(result.split()[0])
-                    return {"ok": True, "status": "shanten", "shanten": value, "waits": []}
-                except ValueError:
-                    return {"ok": True, "status": result, "waits": []}
-            return {"ok": True, "status": result, "waits": []}
-        waits = [denormalize_tile(tile) for tile in result]
-        return {"ok": True, "status": "tenpai", "shanten": 0, "waits": waits}
+        return _tenpai_response(machi_hai_13(_tenpai_tiles(payload)))
     except Exception as exc:  # pragma: no cover - guard for unexpected input
         return {"ok": False, "error": str(exc)}
+
+
+def _batch_items(payload: dict) -> list | None:
+    items = payload.get("items")
+    if not isinstance(items, list) or len(items) > BATCH_MAX_ITEMS:
+        return None
+    return items
+
+
+def _batch_error() -> dict:
+    return {"ok": False, "error": f"items must be a list of at most {BATCH_MAX_ITEMS} payloads"}
+
+
+def _prepare_each(items: list, prepare: Callable[[dict], object]) -> tuple[list, list[dict | None]]:
+    # 前処理で失敗した項目はその場でエラーにし、残りだけをまとめて計算する
+    prepared: list = []
+    results: list[dict | None] = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("payload must be an object")
+            prepared.append(prepare(item))
+            results.append(None)
+        except Exception as exc:
+            prepared.append(None)
+            results.append({"ok": False, "error": str(exc)})
+    return prepared, results
+
+
+def _analyze_hand_batch(payload: dict) -> dict:
+    """/analysis/hand の入力を items にまとめて受け取り、入力順に同じ形の結果を返す
+
+    - 牌の検査は names_to_matrix / validate_matrix で全件まとめて1回で行う
+    - 同じ入力は1度だけ計算し、点数計算は HAND_VALUE_CACHE を共有する
+    """
+    items = _batch_items(payload)
+    if items is None:
+        return _batch_error()
+    prepared, results = _prepare_each(items, _prepare_hand)
+    rows = [i for i, p in enumerate(prepared) if p is not None]
+    counts, reds, invalid = names_to_matrix([prepared[i]["all_tiles"] for i in rows])
+    errors = validate_matrix(counts, reds, invalid)
+
+    scored: dict[str, dict] = {}
+    for row, i in enumerate(rows):
+        if errors[row] is not None:
+            # 知らない牌は単発と同じく最初の牌の名前を添える
+            error = _hand_tiles_error(prepared[i]["all_tiles"]) if invalid[row] else errors[row]
+            results[i] = {"ok": False, "error": error}
+            continue
+        key = json.dumps(items[i], sort_keys=True, ensure_ascii=False)
+        if key not in scored:
+            try:
+                scored[key] = _score_hand(items[i], prepared[i])
+            except Exception as exc:  # pragma: no cover - guard for unexpected input
+                scored[key] = {"ok": False, "error": str(exc)}
+        results[i] = scored[key]
+    return {"ok": True, "results": results}
+
+
+def _analyze_tenpai_batch(payload: dict) -> dict:
+    """/analysis/tenpai の入力を items にまとめて受け取り、入力順に同じ形の結果を返す
+
+    牌の枚数は names_to_matrix で全件まとめて数え、同じ34配列の待ちは1度だけ求める
+    """
+    items = _batch_items(payload)
+    if items is None:
+        return _batch_error()
+    prepared, results = _prepare_each(items, _tenpai_tiles)
+    rows = [i for i, p in enumerate(prepared) if p is not None]
+    counts, _, _ = names_to_matrix([prepared[i] for i in rows])
+
+    waits: dict[bytes, dict] = {}
+    for row, i in enumerate(rows):
+        key = counts[row].tobytes()
+        if key not in waits:
+            try:
+                shape, _ = machi_hai_34(counts[row])
+                waits[key] = _tenpai_response(shape)
+            except Exception as exc:  # pragma: no cover - guard for unexpected input
+                waits[key] = {"ok": False, "error": str(exc)}
+        results[i] = waits[key]
+    return {"ok": True, "results": results}
+
+
+def _action_kind(action: str | None) -> str:
+    # kifu_ui の initFromKifuStep と同じ言い回しを受け付ける（和了を先に見る: "tsumo_win" など）
+    a = (action or "").lower()
+    if any(k in a for k in ("ron", "agari", "win", "和了")):
+        return "win"
+    if any(k in a for k in ("draw", "tsumo", "ツモ")):
+        return "draw"
+    if any(k in a for k in ("discard", "打")):
+        return "discard"
+    return "other"
+
+
+def _seat_wind(seat: str | None, dealer: str | None) -> str:
+    if seat not in KIFU_SEATS or dealer not in KIFU_SEATS:
+        return "E"
+    return KIFU_SEATS[(KIFU_SEATS.index(seat) - KIFU_SEATS.index(dealer)) % 4]
+
+
+def _hand_analysis(hand: IncrementalHand) -> dict:
+    # 返した dict は複数の Step で共有するので書き換えないこと
+    key = tuple(hand.tiles)
+    cached = _HAND_ANALYSIS_CACHE.get(key)
+    if cached is None:
+        if hand.count % 3 == 1:
+            shanten, ukeire = hand.waits()
+            waits = [_denormalize_tile(INDEX_TO_TILE[i]) for i in ukeire] if shanten == 0 else []
+            cached = {"shanten": shanten, "waits": waits, "ukeire": sum(ukeire.values())}
+        else:
+            cached = {"shanten": hand.shanten(), "waits": []}
+        _HAND_ANALYSIS_CACHE.put(key, cached)
+    return cached
+
+
+def _rebuild_entry(raw: list[str]) -> dict:
+    names = _normalize_tiles(raw)
+    error = _hand_tiles_error(names)
+    if error is None and len(names) > 14:
+        error = f"too many tiles: {len(names)}"
+    if error:
+        return {"raw": raw, "hand": None, "result": {"error": error}}
+    hand = IncrementalHand(names_to_34(names))
+    return {"raw": raw, "hand": hand, "result": _hand_analysis(hand)}
+
+
+def _delta_entry(prev: dict, raw: list[str], tile: str, sign: int) -> dict | None:
+    # ツモ・打牌の1枚だけを出し入れする（出し入れした結果が Step の hands と合わなければ None を返して作り直させる）
+    tile_id = NAME_TO_ID.get(tile)
+    hand = prev["hand"]
+    if tile_id is None or hand is None:
+        return None
+    idx = BASE34[tile_id]
+    expected = list(hand.tiles)
+    expected[idx] += sign
+    if expected != names_to_34(_normalize_tiles(raw)):
+        return None
+    if sign > 0:
+        hand.add(idx)
+    else:
+        hand.remove(idx)
+    return {"raw": raw, "hand": hand, "result": _hand_analysis(hand)}
+
+
+def _step_score(rnd: dict, step: dict, kind: str, entry: dict | None) -> dict | None:
+    # 和了の Step と、ツモで和了形になった Step だけ点数を付ける
+    win_tile = step.get("tile")
+    if entry is None or entry["hand"] is None or not win_tile:
+        return None
+    if kind == "win":
+        win_type = "ron" if "ron" in step.get("action", "").lower() else "tsumo"
+    elif kind == "draw" and entry["result"]["shanten"] < 0:
+        win_type = "tsumo"
+    else:
+        return None
+    scored = _analyze_hand_payload({
+        "hand": entry["raw"],
+        "winTile": win_tile,
+        "winType": win_type,
+        "seatWind": _seat_wind(step.get("actor"), rnd.get("dealer")),
+        "roundWind": rnd.get("wind", "E"),
+        "honba": rnd.get("honba", 0),
+        "riichiSticks": rnd.get("riichiSticks", 0),
+        "doraIndicators": step.get("doraIndicators", []),
+    })
+    return {"winType": win_type, "winTile": win_tile, **scored}
+
+
+def _analyze_kifu_round(payload: dict) -> dict:
+    """1局ぶんの Step を順にたどり、Step ごとに各家の向聴数・待ち（和了なら点数）を返す
+
+    - 手牌が前の Step と同じ家は前の結果をそのまま使う
+    - 手番の家のツモ・打牌は IncrementalHand に1枚出し入れして、変わった色だけ引き直す
+    - 34配列ごとの向聴数と待ちは _hand_analysis でキャッシュする
+    """
+    rnd = payload["round"]
+    state: dict[str, dict] = {}
+    lines = []
+    for step in rnd.get("steps", []):
+        actor = step.get("actor")
+        kind = _action_kind(step.get("action"))
+        tile = _normalize_tile(step.get("tile"))
+        players = {}
+        for seat, hand in (step.get("hands") or {}).items():
+            raw = [t for t in hand if t]
+            # 伏せられた手牌は解析しない
+            if not raw or "BACK" in raw:
+                continue
+            prev = state.get(seat)
+            changed = prev is None or prev["raw"] != raw
+            if changed:
+                entry = None
+                if prev is not None and seat == actor and tile and kind in ("draw", "discard"):
+                    entry = _delta_entry(prev, raw, tile, 1 if kind == "draw" else -1)
+                state[seat] = entry or _rebuild_entry(raw)
+            players[seat] = {**state[seat]["result"], "changed": changed}
+
+        line = {
+            "round": rnd.get("roundIndex"),
+            "step": step.get("index"),
+            "actor": actor,
+            "action": step.get("action"),
+            "tile": step.get("tile"),
+            "players": players,
+        }
+        score = _step_score(rnd, step, kind, state.get(actor))
+        if score is not None:
+            line["score"] = score
+        lines.append(line)
+    return {"lines": lines}
+
+
+async def _run_analysis(fn: Callable[[dict], dict], payload: dict) -> dict:
+    if ANALYSIS_POOL is None:
+        return await run_in_threadpool(fn, payload)
+    try:
+        return await ANALYSIS_POOL.run(fn, payload)
+    except PoolSaturated as exc:
+        raise HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": "1"}) from exc
+    except PoolUnavailable as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"}) from exc
+
+
+@app.post("/analysis/hand")
+async def analyze_hand_api(payload: dict) -> dict:
+    return await _run_analysis(_analyze_hand_payload, payload)
+
+
+@app.post("/analysis/tenpai")
+async def analyze_tenpai(payload: dict) -> dict:
+    return await _run_analysis(_analyze_tenpai_payload, payload)
+
+
+@app.post("/analysis/hand/batch")
+async def analyze_hand_batch_api(payload: dict) -> dict:
+    return await _run_analysis(_analyze_hand_batch, payload)
+
+
+@app.post("/analysis/tenpai/batch")
+async def analyze_tenpai_batch(payload: dict) -> dict:
+    return await _run_analysis(_analyze_tenpai_batch, payload)
+
+
+@app.post("/kifu/analyze")
+async def analyze_kifu(payload: dict):
+    ok, errors = _validate_kifu(payload)
+    if not ok:
+        return {"ok": False, "errors": errors}
+
+    async def lines():
+        # 局ごとに解析して書き出すので、長い対局でも最初の局からすぐ返り始める
+        start = time.perf_counter()
+        steps = 0
+        for rnd in payload.get("rounds", []):
+            try:
+                out = await _run_analysis(_analyze_kifu_round, {"round": rnd})
+            except HTTPException as exc:
+                yield json.dumps({"ok": False, "round": rnd.get("roundIndex"), "error": exc.detail}) + "\n"
+                return
+            except Exception as exc:
+                # 解析できない局はエラーの行を返して次の局へ進む（ストリームを途中で切らない）
+                yield json.dumps({"ok": False, "round": rnd.get("roundIndex"), "error": str(exc)},
+                                 ensure_ascii=False) + "\n"
+                continue
+            for line in out["lines"]:
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            steps += len(out["lines"])
+        summary = {"done": True, "rounds": len(payload.get("rounds", [])), "steps": steps,
+                   "seconds": round(time.perf_counter() - start, 3)}
+        yield json.dumps(summary) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/analysis/pool")
+def analysis_pool_stats() -> dict:
+    if ANALYSIS_POOL is None:
+        return {"mode": "inline"}
+    return {"mode": "pool", **ANALYSIS_POOL.metrics()}
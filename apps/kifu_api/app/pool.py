@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+
+class PoolSaturated(Exception):
+    """待ち行列が上限に達している"""
+
+
+class PoolUnavailable(Exception):
+    """時間切れ、またはワーカープロセスが落ちて結果を返せない"""
+
+
+def _timed(fn: Callable, *args) -> tuple[float, Any]:
+    # ワーカーの中で計るので、待ち行列で待った時間は busyRatio に入らない
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+class AnalysisPool:
+    """CPU を使う解析をプロセスプールで実行し、待ち行列の長さと時間を制限する
+
+    - 実行中＋待ち中の件数が max_pending に達したら PoolSaturated
+    - timeout 秒で結果が返らなければ PoolUnavailable（ワーカーでの処理は終わるまで件数に数える）
+    - ワーカーが落ちたらプールを作り直して PoolUnavailable
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counts = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+        self._busy_sec = 0.0
+        self._started = time.monotonic()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _restart(self, executor: ProcessPoolExecutor | None) -> None:
+        # 古いプールの失敗が遅れて届いたときに、作り直したばかりのプールを止めない
+        with self._lock:
+            if executor is None or self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, future) -> None:
+        busy = 0.0
+        if not future.cancelled() and future.exception() is None:
+            busy, _ = future.result()
+        with self._lock:
+            self._pending -= 1
+            self._busy_sec += busy
+
+    async def run(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counts["rejected"] += 1
+                raise PoolSaturated(f"analysis queue is full ({self._pending}/{self.max_pending})")
+            self._pending += 1
+            self._counts["submitted"] += 1
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_timed, fn, *args)
+        except (BrokenProcessPool, RuntimeError) as exc:
+            with self._lock:
+                self._pending -= 1
+            self._restart(executor)
+            raise PoolUnavailable(f"analysis pool unavailable: {exc}") from exc
+        # 時間切れで諦めてもワーカーは処理を続けるので、実際に終わった時点で件数を戻す
+        future.add_done_callback(self._finished)
+
+        try:
+            _, result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.CancelledError as exc:
+            # 別のリクエストがプールを作り直して待ち中の処理が取り消された（リクエスト自体の取り消しはそのまま）
+            if not future.cancelled() or self._executor is executor:
+                raise
+            with self._lock:
+                self._counts["errors"] += 1
+            raise PoolUnavailable("analysis was cancelled by a pool restart") from exc
+        except asyncio.TimeoutError as exc:
+            future.cancel()
+            with self._lock:
+                self._counts["timeouts"] += 1
+            raise PoolUnavailable(f"analysis timed out after {self.timeout}s") from exc
+        except BrokenProcessPool as exc:
+            with self._lock:
+                self._counts["errors"] += 1
+            self._restart(executor)
+            raise PoolUnavailable(f"analysis worker crashed: {exc}") from exc
+        with self._lock:
+            self._counts["completed"] += 1
+        return result
+
+    def metrics(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            running = min(pending, self.workers)
+            uptime = time.monotonic() - self._started
+            return {
+                "workers": self.workers,
+                "maxPending": self.max_pending,
+                "timeoutSec": self.timeout,
+                "pending": pending,
+                "running": running,
+                "queued": pending - running,
+                "utilization": running / self.workers,
+                "busyRatio": self._busy_sec / (uptime * self.workers) if uptime else 0.0,
+                **self._counts,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def pool_from_env() -> AnalysisPool | None:
+    """KIFU_ANALYSIS_MODE=pool のときだけプールを作る（既定の inline ではリクエストのスレッドで実行）
+
+    - KIFU_ANALYSIS_WORKERS    : ワーカープロセス数（既定: CPU数-1）
+    - KIFU_ANALYSIS_MAX_PENDING: 実行中＋待ち中の上限（既定: ワーカー数の4倍）
+    - KIFU_ANALYSIS_TIMEOUT    : 1件あたりの制限時間（秒、既定: 10）
+    """
+    if os.environ.get("KIFU_ANALYSIS_MODE", "inline").lower() != "pool":
+        return None
+    workers = int(os.environ.get("KIFU_ANALYSIS_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+    max_pending = int(os.environ.get("KIFU_ANALYSIS_MAX_PENDING", workers * 4))
+    timeout = float(os.environ.get("KIFU_ANALYSIS_TIMEOUT", 10))
+    return AnalysisPool(workers, max_pending, timeout)
@@ -2,16 +2,15 @@ from pathlib import Path
 import base64
 import contextlib
 import io
-import tempfile
 
 import streamlit as st
 from PIL import Image
 
 from mahjong.constants import EAST, NORTH, SOUTH, WEST
-from mj.models.tehai.myyolo import MYYOLO
+from mj.models.tehai.myyolo import MYYOLO, get_detector_from_bytes
 from mj.machi import machi_hai_13
-from mj.calcHand import analyze_hand
-from mj.utils import print_hand_result
+from mj.calcHand import analyze_all_waits
+from mj.utils import print_hand_result, tiles_to_mahjong_array_strings
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 DEFAULT_WEIGHTS = (
@@ -37,14 +36,12 @@ def _resolve_weights(weight_choice: str, weights_local_file) -> str:
         if weights_local_file is None:
             st.error("ローカルの重み .pt を選択してください。")
             st.stop()
-        with tempfile.NamedTemporaryFile(suffix=".pt", delete=False) as wtmp:
-            wtmp.write(weights_local_file.read())
-            return wtmp.name
+        return get_detector_from_bytes(weights_local_file.getvalue()).model_path
     return str(DEFAULT_WEIGHTS)
 
 
-def _run_pipeline(img_path: str, weights: str):
-    tile_infos, tile_names = MYYOLO(model_path=weights, image_path=img_path)
+def _run_pipeline(image, weights: str):
+    tile_infos, tile_names = MYYOLO(model_path=weights, image_path=image)
     shape = machi_hai_13(tile_names)
     return tile_infos, tile_names, shape
 
@@ -170,13 +167,9 @@ def render():
         if not run:
             return
 
-        weights_to_use = _resolve_weights(weight_choice, weights_local_file)
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            img.save(tmp.name)
-            tmp_path = tmp.name
-
         with st.spinner("解析中…"):
-            tile_infos, tile_names, shape = _run_pipeline(tmp_path, weights_to_use)
+            weights_to_use = _resolve_weights(weight_choice, weights_local_file)
+            tile_infos, tile_names, shape = _run_pipeline(img, weights_to_use)
 
         col_det, col_wait = st.columns([8, 3], gap="large")
         with col_det:
@@ -198,37 +191,39 @@ def render():
 
         if isinstance(shape, (list, tuple, set)) and len(shape) > 0:
             st.subheader("待ち牌ごとのアガリ結果")
+            try:
+                _, table = analyze_all_waits(
+                    tiles=tile_names,
+                    has_aka=has_aka,
+                    melds=[],
+                    doras=[s.strip() for s in doras_text.split(",") if s.strip()],
+                    is_riichi=is_riichi,
+                    is_ippatsu=is_ippatsu,
+                    player_wind=player_wind,
+                    round_wind=round_wind,
+                    is_rinshan=is_rinshan,
+                    is_chankan=is_chankan,
+                    is_hotei=is_hotei,
+                    is_haitei=is_haitei,
+                    is_wriichi=is_wriichi,
+                    is_tenho=is_tenho,
+                    is_renho=is_renho,
+                    is_chiho=is_chiho,
+                    kyoutaku=kyoutaku,
+                    honba=honba
+                )
+            except Exception as e:
+                st.warning(f"結果計算でエラー: {e}")
+                table = {}
             for name in waits:
-                try:
-                    h2, a2, cfg2 = analyze_hand(
-                        tiles=tile_names,
-                        win=name,
-                        has_aka=has_aka,
-                        melds=[],
-                        doras=[s.strip() for s in doras_text.split(",") if s.strip()],
-                        is_riichi=is_riichi,
-                        is_ippatsu=is_ippatsu,
-                        is_tsumo=is_tsumo,
-                        player_wind=player_wind,
-                        round_wind=round_wind,
-                        is_rinshan=is_rinshan,
-                        is_chankan=is_chankan,
-                        is_hotei=is_hotei,
-                        is_haitei=is_haitei,
-                        is_wriichi=is_wriichi,
-                        is_tenho=is_tenho,
-                        is_renho=is_renho,
-                        is_chiho=is_chiho,
-                        kyoutaku=kyoutaku,
-                        honba=honba
-                    )
-                    buf = io.StringIO()
-                    with contextlib.redirect_stdout(buf):
-                        print_hand_result(h2, a2, cfg2, is_tsumo=is_tsumo)
-                    st.expander(f"{name} のアガリ結果", expanded=False).code(buf.getvalue(), language="text")
-                except Exception as e:
-                    st.warning(f"{name} の結果計算でエラー: {e}")
-
+                if name not in table:
+                    continue
+                cfg2 = table[name]["tsumo" if is_tsumo else "ron"]
+                h2 = tiles_to_mahjong_array_strings(tile_names, [name], need_aka=True)
+                buf = io.StringIO()
+                with contextlib.redirect_stdout(buf):
+                    print_hand_result(h2, name, cfg2, is_tsumo=is_tsumo)
+                st.expander(f"{name} のアガリ結果", expanded=False).code(buf.getvalue(), language="text")
 
 if __name__ == "__main__":
     render()
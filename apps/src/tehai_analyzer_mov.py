@@ -4,22 +4,29 @@ from pathlib import Path
 import base64
 import functools
 import http.server
-import queue
 import tempfile
 import threading
 import time
 import urllib.parse
 from typing import Sequence
 
-import cv2
 import numpy as np
 import streamlit as st
 import streamlit.components.v1 as components
 from PIL import Image
-from ultralytics import YOLO
 
-from mj.models.tehai.myyolo import MYYOLO
-from mj.machi import machi_hai_13
+from mj.models.tehai.crop import HandCropper
+from mj.models.tehai.myyolo import (
+    MYYOLO,
+    UPLOADED_DETECTORS_MAX,
+    TehaiDetector,
+    get_detector,
+    get_detector_from_bytes,
+    has_detector,
+)
+from mj.models.tehai.tracking import HandStabilizer, TileTracker
+from mj.machi import IncrementalMachi
+from mj.video_stream import DROP, VideoStream
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 DEFAULT_WEIGHTS = (
@@ -158,38 +165,24 @@ def _img_b64(path: Path) -> str:
     return base64.b64encode(path.read_bytes()).decode("ascii")
 
 
-@st.cache_resource(show_spinner=False)
-def _load_model(weights_path: str) -> YOLO:
-    return YOLO(weights_path)
+# get_detector_from_bytes が捨てた検出器をここで持ち続けないように件数を絞る
+@st.cache_resource(show_spinner=False, max_entries=UPLOADED_DETECTORS_MAX + 1)
+def _load_model(weights_path: str) -> TehaiDetector:
+    return get_detector(weights_path)
 
 
-def _detect_from_ndarray(frame_rgb: np.ndarray, model: YOLO):
-    result = model.predict(
-        source=frame_rgb,
-        conf=YOLO_CONF,
-        iou=YOLO_IOU,
-        verbose=False,
-    )[0]
-    cls_names = model.names
-    tile_infos = []
-    for box in result.boxes:
-        cls_name = cls_names[int(box.cls[0])]
-        conf = float(box.conf[0])
-        ltop = box.xyxy[0][0]
-        tile_infos.append({"point": ltop, "conf": conf, "class": cls_name})
-    tile_infos.sort(key=lambda x: x["point"])
-    tile_names = [h["class"] for h in tile_infos]
-    shape = machi_hai_13(tile_names)
-    return tile_infos, tile_names, shape
+def _detect_from_ndarray(frame_rgb: np.ndarray, model: TehaiDetector, cropper: HandCropper | None = None):
+    if cropper is not None:
+        tile_infos, tile_names = cropper.detect(model, frame_rgb, conf=YOLO_CONF, iou=YOLO_IOU)
+    else:
+        tile_infos, tile_names = model.detect(frame_rgb, conf=YOLO_CONF, iou=YOLO_IOU)
+    return tile_infos, tile_names
 
 
 def _detect_from_ndarray_fallback(frame_rgb: np.ndarray, weights_path: str):
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-        Image.fromarray(frame_rgb).save(tmp.name)
-        img_path = tmp.name
-    tile_infos, tile_names = MYYOLO(model_path=weights_path, image_path=img_path)
-    shape = machi_hai_13(tile_names)
-    return tile_infos, tile_names, shape
+    # PIL 経由で渡せば ultralytics 側で RGB として正しく扱われる
+    tile_infos, tile_names = MYYOLO(model_path=weights_path, image_path=Image.fromarray(frame_rgb))
+    return tile_infos, tile_names
 
 
 def _draw_tile_row(
@@ -233,141 +226,38 @@ def _draw_tile_row(
     (target_container or st).markdown(html, unsafe_allow_html=True)
 
 
-class FrameGrabber:
-    def __init__(self, path: str, target_width: int, out_queue: queue.Queue):
-        self.path = path
-        self.target_width = target_width
-        self.q = out_queue
-        self.cap = None
-        self.stop_evt = threading.Event()
-        self.ready = threading.Event()
-        self.opened = False
-        self.last_frame = None
-
-    def start(self):
-        self.t = threading.Thread(target=self._run, daemon=True)
-        self.t.start()
-        return self
-
-    def _open_capture(self):
-        cap = cv2.VideoCapture(self.path, cv2.CAP_FFMPEG)
-        if not cap.isOpened():
-            cap = cv2.VideoCapture(self.path)
-        return cap
-
-    def _run(self):
-        self.cap = self._open_capture()
-        if not self.cap or not self.cap.isOpened():
-            self.opened = False
-            self.ready.set()
-            return
-        self.opened = True
-        self.ready.set()
-
-        while not self.stop_evt.is_set():
-            ok, frame_bgr = self.cap.read()
-            if not ok:
-                break
-            h, w = frame_bgr.shape[:2]
-            scale = self.target_width / max(1, w)
-            if scale != 1.0:
-                frame_bgr = cv2.resize(frame_bgr, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-            frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-            self.last_frame = frame_rgb
+def _make_analyzer(model: TehaiDetector, weights_path: str, crop: bool, stable_window: int = 1):
+    cropper = HandCropper() if crop else None
 
-            try:
-                while True:
-                    self.q.get_nowait()
-            except queue.Empty:
-                pass
-            try:
-                self.q.put_nowait(frame_rgb)
-            except queue.Full:
-                pass
-
-        if self.cap is not None:
-            try:
-                self.cap.release()
-            except Exception:
-                pass
-            self.cap = None
-
-    def stop(self):
-        self.stop_evt.set()
-        if hasattr(self, "t"):
-            self.t.join(timeout=1.0)
-
-
-class InferWorker:
-    def __init__(self, frame_q: queue.Queue, result_q: queue.Queue, weights_path: str, interval_ms: int):
-        self.frame_q = frame_q
-        self.result_q = result_q
-        self.weights_path = weights_path
-        self.interval = max(10, interval_ms) / 1000.0
-        self.stop_evt = threading.Event()
-        self.model = None
-
-    def start(self):
-        self.t = threading.Thread(target=self._run, daemon=True)
-        self.t.start()
-        return self
-
-    def _run(self):
-        last_t = 0.0
+    def detect(frame: np.ndarray):
         try:
-            self.model = _load_model(self.weights_path)
-        except Exception as e:
-            self._push_result({"error": f"モデル読み込みに失敗: {e}"})
-            return
-
-        while not self.stop_evt.is_set():
-            now = time.time()
-            if now - last_t < self.interval:
-                time.sleep(0.005)
-                continue
-            try:
-                frame = self.frame_q.get(timeout=0.05)
-            except queue.Empty:
-                continue
-            last_t = now
-            t0 = time.time()
-            try:
-                try:
-                    infos, names, shape = _detect_from_ndarray(frame, self.model)
-                except Exception:
-                    infos, names, shape = _detect_from_ndarray_fallback(frame, self.weights_path)
-                waits = [str(x).strip() for x in shape] if isinstance(shape, (list, tuple, set)) else []
-                infer_ms = int((time.time() - t0) * 1000)
-                self._push_result({
-                    "frame": frame,
-                    "infos": infos,
-                    "names": names,
-                    "waits": waits,
-                    "infer_ms": infer_ms,
-                })
-            except Exception as e:
-                self._push_result({"error": f"Infer error: {e}"})
+            return _detect_from_ndarray(frame, model, cropper)
+        except Exception:
+            return _detect_from_ndarray_fallback(frame, weights_path)
 
-    def _push_result(self, payload: dict) -> None:
-        while True:
-            try:
-                self.result_q.get_nowait()
-            except queue.Empty:
-                break
-        self.result_q.put(payload)
+    # 手牌の見た目が変わっていなければ検出を省き、直近のフレームで多数決した手牌が変わったときだけ待ちを求める
+    tracker = TileTracker(detect, waits=None)
+    stabilizer = HandStabilizer(window=stable_window, waits=IncrementalMachi())
+
+    def analyze(frame: np.ndarray) -> dict:
+        tracked = tracker.update(frame)
+        stable = stabilizer.update(tracked["infos"])
+        shape = stable["shape"]
+        waits = [str(x).strip() for x in shape] if isinstance(shape, (list, tuple, set)) else []
+        return {
+            "infos": stable["infos"],
+            "names": stable["names"],
+            "waits": waits,
+            "reused": tracked["reused"],
+            "changed": stable["changed"],
+        }
 
-    def stop(self):
-        self.stop_evt.set()
-        if hasattr(self, "t"):
-            self.t.join(timeout=1.0)
+    return analyze
 
 
 def _init_state(ss: dict) -> None:
     defaults = {
-        "grabber": None,
-        "inferer": None,
-        "frame_q": queue.Queue(maxsize=1),
-        "result_q": queue.Queue(maxsize=1),
+        "stream": None,
         "last_frame": None,
         "last_tiles": [],
         "last_infos": [],
@@ -380,7 +270,7 @@ def _init_state(ss: dict) -> None:
         "video_server": None,
         "video_server_root": None,
         "show_preview": False,
-        "mov_weights_tmp": None,
+        "mov_weights_key": None,
         "ui_video_path": None,
     }
     for key, value in defaults.items():
@@ -396,25 +286,23 @@ def _reset_results(ss: dict) -> None:
 
 
 def _stop_workers(ss: dict) -> None:
-    for key in ("inferer", "grabber"):
-        worker = ss.get(key)
-        if worker is None:
-            continue
-        try:
-            worker.stop()
-        except Exception:
-            pass
-        ss[key] = None
+    stream = ss.get("stream")
+    if stream is None:
+        return
+    try:
+        stream.stop()
+    except Exception:
+        pass
+    ss["stream"] = None
 
 
 def _resolve_weights(choice: str, weights_local_file, ss: dict) -> str:
     weights = str(DEFAULT_WEIGHTS)
     if choice == "local" and weights_local_file is not None:
-        if ss.get("mov_weights_tmp") is None:
-            with tempfile.NamedTemporaryFile(suffix=".pt", delete=False) as wtmp:
-                wtmp.write(weights_local_file.read())
-                ss["mov_weights_tmp"] = wtmp.name
-        weights = str(ss["mov_weights_tmp"])
+        # 覚えておける重みの数を超えて捨てられていたら、もう一度読み込む
+        if ss.get("mov_weights_key") is None or not has_detector(ss["mov_weights_key"]):
+            ss["mov_weights_key"] = get_detector_from_bytes(weights_local_file.getvalue()).model_path
+        weights = str(ss["mov_weights_key"])
     return weights
 
 
@@ -470,6 +358,18 @@ def render():
                 step=100,
                 help="再生の滑らかさ優先なら大きめに",
             )
+            stable_window = st.slider(
+                "多数決のフレーム数",
+                1,
+                10,
+                3,
+                help="直近のフレームで牌ごとに信頼度で多数決し、ちらつきを抑えます（1 で無効）",
+            )
+            crop_hand = st.checkbox(
+                "手牌の帯だけを解析",
+                value=True,
+                help="前フレームの牌の位置から帯を切り出して推論します（見失ったら全体を解析）",
+            )
 
         if not TILES_DIR.exists():
             st.warning(f"タイル画像フォルダが見つかりません: {TILES_DIR.resolve()}")
@@ -495,33 +395,44 @@ def render():
         if start and have_path:
             _stop_workers(ss)
             _reset_results(ss)
-            ss["frame_q"] = queue.Queue(maxsize=1)
-            ss["result_q"] = queue.Queue(maxsize=1)
-            ss["grabber"] = FrameGrabber(ss["ui_video_path"], target_width, ss["frame_q"]).start()
-            ss["grabber"].ready.wait(timeout=3.0)
-            if not ss["grabber"].opened:
-                st.error("動画を開けませんでした。パス/コーデック(FFmpeg)をご確認ください。")
-                ss["running"] = False
-            else:
-                ss["inferer"] = InferWorker(ss["frame_q"], ss["result_q"], weights_to_use, interval_ms=interval_ms).start()
-                ss["running"] = True
+            try:
+                model = _load_model(weights_to_use)
+            except Exception as e:
+                det_holder.error(f"モデル読み込みに失敗: {e}")
+                model = None
+            if model is not None:
+                # 画面表示用なので再生速度に合わせて読み、詰まったら古いフレームを捨てる
+                ss["stream"] = VideoStream(
+                    ss["ui_video_path"],
+                    _make_analyzer(model, weights_to_use, crop_hand, stable_window),
+                    queue_depth=1,
+                    interval_sec=interval_ms / 1000.0,
+                    policy=DROP,
+                    target_width=target_width,
+                    rgb=True,
+                    realtime=True,
+                    keep_frames=True,
+                ).start()
+                if not ss["stream"].opened:
+                    st.error("動画を開けませんでした。パス/コーデック(FFmpeg)をご確認ください。")
+                    _stop_workers(ss)
+                    ss["running"] = False
+                else:
+                    ss["running"] = True
 
         if stop and ss.get("running"):
             ss["running"] = False
             _stop_workers(ss)
 
-        try:
-            msg = ss["result_q"].get_nowait()
-        except queue.Empty:
-            msg = None
+        msg = ss["stream"].poll() if ss.get("stream") is not None else None
         if msg is not None:
             if "error" in msg:
                 det_holder.error(msg["error"])
             else:
                 ss["last_frame"] = msg["frame"]
-                ss["last_tiles"] = msg["names"]
-                ss["last_infos"] = msg["infos"]
-                ss["last_waits"] = msg["waits"]
+                ss["last_tiles"] = msg["result"]["names"]
+                ss["last_infos"] = msg["result"]["infos"]
+                ss["last_waits"] = msg["result"]["waits"]
                 ss["last_infer_ms"] = msg["infer_ms"]
 
         if ss.get("video_url"):
@@ -541,8 +452,8 @@ def render():
             value=ss["show_preview"],
         )
         frame = ss.get("last_frame")
-        if frame is None and ss.get("grabber") is not None:
-            frame = ss["grabber"].last_frame
+        if frame is None and ss.get("stream") is not None:
+            frame = ss["stream"].last_frame
         if ss["show_preview"]:
             if frame is not None:
                 preview_holder.image(frame, use_container_width=True)
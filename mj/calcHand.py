@@ -1,11 +1,58 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
 from mahjong.hand_calculating.hand import HandCalculator
+from mahjong.hand_calculating.scores import ScoresCalculator
 from mahjong.tile import TilesConverter
 from mahjong.hand_calculating.hand_config import HandConfig, OptionalRules
 from mahjong.meld import Meld
 from mahjong.constants import EAST, SOUTH, WEST, NORTH
 
+from mj.machi import machi_hai_13
+from mj.tiles import ids_to_136, names_to_ids
 from mj.utils import tiles_to_mahjong_array_strings
 
+
+# self_config が読む設定引数と既定値
+HAND_CONFIG_DEFAULTS = {
+    'is_tsumo': False,
+    'is_riichi': True,
+    'is_ippatsu': False,
+    'is_rinshan': False,
+    'is_chankan': False,
+    'is_haitei': False,
+    'is_houtei': False,
+    'is_daburu_riichi': False,
+    'is_nagashi_mangan': False,
+    'is_tenhou': False,
+    'is_renhou': False,
+    'is_chiihou': False,
+    'is_open_riichi': False,
+    'player_wind': EAST,
+    'round_wind': EAST,
+    'kyoutaku_number': 0,
+    'tsumi_number': 0,
+    'paarenchan': 0,
+}
+OPTIONAL_RULES_DEFAULTS = {
+    'has_open_tanyao': True,
+    'has_double_yakuman': False,
+    'kiriage': False,
+    'fu_for_open_pinfu': False,
+    'fu_for_pinfu_tsumo': False,
+    'renhou_as_yakuman': False,
+    'has_daisharin': False,
+    'has_daisharin_other_suits': False,
+    'has_sashikomi_yakuman': False,
+    'limit_to_sextuple_yakuman': False,
+    'paarenchan_needs_yaku': False,
+    'has_daichisei': False,
+}
+
 def analyze_hand(
     tiles: list[str], 
     win: str, 
@@ -40,47 +87,473 @@ def analyze_hand(
         win_136, 
         melds, 
         doras_136, 
-        self_config(has_aka=has_aka, **kwargs))
+        self_config(has_aka=has_aka, **kwargs),
+        scores_calculator_factory=TableScoresCalculator)
     
     return hand14, win, result
+
+
+# 点数表（翻・符・親/子・ツモ/ロンから点数を直接引く表）
+#
+# - 切り上げ満貫の有無・数え役満の扱い・役満かどうか・6倍役満の上限ごとに初回だけ作る
+#   （値は ScoresCalculator で求めるので HandCalculator の点数と必ず一致する）
+# - 4翻以下は符ごと、5翻以上は符によらないので同じ行を共有する
+# - 各マスは {(本場, 供託): 点数} の辞書で、0 本場・供託なしから始めて、
+#   出てきた本場・供託の組み合わせを 1本あたりの点数（HONBA_BONUS）から求めて書き足す
+SCORE_TABLE_MAX_HAN = 78
+SCORE_TABLE_MAX_FU = 110
+SCORE_TABLE_MAX_STICKS = 20
+# [is_tsumo] -> (main の1本場あたり, additional の1本場あたり)
+HONBA_BONUS = ((300, 0), (100, 100))
+_SCORE_TABLES: dict[tuple, list] = {}
+_SCORE_TABLES_LOCK = threading.Lock()
+
+
+def _build_score_table(kiriage: bool, kazoe_limit: int, is_yakuman: bool, sextuple: bool) -> list:
+    calculator = ScoresCalculator()
+    options = OptionalRules(kiriage=kiriage, kazoe_limit=kazoe_limit, limit_to_sextuple_yakuman=sextuple)
+    configs = [
+        HandConfig(is_tsumo=is_tsumo, player_wind=EAST if is_dealer else SOUTH, options=options)
+        for is_dealer in (False, True)
+        for is_tsumo in (False, True)
+    ]
+
+    def cell(han: int, fu: int) -> tuple:
+        return tuple({(0, 0): calculator.calculate_scores(han, fu, config, is_yakuman)} for config in configs)
+
+    width = SCORE_TABLE_MAX_FU // 5 + 1
+    table = []
+    for han in range(SCORE_TABLE_MAX_HAN + 1):
+        if han < 5:
+            table.append([cell(han, i * 5) if i % 2 == 0 or i == 5 else None for i in range(width)])
+        else:
+            table.append([cell(han, 30)] * width)
+    return table
+
+
+def score_table(
+    kiriage: bool = False,
+    kazoe_limit: int = HandConfig.KAZOE_LIMITED,
+    is_yakuman: bool = False,
+    sextuple: bool = False,
+) -> list:
+    '''
+    ルールごとの点数表を返す（初回だけ作って使い回す）
+
+    table[翻][符 // 5][親 * 2 + ツモ][(本場, 供託)] -> calculate_scores の dict（書き換えないこと）
+    ありえない符（35 符など）は None
+    '''
+    key = (kiriage, kazoe_limit, is_yakuman, sextuple)
+    table = _SCORE_TABLES.get(key)
+    if table is None:
+        with _SCORE_TABLES_LOCK:
+            table = _SCORE_TABLES.get(key)
+            if table is None:
+                table = _build_score_table(*key)
+                _SCORE_TABLES[key] = table
+    return table
+
+
+def _cell_cost(costs: dict, is_tsumo: bool, honba: int, kyoutaku: int) -> dict:
+    key = (honba, kyoutaku)
+    cost = costs.get(key)
+    if cost is None:
+        cost = costs[(0, 0)].copy()
+        main_per, additional_per = HONBA_BONUS[is_tsumo]
+        cost['main_bonus'] = main_per * honba
+        cost['additional_bonus'] = additional_per * honba
+        cost['kyoutaku_bonus'] = 1000 * kyoutaku
+        cost['total'] += cost['main_bonus'] + 2 * cost['additional_bonus'] + cost['kyoutaku_bonus']
+        if 0 <= honba <= SCORE_TABLE_MAX_STICKS and 0 <= kyoutaku <= SCORE_TABLE_MAX_STICKS:
+            costs[key] = cost
+        else:
+            return cost
+    # 結果の dict は呼び出し側が書き換えることがあるので複製を返す
+    return cost.copy()
+
+
+def lookup_cost(
+    han: int,
+    fu: int,
+    is_dealer: bool,
+    is_tsumo: bool,
+    honba: int = 0,
+    kyoutaku: int = 0,
+    kiriage: bool = False,
+    kazoe_limit: int = HandConfig.KAZOE_LIMITED,
+    is_yakuman: bool = False,
+    sextuple: bool = False,
+) -> dict | None:
+    '''
+    翻・符から点数を表引きで求める（ScoresCalculator.calculate_scores と同じ形の dict）
+    表の範囲外（SCORE_TABLE_MAX_HAN を超える翻、ありえない符）なら None
+
+    :param honba: int, 本場の数
+    :param kyoutaku: int, 供託（立直棒）の数
+    '''
+    if not 0 <= han <= SCORE_TABLE_MAX_HAN or not 0 <= fu <= SCORE_TABLE_MAX_FU or fu % 5:
+        return None
+    entry = score_table(kiriage, kazoe_limit, is_yakuman, sextuple)[han][fu // 5]
+    if entry is None:
+        return None
+    return _cell_cost(entry[is_dealer * 2 + is_tsumo], is_tsumo, honba, kyoutaku)
+
+
+class TableScoresCalculator(ScoresCalculator):
+    """
+    点数を表引きで求める ScoresCalculator（HandCalculator の scores_calculator_factory に渡す）
+    流し満貫や表の範囲外はライブラリの計算に任せる
+    """
+
+    def calculate_scores(self, han: int, fu: int, config: HandConfig, is_yakuman: bool = False) -> dict:
+        if han <= SCORE_TABLE_MAX_HAN and fu <= SCORE_TABLE_MAX_FU and not fu % 5 and not config.is_nagashi_mangan:
+            options = config.options
+            key = (options.kiriage, options.kazoe_limit, is_yakuman, options.limit_to_sextuple_yakuman)
+            table = _SCORE_TABLES.get(key) or score_table(*key)
+            entry = table[han][fu // 5]
+            if entry is not None:
+                costs = entry[config.is_dealer * 2 + config.is_tsumo]
+                cost = costs.get((config.tsumi_number, config.kyoutaku_number))
+                if cost is not None:
+                    return cost.copy()
+                return _cell_cost(costs, config.is_tsumo, config.tsumi_number, config.kyoutaku_number)
+        return super().calculate_scores(han, fu, config, is_yakuman)
+
+
+def benchmark_score_table(repeat: int = 20000) -> dict:
+    '''
+    翻・符・親/子・ツモ/ロン・本場・供託の組み合わせについて、ライブラリの計算と表引きの速さを比べる
+    （結果が一致しなければ AssertionError）
+
+    :return: dict, {'lookups': 件数, 'library_sec': 秒, 'table_sec': 秒, 'speedup': 倍率}
+    '''
+    cases = []
+    for han in (1, 2, 3, 4, 5, 7, 13, 26):
+        for fu in (20, 25, 30, 40, 70, 110):
+            for is_dealer in (False, True):
+                for is_tsumo in (False, True):
+                    cases.append((han, fu, is_dealer, is_tsumo, han % 3, han % 2))
+    configs = {
+        (is_dealer, is_tsumo, honba, kyoutaku): self_config(
+            has_aka=False,
+            player_wind=EAST if is_dealer else SOUTH,
+            is_tsumo=is_tsumo,
+            tsumi_number=honba,
+            kyoutaku_number=kyoutaku,
+        )
+        for _, _, is_dealer, is_tsumo, honba, kyoutaku in cases
+    }
+    cases = [(han, fu, configs[tuple(rest)]) for han, fu, *rest in cases]
+    library, table = ScoresCalculator(), TableScoresCalculator()
+    for han, fu, config in cases:
+        assert library.calculate_scores(han, fu, config) == table.calculate_scores(han, fu, config)
+    loops = max(1, repeat // len(cases))
+
+    def run(calculator) -> float:
+        start = time.perf_counter()
+        for _ in range(loops):
+            for han, fu, config in cases:
+                calculator.calculate_scores(han, fu, config)
+        return time.perf_counter() - start
+
+    library_sec, table_sec = run(library), run(table)
+    return {
+        'lookups': loops * len(cases),
+        'library_sec': library_sec,
+        'table_sec': table_sec,
+        'speedup': library_sec / table_sec if table_sec > 0 else 0.0,
+    }
+
     
+class HandValueCache:
+    """
+    手牌の正規化キー → HandResponse の LRU キャッシュ（件数上限つき、スレッドセーフ）
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """
+        get と同じ値を返すが、ヒット・ミスの件数や使われた順は変えない（もう一度確かめるとき用）
+        """
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+HAND_VALUE_CACHE = HandValueCache()
+
+def hand_key(
+    tiles: list[str],
+    win: str,
+    melds: list[Meld],
+    doras: list[str],
+    has_aka: bool = False,
+    **kwargs
+) -> tuple:
+    """
+    手牌・副露・アガリ牌・ドラ・設定を並び順に依存しない形にまとめたキー
+    （手牌やドラの並び順は計算結果に影響しない）
+    """
+    meld_key = tuple(sorted(
+        (m.type, tuple(sorted(m.tiles)), bool(m.opened)) for m in (melds or [])
+    ))
+    return (
+        tuple(sorted(tiles)),
+        win,
+        meld_key,
+        tuple(sorted(doras)),
+        config_key(has_aka, **kwargs),
+    )
+
+def analyze_hand_cached(
+    tiles: list[str],
+    win: str,
+    melds: list[Meld],
+    doras: list[str],
+    has_aka: bool = False,
+    cache: HandValueCache | None = None,
+    **kwargs
+):
+    """
+    analyze_hand の前段に LRU キャッシュを挟んだもの（引数・戻り値は analyze_hand と同じ）
+    """
+    cache = HAND_VALUE_CACHE if cache is None else cache
+    key = hand_key(tiles, win, melds, doras, has_aka, **kwargs)
+    result = cache.get(key)
+    if result is None:
+        _, _, result = analyze_hand(tiles, win, melds, doras, has_aka, **kwargs)
+        cache.put(key, result)
+    hand14 = tiles_to_mahjong_array_strings(tiles, [win], need_aka=True)
+    return hand14, win, result
+
 def self_config(has_aka, **kwargs):
     """
     手牌の設定引数を整理して返す
     """
     return HandConfig(
-        is_tsumo=kwargs.get('is_tsumo', False),
-        is_riichi=kwargs.get('is_riichi', True),
-        is_ippatsu=kwargs.get('is_ippatsu', False),
-        is_rinshan=kwargs.get('is_rinshan', False),
-        is_chankan=kwargs.get('is_chankan', False),
-        is_haitei=kwargs.get('is_haitei', False),
-        is_houtei=kwargs.get('is_houtei', False),
-        is_daburu_riichi=kwargs.get('is_daburu_riichi', False),
-        is_nagashi_mangan=kwargs.get('is_nagashi_mangan', False),
-        is_tenhou=kwargs.get('is_tenhou', False),
-        is_renhou=kwargs.get('is_renhou', False),
-        is_chiihou=kwargs.get('is_chiihou', False),
-        is_open_riichi=kwargs.get('is_open_riichi', False),
-        player_wind=kwargs.get('player_wind', EAST),
-        round_wind=kwargs.get('round_wind', EAST),
-        kyoutaku_number=kwargs.get('kyoutaku_number', 0),
-        tsumi_number=kwargs.get('tsumi_number', 0),
-        paarenchan=kwargs.get('paarenchan', 0),
+        **{k: kwargs.get(k, v) for k, v in HAND_CONFIG_DEFAULTS.items()},
         options=OptionalRules(
-            has_open_tanyao=kwargs.get('has_open_tanyao', True),
             has_aka_dora=has_aka,
-            has_double_yakuman=kwargs.get('has_double_yakuman', False),
             kazoe_limit=HandConfig.KAZOE_LIMITED,
-            kiriage=kwargs.get('kiriage', False),
-            fu_for_open_pinfu=kwargs.get('fu_for_open_pinfu', False),
-            fu_for_pinfu_tsumo=kwargs.get('fu_for_pinfu_tsumo', False),
-            renhou_as_yakuman=kwargs.get('renhou_as_yakuman', False),
-            has_daisharin=kwargs.get('has_daisharin', False),
-            has_daisharin_other_suits=kwargs.get('has_daisharin_other_suits', False),
-            has_sashikomi_yakuman=kwargs.get('has_sashikomi_yakuman', False),
-            limit_to_sextuple_yakuman=kwargs.get('limit_to_sextuple_yakuman', False),
-            paarenchan_needs_yaku=kwargs.get('paarenchan_needs_yaku', False),
-            has_daichisei=kwargs.get('has_daichisei', False),
+            **{k: kwargs.get(k, v) for k, v in OPTIONAL_RULES_DEFAULTS.items()},
         )
     )
+
+def config_key(has_aka, **kwargs) -> tuple:
+    """
+    self_config が参照する設定値だけを既定値で補って並べたもの（キャッシュのキー用）
+    """
+    return (
+        has_aka,
+        *(kwargs.get(k, v) for k, v in HAND_CONFIG_DEFAULTS.items()),
+        *(kwargs.get(k, v) for k, v in OPTIONAL_RULES_DEFAULTS.items()),
+    )
+
+def tiles_to_136(tiles: list[str], has_aka: bool = False) -> list[int]:
+    """
+    牌の名前のリストを文字列を経由せずに136配列に変換する（mj.tiles.ids_to_136 を参照）
+    """
+    return ids_to_136(names_to_ids(tiles), has_aka=has_aka)
+
+
+# スレッドごとに使い回す計算器と設定
+# （HandCalculator は計算のたびに .config を差し替え、config.yaku のドラ・赤ドラの翻数を書き換えるので、
+#   スレッドをまたいで共有すると同時に呼ばれたときに結果が混ざる）
+_LOCAL = threading.local()
+
+
+def _shared_calculator() -> HandCalculator:
+    calculator = getattr(_LOCAL, "calculator", None)
+    if calculator is None:
+        calculator = _LOCAL.calculator = HandCalculator()
+    return calculator
+
+
+def shared_config(has_aka: bool, **kwargs) -> HandConfig:
+    """
+    同じ設定引数なら同じ HandConfig を返す（self_config の使い回し版。スレッドごとに別のものを返す）
+    """
+    configs = getattr(_LOCAL, "configs", None)
+    if configs is None:
+        configs = _LOCAL.configs = {}
+    key = config_key(has_aka, **kwargs)
+    config = configs.get(key)
+    if config is None:
+        config = self_config(has_aka=has_aka, **kwargs)
+        configs[key] = config
+    return config
+
+
+def _detach_yaku(result, config: HandConfig):
+    """
+    HandCalculator は config.yaku のドラ・赤ドラの翻数を計算ごとに書き換えるので、
+    設定を使い回す場合は結果側にその時点の値を複製しておく
+    """
+    if getattr(result, "yaku", None):
+        shared = (config.yaku.dora, config.yaku.aka_dora)
+        result.yaku = [copy.copy(y) if any(y is s for s in shared) else y for y in result.yaku]
+    return result
+
+
+def analyze_hand_fast(
+    tiles: list[str],
+    win: str,
+    melds: list[Meld],
+    doras: list[str],
+    has_aka: bool = False,
+    **kwargs
+):
+    """
+    analyze_hand と同じ計算を、計算器・設定を使い回し文字列変換を省いて行う
+    戻り値は HandResponse のみ
+    """
+    hand14_136 = tiles_to_136([*tiles, win], has_aka=has_aka)
+    win_136 = tiles_to_136([win], has_aka=has_aka)[0]
+    doras_136 = [tiles_to_136([dora], has_aka=has_aka)[0] for dora in doras]
+    config = shared_config(has_aka=has_aka, **kwargs)
+    result = _shared_calculator().estimate_hand_value(
+        hand14_136,
+        win_136,
+        melds,
+        doras_136,
+        config,
+        scores_calculator_factory=TableScoresCalculator)
+    return _detach_yaku(result, config)
+
+
+def analyze_all_waits(
+    tiles: list[str],
+    melds: list[Meld],
+    doras: list[str],
+    has_aka: bool = False,
+    cache: HandValueCache | None = None,
+    **kwargs
+):
+    """
+    13枚の手牌の待ちを一度だけ求め、全ての待ち牌についてロン・ツモ両方の結果をまとめて返す
+    同じアガリ形のロンとツモでは手牌の分解結果を共有する（is_tsumo の指定は無視）
+
+    :return: tuple
+        - list[str] or str: machi_hai_13 と同じ
+        - dict[str, dict[str, HandResponse]]: {待ち牌: {'ron': HandResponse, 'tsumo': HandResponse}}
+    """
+    shape = machi_hai_13(tiles)
+    table: dict[str, dict] = {}
+    if isinstance(shape, str):
+        return shape, table
+
+    cache = HAND_VALUE_CACHE if cache is None else cache
+    kwargs.pop('is_tsumo', None)
+    # 分解結果のキャッシュはこの呼び出しの中だけで使う
+    calculator = HandCalculator()
+    doras_136 = [tiles_to_136([dora], has_aka=has_aka)[0] for dora in doras]
+    for wait in shape:
+        hand14_136 = tiles_to_136([*tiles, wait], has_aka=has_aka)
+        win_136 = tiles_to_136([wait], has_aka=has_aka)[0]
+        table[wait] = {}
+        for label, is_tsumo in (('ron', False), ('tsumo', True)):
+            key = hand_key(tiles, wait, melds, doras, has_aka, is_tsumo=is_tsumo, **kwargs)
+            result = cache.get(key)
+            if result is None:
+                config = shared_config(has_aka=has_aka, is_tsumo=is_tsumo, **kwargs)
+                result = calculator.estimate_hand_value(
+                    hand14_136,
+                    win_136,
+                    melds,
+                    doras_136,
+                    config,
+                    scores_calculator_factory=TableScoresCalculator,
+                    use_hand_divider_cache=True)
+                result = _detach_yaku(result, config)
+                cache.put(key, result)
+            table[wait][label] = result
+    return shape, table
+
+
+def _analyze_chunk(hands: list[dict]) -> list:
+    return [analyze_hand_fast(**hand) for hand in hands]
+
+
+def analyze_hands_batch(
+    hands: Iterable[dict],
+    processes: int | None = 0,
+    chunksize: int = 512,
+):
+    """
+    複数の手牌をまとめて分析する
+
+    :param hands: Iterable[dict], analyze_hand の引数（tiles, win, melds, doras, has_aka, その他設定）の辞書
+    :param processes: int | None, プロセス数（0 ならこのプロセスで計算、None なら CPU 数）
+    :param chunksize: int, ワーカーへ渡す1回あたりの手牌数
+
+    :return: tuple
+        - list[HandResponse]: 入力順の分析結果
+        - dict: {'hands': 件数, 'seconds': 経過秒, 'hands_per_sec': 処理速度}
+    """
+    start = time.perf_counter()
+    hands = list(hands)
+    if processes == 0 or len(hands) <= chunksize:
+        results = _analyze_chunk(hands)
+    else:
+        chunks = [hands[i:i + chunksize] for i in range(0, len(hands), chunksize)]
+        results = []
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for part in pool.map(_analyze_chunk, chunks):
+                results.extend(part)
+    seconds = time.perf_counter() - start
+    stats = {
+        'hands': len(results),
+        'seconds': seconds,
+        'hands_per_sec': len(results) / seconds if seconds > 0 else 0.0,
+    }
+    return results, stats
+
+
+if __name__ == "__main__":
+    # python -m mj.calcHand で点数表とライブラリの計算の速さを比べる
+    bench = benchmark_score_table(200000)
+    print(
+        f"点数表: {bench['lookups']}回 ライブラリ {bench['library_sec']:.3f}秒 / "
+        f"表引き {bench['table_sec']:.3f}秒 ({bench['speedup']:.2f}倍)"
+    )
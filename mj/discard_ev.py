@@ -0,0 +1,253 @@
+"""打牌ごとの和了率と期待打点をモンテカルロ法で見積もる（一人麻雀のシミュレーション）
+
+    python -m mj.discard_ev 1m 2m 3m 5m 0m 7p 8p 3s 4s 6s to to hk 9p --visible 9s 1m --dora-indicators 1m --budget 2
+
+- 打牌後の13枚から、見えていない牌の山を無作為に turns 回ツモる続きを何度も試す
+- ツモ牌が有効牌なら受け入れ最大の打牌（mj.ukeire.greedy_discard）、そうでなければツモ切り
+- 和了したら mj.calcHand.analyze_hand_cached でツモ和了の点数を求める（和了できなければ 0 点）
+- 試行は「候補ごとに batch 回ずつのブロック」に分け、1周で各候補 blocks_per_round 個のブロックを
+  プロセスに振り分ける（候補×ブロックがプロセス数より多ければコア数に比例して速くなる）
+- 1周ごとに集計し、最良の候補と期待打点に有意な差（z 値）がついた候補は打ち切る。
+  残りが1つになる（順位が決まる）か、時間・試行回数の上限に達したら終わる
+- 乱数の種はブロックの番号から決め、打ち切りの判定も周の区切りだけで行うので、
+  同じ周回数なら結果はプロセス数によらない（時間の上限で周回数が変わることはある）
+"""
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+from mj.calcHand import analyze_hand_cached
+from mj.machi import INDEX_TO_TILE
+from mj.tiles import BASE34, NAME_TO_ID, names_to_34
+from mj.ukeire import cached_waits, discard_table, greedy_discard, visible_to_34
+
+
+def _tile_names(hand_34: list[int], reds: tuple[str, ...]) -> list[str]:
+    names = [INDEX_TO_TILE[i] for i, c in enumerate(hand_34) for _ in range(c)]
+    # 赤5は同じ色の5が手に残っている間は持っているものとみなす
+    for red in reds:
+        base = INDEX_TO_TILE[BASE34[NAME_TO_ID[red]]]
+        if base in names:
+            names[names.index(base)] = red
+    return names
+
+
+def _simulate_block(task: tuple) -> tuple[int, int, int, float, float]:
+    '''
+    1つの候補について batch 回の続きを試し、(候補, 試行数, 和了数, 点数の和, 点数の二乗和) を返す
+    '''
+    cand, block, hand_13, reds, wall, visible_34, turns, batch, seed, dora_indicators, config = task
+    rng = random.Random(f"{seed}:{cand}:{block}")
+    turns = min(turns, len(wall))
+    start_shanten, start_accepts = cached_waits(tuple(hand_13))
+    wins, total, total_sq = 0, 0.0, 0.0
+    for _ in range(batch):
+        hand = list(hand_13)
+        seen = list(visible_34)
+        shanten, accepts = start_shanten, start_accepts
+        for t in rng.sample(wall, turns):
+            if t not in accepts:
+                seen[t] += 1
+                continue
+            hand[t] += 1
+            if shanten == 0:
+                win_hand = list(hand)
+                win_hand[t] -= 1
+                _, _, result = analyze_hand_cached(
+                    tiles=_tile_names(win_hand, reds),
+                    win=INDEX_TO_TILE[t],
+                    melds=[],
+                    doras=dora_indicators,
+                    is_tsumo=True,
+                    **config,
+                )
+                if result.error is None and result.cost:
+                    wins += 1
+                    points = result.cost['total']
+                    total += points
+                    total_sq += points * points
+                break
+            d = greedy_discard(hand, seen)
+            hand[d] -= 1
+            seen[d] += 1
+            shanten, accepts = cached_waits(tuple(hand))
+    return cand, batch, wins, total, total_sq
+
+
+def _summary(stats: dict) -> dict:
+    n = stats['samples']
+    ev = stats['total'] / n if n else 0.0
+    var = max(0.0, stats['total_sq'] / n - ev * ev) if n else 0.0
+    return {
+        'discard': stats['discard'],
+        'samples': n,
+        'win_rate': stats['wins'] / n if n else 0.0,
+        'ev': ev,
+        'ev_se': math.sqrt(var / n) if n else 0.0,
+        'active': stats['active'],
+    }
+
+
+def evaluate_discards(
+    hand: list[str],
+    visible: Iterable[str] | None = None,
+    dora_indicators: list[str] | None = None,
+    turns: int = 12,
+    time_budget: float = 2.0,
+    batch: int = 64,
+    blocks_per_round: int = 8,
+    max_samples: int = 20000,
+    z: float = 2.58,
+    candidates: int = 5,
+    seed: int = 0,
+    processes: int | None = 0,
+    **config,
+) -> dict:
+    '''
+    打牌の候補ごとに和了率と期待打点（ツモ和了のみ、和了できなければ 0 点）を見積もる
+
+    :param hand: list[str], 14枚（3n+2枚）の手牌の名前のリスト
+    :param visible: Iterable[str] | None, 場に見えている牌の名前（山から除く）
+    :param dora_indicators: list[str] | None, ドラ表示牌（analyze_hand の doras と同じく表示牌を渡す。
+        表示牌も見えている牌なので visible にも含める）
+    :param turns: int, 1回の続きでツモる回数
+    :param time_budget: float, 使ってよい秒数（1周ぶん足りなくなりそうなら次の周を始めない）
+    :param batch: int, 1ブロックの試行回数
+    :param blocks_per_round: int, 1周で各候補に割り当てるブロック数（打ち切りの判定の間隔）
+    :param max_samples: int, 1候補あたりの試行回数の上限
+    :param z: float, 最良の候補と期待打点の差がこの z 値を超えたら打ち切る
+    :param candidates: int, シミュレーションする候補の数（discard_table の上位から）
+    :param seed: int, 乱数の種
+    :param processes: int | None, プロセス数（0 ならこのプロセスで計算、None なら CPU 数）
+    :param config: analyze_hand の設定引数（is_riichi, player_wind, round_wind, has_aka など）
+
+    :return: dict
+        - 'candidates': list[dict], 期待打点の高い順（discard, samples, win_rate, ev, ev_se, active）
+        - 'settled': bool, 最良の候補以外をすべて打ち切れたか
+        - 'samples': int, 全候補の試行回数の合計
+        - 'rounds': int, 周回数
+        - 'seconds': float, 経過秒
+    '''
+    start = time.perf_counter()
+    tiles_34 = names_to_34(hand)
+    visible_34 = visible_to_34(visible)
+    seen = [min(4, a + b) for a, b in zip(tiles_34, visible_34)]
+    wall = tuple(i for i in range(34) for _ in range(4 - seen[i]))
+    dora_indicators = list(dora_indicators or [])
+    config.setdefault('has_aka', any(t.startswith('0') for t in hand))
+
+    # 受け入れの上位から、同じ牌（5 と赤5）を除いて候補を選ぶ
+    stats: dict[int, dict] = {}
+    for row in discard_table(hand, visible, second=0):
+        idx = BASE34[NAME_TO_ID[row['discard']]]
+        if idx in stats:
+            continue
+        if len(stats) >= candidates:
+            break
+        hand_13 = list(tiles_34)
+        hand_13[idx] -= 1
+        reds = list(t for t in hand if t.startswith('0'))
+        if row['discard'] in reds:
+            reds.remove(row['discard'])
+        # 切った牌も見えている牌に数える
+        seen_after = list(visible_34)
+        seen_after[idx] += 1
+        stats[idx] = {
+            'discard': row['discard'], 'hand': tuple(hand_13), 'reds': tuple(reds), 'visible': tuple(seen_after),
+            'samples': 0, 'wins': 0, 'total': 0.0, 'total_sq': 0.0, 'blocks': 0, 'active': True,
+        }
+
+    workers = (os.cpu_count() or 1) if processes is None else max(1, processes)
+    executor = ProcessPoolExecutor(max_workers=workers) if processes != 0 else None
+    # 候補が1つでも、見積もりを返すために少なくとも1周はシミュレーションする
+    rounds, settled, last_round = 0, False, 0.0
+    try:
+        while not settled:
+            active = [idx for idx, s in stats.items() if s['active'] and s['samples'] < max_samples]
+            elapsed = time.perf_counter() - start
+            if not active or (rounds and elapsed + last_round > time_budget):
+                break
+            round_start = time.perf_counter()
+            tasks = []
+            for idx in active:
+                s = stats[idx]
+                for _ in range(blocks_per_round):
+                    tasks.append((
+                        idx, s['blocks'], s['hand'], s['reds'], wall, s['visible'],
+                        turns, batch, seed, dora_indicators, config,
+                    ))
+                    s['blocks'] += 1
+            results = executor.map(_simulate_block, tasks) if executor else map(_simulate_block, tasks)
+            for idx, n, wins, total, total_sq in results:
+                s = stats[idx]
+                s['samples'] += n
+                s['wins'] += wins
+                s['total'] += total
+                s['total_sq'] += total_sq
+            rounds += 1
+            last_round = time.perf_counter() - round_start
+
+            # 最良の候補と有意に差がついた候補を打ち切る
+            summaries = {idx: _summary(s) for idx, s in stats.items() if s['active']}
+            best = max(summaries.values(), key=lambda r: (r['ev'], r['win_rate']))
+            for idx, r in summaries.items():
+                if r is best:
+                    continue
+                se = math.hypot(best['ev_se'], r['ev_se'])
+                if se and (best['ev'] - r['ev']) / se > z:
+                    stats[idx]['active'] = False
+            settled = sum(s['active'] for s in stats.values()) <= 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    table = sorted((_summary(s) for s in stats.values()), key=lambda r: (-r['ev'], -r['win_rate']))
+    return {
+        'candidates': table,
+        'settled': settled,
+        'samples': sum(s['samples'] for s in stats.values()),
+        'rounds': rounds,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="打牌ごとの和了率と期待打点をモンテカルロ法で見積もる")
+    parser.add_argument("hand", nargs="+", help="14枚の手牌（字牌は to/na/sh/pe/hk/ht/ty）")
+    parser.add_argument("--visible", nargs="*", default=[], help="場に見えている牌")
+    parser.add_argument("--dora-indicators", nargs="*", default=[], help="ドラ表示牌（--visible にも含める）")
+    parser.add_argument("--turns", type=int, default=12, help="1回の続きでツモる回数")
+    parser.add_argument("--budget", type=float, default=2.0, help="使ってよい秒数")
+    parser.add_argument("--max-samples", type=int, default=20000, help="1候補あたりの試行回数の上限")
+    parser.add_argument("--processes", type=int, default=None, help="プロセス数（0 はこのプロセスだけ、既定は CPU 数）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-riichi", action="store_true", help="立直なしで点数を数える")
+    args = parser.parse_args(argv)
+
+    out = evaluate_discards(
+        args.hand,
+        visible=args.visible,
+        dora_indicators=args.dora_indicators,
+        turns=args.turns,
+        time_budget=args.budget,
+        max_samples=args.max_samples,
+        processes=args.processes,
+        seed=args.seed,
+        is_riichi=not args.no_riichi,
+    )
+    for r in out['candidates']:
+        mark = "" if r['active'] else "（打ち切り）"
+        print(
+            f"打 {r['discard']}: 和了率 {r['win_rate']:.1%} 期待打点 {r['ev']:.0f}±{r['ev_se']:.0f} "
+            f"({r['samples']}回){mark}"
+        )
+    state = "順位確定" if out['settled'] else "時間切れ"
+    print(f"{state}: {out['samples']}回 / {out['rounds']}周 / {out['seconds']:.2f}秒")
+
+
+if __name__ == "__main__":
+    main()
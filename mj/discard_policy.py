@@ -1,34 +1,60 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from mj.models.tehai.myyolo import MYYOLO
- 
-model_name = "openai/gpt-oss-20b"
-
-_, tiles = MYYOLO(
-    model_path='best.pt',
-    image_path='agari.png',)
- 
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    torch_dtype="auto",
-    device_map="mps"
-)
- 
-messages = [
-    {"role": "user", "content": f"麻雀において最短で和了を目指す場合、手牌 {tiles} のうちどれを切ればよいでしょうか？"},
-]
-
-inputs = tokenizer.apply_chat_template(
-    messages,
-    add_generation_prompt=True,
-    return_tensors="pt",
-    return_dict=True,
-).to(model.device)
- 
-outputs = model.generate(
-    **inputs,
-    max_new_tokens=200,
-    temperature=0.8
-)
- 
-print(tokenizer.decode(outputs[0]))
\ No newline at end of file
+"""手牌の画像から何を切るかを牌効率（受け入れ枚数）で決める
+
+    python -m mj.discard_policy --image agari.png --visible 1m 9s to
+
+- 既定では mj.ukeire.discard_table で決定的に求める（CPU でミリ秒単位）
+- --llm を付けたときだけ LLM にも尋ねる（mj.llm_advisor。既定の openai/gpt-oss-20b は読み込みに数分、
+  メモリを数十GB使う。--backend ukeire ならモデルを読み込まない代役で答える）
+"""
+import argparse
+
+from mj.llm_advisor import BACKENDS, MODEL_NAME, get_advisor
+from mj.machi import machi_hai_13_ukeire
+from mj.ukeire import discard_table
+
+
+def format_table(table: list[dict], top: int = 5) -> str:
+    lines = []
+    for c in table[:top]:
+        tiles = " ".join(f"{name}({n})" for name, n in c['tiles'].items())
+        second = "" if c['ukeire2'] is None else f" 二次 {c['ukeire2']}"
+        lines.append(f"打 {c['discard']}: {c['shanten']}向聴 受け入れ {c['ukeire']}枚{second} [{tiles}]")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="手牌の画像から牌効率で切る牌を決める")
+    parser.add_argument("--weights", default="best.pt")
+    parser.add_argument("--image", default="agari.png")
+    parser.add_argument("--visible", nargs="*", default=[], help="場に見えている牌（河・ドラ表示牌・他家の鳴き）")
+    parser.add_argument("--top", type=int, default=5, help="表示する候補の数")
+    parser.add_argument("--llm", action="store_true", help="LLM にも尋ねる")
+    parser.add_argument("--backend", choices=tuple(BACKENDS), default="transformers", help="--llm で使うバックエンド")
+    parser.add_argument("--model", default=MODEL_NAME, help="transformers バックエンドのモデル")
+    parser.add_argument("--device", default=None, help="transformers バックエンドの device（既定は自動）")
+    parser.add_argument("--sample", action="store_true", help="サンプリングして生成する（既定は決定的）")
+    args = parser.parse_args(argv)
+
+    from mj.models.tehai.myyolo import MYYOLO
+
+    _, tiles = MYYOLO(
+        model_path=args.weights,
+        image_path=args.image,)
+    print(f"手牌: {tiles}")
+
+    if len(tiles) % 3 == 2:
+        print(format_table(discard_table(tiles, args.visible), args.top))
+    else:
+        # 打牌前でなければ待ち（または有効牌）を示す
+        shape, ukeire = machi_hai_13_ukeire(tiles)
+        print(f"{shape} {ukeire}")
+
+    if args.llm:
+        options = {}
+        if args.backend == "transformers":
+            options = {"model_name": args.model, "device": args.device, "do_sample": args.sample}
+        print(get_advisor(args.backend, **options).ask(tiles))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+from itertools import chain
+from typing import Sequence
+
+import numpy as np
+
+from mj.tiles import BASE34, NAME_TO_ID, N_TILE_IDS, RED_IDS, TILE_NAMES
+
+# 大量の手牌を (N, 34) の uint8 行列でまとめて扱うための関数群
+#
+# - counts: (N, 34) uint8, 各手牌の34種ごとの枚数（赤5は5に含める）
+# - reds  : (N, 3)  uint8, 各手牌の赤5（0s, 0p, 0m）の枚数
+# - 知らない牌の名前は invalid (N,) bool に記録して枚数からは除く
+
+_BASE34 = np.asarray(BASE34, dtype=np.intp)
+
+
+def _ids_from_names(flat: list[str]) -> np.ndarray:
+    '''
+    牌の名前の一次元リストを牌IDの配列に変換する（知らない名前は -1）
+    '''
+    if not flat:
+        return np.empty(0, dtype=np.intp)
+    uniq, inverse = np.unique(np.asarray(flat), return_inverse=True)
+    lut = np.fromiter((NAME_TO_ID.get(str(u), -1) for u in uniq), dtype=np.intp, count=len(uniq))
+    return lut[inverse.reshape(-1)]
+
+
+def _matrix_from_flat(ids: np.ndarray, rows: np.ndarray, n: int):
+    valid = ids >= 0
+    invalid = np.zeros(n, dtype=bool)
+    invalid[rows[~valid]] = True
+    full = np.bincount(
+        rows[valid] * N_TILE_IDS + ids[valid],
+        minlength=n * N_TILE_IDS,
+    ).reshape(n, N_TILE_IDS)
+    counts = full[:, :34].copy()
+    # 赤5の列を対応する5の列に足し込む
+    counts[:, _BASE34[list(RED_IDS)]] += full[:, 34:]
+    reds = full[:, 34:]
+    return (
+        np.minimum(counts, 255).astype(np.uint8),
+        np.minimum(reds, 255).astype(np.uint8),
+        invalid,
+    )
+
+
+def names_to_matrix(hands: Sequence[Sequence[str]]):
+    '''
+    牌の名前のリスト（MYYOLO の tile_names など）の列をまとめて枚数行列に変換する
+
+    :param hands: Sequence[Sequence[str]], 手牌ごとの牌の名前のリスト
+
+    :return: tuple
+        - np.ndarray: (N, 34) uint8, 枚数
+        - np.ndarray: (N, 3) uint8, 赤5の枚数
+        - np.ndarray: (N,) bool, 知らない牌の名前を含むか
+    '''
+    n = len(hands)
+    lengths = np.fromiter((len(h) for h in hands), dtype=np.intp, count=n)
+    rows = np.repeat(np.arange(n, dtype=np.intp), lengths)
+    ids = _ids_from_names(list(chain.from_iterable(hands)))
+    return _matrix_from_flat(ids, rows, n)
+
+
+def ids_to_matrix(hands: Sequence[Sequence[int]]):
+    '''
+    牌IDのリストの列をまとめて枚数行列に変換する（戻り値は names_to_matrix と同じ）
+    '''
+    n = len(hands)
+    lengths = np.fromiter((len(h) for h in hands), dtype=np.intp, count=n)
+    rows = np.repeat(np.arange(n, dtype=np.intp), lengths)
+    ids = np.fromiter(chain.from_iterable(hands), dtype=np.intp, count=int(lengths.sum()))
+    ids = np.where((ids >= 0) & (ids < N_TILE_IDS), ids, -1)
+    return _matrix_from_flat(ids, rows, n)
+
+
+def tile_overflow(counts: np.ndarray) -> np.ndarray:
+    '''
+    5枚以上ある牌を含む手牌のマスク (N,)
+    '''
+    return (counts > 4).any(axis=1)
+
+
+def red_overflow(reds: np.ndarray) -> np.ndarray:
+    '''
+    同じ赤5が2枚以上ある手牌のマスク (N,)
+    '''
+    return (reds > 1).any(axis=1)
+
+
+def validate_matrix(counts: np.ndarray, reds: np.ndarray, invalid: np.ndarray | None = None) -> list[str | None]:
+    '''
+    /analysis/hand と同じ検査をまとめて行い、手牌ごとのエラー文（問題なければ None）を返す
+    '''
+    errors: list[str | None] = [None] * len(counts)
+    tile_bad = tile_overflow(counts)
+    red_bad = red_overflow(reds)
+    bad_rows = tile_bad | red_bad
+    if invalid is not None:
+        bad_rows &= ~invalid
+        for i in np.flatnonzero(invalid):
+            errors[i] = "invalid tile"
+    tile_first = np.argmax(counts > 4, axis=1)
+    red_first = np.argmax(reds > 1, axis=1)
+    for i in np.flatnonzero(bad_rows):
+        if tile_bad[i]:
+            base = tile_first[i]
+            errors[i] = f"tile overflow: {TILE_NAMES[base]} x{counts[i, base]}"
+        else:
+            red = red_first[i]
+            errors[i] = f"red overflow: {TILE_NAMES[RED_IDS[red]]} x{reds[i, red]}"
+    return errors
@@ -0,0 +1,220 @@
+"""LLM に何を切るかを尋ねる助言役（discard_policy --llm から使う）
+
+- モデルは最初に尋ねたときに読み込み、get_advisor で同じ設定の助言役を1つだけ作って使い回す
+- 答えは手牌を並べ替えた形（canonical_hand）をキーに覚えておき、同じ手牌には計算せずに返す
+- ask_batch は覚えていない手牌だけをまとめてプロンプトにし、batch_size ずつ一度に生成する
+- バックエンドは差し替えられる
+    - transformers: Hugging Face のモデル（既定は openai/gpt-oss-20b。device は cuda → mps → cpu の順に自動で選ぶ）
+    - ukeire      : モデルを使わず mj.ukeire の結果を文章にして返す、テスト用の小さな代役
+- 既定では貪欲法で生成する（do_sample=False）ので同じ手牌には同じ答えを返す
+"""
+import threading
+from typing import Callable, Iterable
+
+from mj.calcHand import HandValueCache
+from mj.machi import machi_hai_13_ukeire
+from mj.tiles import BASE34, NAME_TO_ID
+from mj.ukeire import recommend_discard
+
+MODEL_NAME = "openai/gpt-oss-20b"
+PROMPT = "麻雀において最短で和了を目指す場合、手牌 {tiles} のうちどれを切ればよいでしょうか？"
+
+
+def canonical_hand(tiles: Iterable[str]) -> tuple[str, ...]:
+    '''
+    牌の並び順によらないキー（34配列の順、5 の次に赤5。知らない名前は最後）
+    '''
+    def order(name: str):
+        tile = NAME_TO_ID.get(name)
+        return (0, BASE34[tile], tile, name) if tile is not None else (1, 0, 0, name)
+
+    return tuple(sorted((t for t in tiles if t), key=order))
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _default_device() -> str:
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+class TransformersBackend:
+    """Hugging Face の因果言語モデルで答えるバックエンド（最初の generate で読み込む）
+
+    Args:
+        model_name (str, optional): モデル名またはパス（テストでは小さなモデルを渡せる）
+        device (str, optional): "cuda" / "mps" / "cpu"（None なら自動で選ぶ）
+        max_new_tokens (int, optional): 1件あたりの生成トークン数の上限
+        do_sample (bool, optional): サンプリングするか（False なら貪欲法で決定的に生成）
+        temperature (float, optional): do_sample=True のときの温度
+        batch_size (int, optional): 一度に生成するプロンプトの数
+        torch_dtype (str, optional): from_pretrained に渡す dtype
+    """
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        device: str | None = None,
+        max_new_tokens: int = 200,
+        do_sample: bool = False,
+        temperature: float = 0.8,
+        batch_size: int = 4,
+        torch_dtype: str = "auto",
+    ):
+        self.model_name = model_name
+        self.device = device
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.batch_size = max(1, batch_size)
+        self.torch_dtype = torch_dtype
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+        # 同じモデルで同時に generate しない
+        self._generate_lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from transformers import AutoModelForCausalLM, AutoTokenizer
+                except ImportError as exc:  # pragma: no cover - optional dependency
+                    raise ImportError("LLM に尋ねるには transformers が必要です: uv pip install transformers") from exc
+                tokenizer = AutoTokenizer.from_pretrained(self.model_name, padding_side="left")
+                if tokenizer.pad_token is None:
+                    tokenizer.pad_token = tokenizer.eos_token
+                model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=self.torch_dtype)
+                model.to(self.device or _default_device())
+                model.eval()
+                self._tokenizer, self._model = tokenizer, model
+        return self._tokenizer, self._model
+
+    def _chat_text(self, tokenizer, prompt: str) -> str:
+        if getattr(tokenizer, "chat_template", None) is None:
+            return prompt
+        return tokenizer.apply_chat_template(
+            [{"role": "user", "content": prompt}],
+            add_generation_prompt=True,
+            tokenize=False,
+        )
+
+    def generate(self, prompts: list[str], hands: list[tuple[str, ...]]) -> list[str]:
+        import torch
+
+        tokenizer, model = self._load()
+        options = {"max_new_tokens": self.max_new_tokens, "do_sample": self.do_sample,
+                   "pad_token_id": tokenizer.pad_token_id}
+        if self.do_sample:
+            options["temperature"] = self.temperature
+        replies = []
+        for chunk in _chunks(prompts, self.batch_size):
+            texts = [self._chat_text(tokenizer, p) for p in chunk]
+            inputs = tokenizer(texts, return_tensors="pt", padding=True).to(model.device)
+            with self._generate_lock, torch.inference_mode():
+                outputs = model.generate(**inputs, **options)
+            # プロンプトの部分を除いて、生成した部分だけを返す
+            new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+            replies.extend(tokenizer.batch_decode(new_tokens, skip_special_tokens=True))
+        return replies
+
+
+class UkeireBackend:
+    """モデルを読み込まずに mj.ukeire の打牌候補を文章にして返す代役（テストやモデルのない環境向け）"""
+
+    def generate(self, prompts: list[str], hands: list[tuple[str, ...]]) -> list[str]:
+        return [self._answer(list(hand)) for hand in hands]
+
+    def _answer(self, tiles: list[str]) -> str:
+        if len(tiles) % 3 != 2:
+            shape, _ = machi_hai_13_ukeire(tiles)
+            return f"打牌前の手牌ではありません（{shape}）"
+        best = recommend_discard(tiles)
+        if best is None:
+            return "切れる牌がありません"
+        accepts = " ".join(best['tiles'])
+        return f"{best['discard']} を切ります（{best['shanten']}向聴、受け入れ {best['ukeire']}枚: {accepts}）"
+
+
+BACKENDS: dict[str, Callable[..., object]] = {
+    "transformers": TransformersBackend,
+    "ukeire": UkeireBackend,
+}
+
+
+def register_backend(name: str, factory: Callable[..., object]) -> None:
+    '''
+    generate(prompts, hands) -> list[str] を持つバックエンドを名前で登録する
+    '''
+    BACKENDS[name] = factory
+
+
+class DiscardAdvisor:
+    """手牌ごとの答えを覚えておき、覚えていない手牌だけをバックエンドにまとめて尋ねる
+
+    Args:
+        backend: generate(prompts, hands) -> list[str] を持つオブジェクト
+        cache_size (int, optional): 覚えておく手牌の数
+        prompt (str, optional): {tiles} に手牌のリストが入るプロンプト
+    """
+
+    def __init__(self, backend, cache_size: int = 1024, prompt: str = PROMPT):
+        self.backend = backend
+        self.prompt = prompt
+        self.cache = HandValueCache(maxsize=cache_size)
+        # 覚えていない手牌を尋ねるのは1度に1つの呼び出しだけ（同じ手牌を同時に2回生成しない）
+        self._lock = threading.Lock()
+
+    def ask(self, tiles: list[str]) -> str:
+        return self.ask_batch([tiles])[0]
+
+    def ask_batch(self, hands: list[list[str]]) -> list[str]:
+        keys = [canonical_hand(h) for h in hands]
+        answers = {}
+        for key in keys:
+            if key not in answers:
+                answers[key] = self.cache.get(key)
+        todo = [key for key, answer in answers.items() if answer is None]
+        if todo:
+            with self._lock:
+                # 待っている間にほかの呼び出しが答えた手牌は尋ねない
+                for key in todo:
+                    answers[key] = self.cache.peek(key)
+                todo = [key for key in todo if answers[key] is None]
+                if todo:
+                    prompts = [self.prompt.format(tiles=list(key)) for key in todo]
+                    for key, reply in zip(todo, self.backend.generate(prompts, todo)):
+                        self.cache.put(key, reply)
+                        answers[key] = reply
+        return [answers[key] for key in keys]
+
+
+_ADVISORS: dict[tuple, DiscardAdvisor] = {}
+_ADVISORS_LOCK = threading.Lock()
+
+
+def get_advisor(backend: str = "transformers", cache_size: int = 1024, **options) -> DiscardAdvisor:
+    '''
+    同じバックエンド・設定の DiscardAdvisor を1つだけ作って返す（モデルは最初に尋ねたときに読み込む）
+
+    :param backend: str, BACKENDS に登録した名前
+    :param cache_size: int, 覚えておく手牌の数（最初に作ったときだけ使う）
+    :param options: バックエンドの引数（TransformersBackend の model_name, device, do_sample など）
+    '''
+    key = (backend, tuple(sorted(options.items())))
+    with _ADVISORS_LOCK:
+        advisor = _ADVISORS.get(key)
+        if advisor is None:
+            if backend not in BACKENDS:
+                raise ValueError(f"unknown backend: {backend} (choose from {', '.join(BACKENDS)})")
+            advisor = DiscardAdvisor(BACKENDS[backend](**options), cache_size=cache_size)
+            _ADVISORS[key] = advisor
+        return advisor
@@ -1,10 +1,10 @@
-from typing import List
-from mahjong.shanten import Shanten
-from mahjong.tile import TilesConverter
-from mj.utils import (
-    tiles_to_mahjong_array_strings,
-    ALL_TILES_NO_RED_TILES
-)
+from typing import List, Sequence
+from mj.shanten_table import IncrementalHand, calculate_waits
+from mj.tiles import names_to_34
+from mj.utils import ALL_TILES_NO_RED_TILES
+
+# 34配列のインデックス → 牌の名前
+INDEX_TO_TILE = list(ALL_TILES_NO_RED_TILES)
 
 def machi_hai_13(hand: list[str]) -> List[str] | str:
     '''
@@ -19,23 +19,67 @@ def machi_hai_13(hand: list[str]) -> List[str] | str:
     - 聴牌     → ['1m', '4p', ...]（待ち牌リスト）
     '''
     
-    waits = []
-    shanten_engine = Shanten()
-    config = tiles_to_mahjong_array_strings(hand, need_aka=False)
-    base34 = TilesConverter.string_to_34_array(*config)
-    current = shanten_engine.calculate_shanten(base34)
+    shape, _ = machi_hai_13_ukeire(hand)
+    return shape
+
+def machi_hai_13_ukeire(hand: list[str]) -> tuple[List[str] | str, dict[str, int]]:
+    '''
+    machi_hai_13 と同じ結果に受け入れ枚数を添えて返す
+    
+    :param hand: list[str], 牌の名前のリスト
+    
+    :return: tuple
+        - list[str] or str: machi_hai_13 と同じ
+        - dict[str, int]: {牌の名前: 残り枚数}（聴牌なら待ち牌、向聴なら有効牌）
+    '''
+    
+    return machi_hai_34(names_to_34(hand))
+
+def machi_hai_34(tiles_34: Sequence[int]) -> tuple[List[str] | str, dict[str, int]]:
+    '''
+    34配列から machi_hai_13_ukeire と同じ結果を返す（names_to_matrix でまとめて数えた行などに使う）
+    
+    :param tiles_34: Sequence[int], 34配列
+    
+    :return: tuple, machi_hai_13_ukeire と同じ
+    '''
+    
+    return _machi_shape(*calculate_waits([int(c) for c in tiles_34]))
+
+def _machi_shape(current: int, ukeire: dict[int, int]) -> tuple[List[str] | str, dict[str, int]]:
+    ukeire = {INDEX_TO_TILE[idx]: cnt for idx, cnt in ukeire.items()}
     
     if current < 0:
-        return 'agari'
+        return 'agari', ukeire
     elif current > 0:
-        return f'{current} shanten'
-    
-    waits: list[str] = []
-    for idx, tile in enumerate(ALL_TILES_NO_RED_TILES):
-        if base34[idx] > 3:
-            continue
-        test34 = base34.copy()
-        test34[idx] += 1
-        if shanten_engine.calculate_shanten(test34) < 0:
-            waits.append(tile)
-    return waits
\ No newline at end of file
+        return f'{current} shanten', ukeire
+    return list(ukeire), ukeire
+
+class IncrementalMachi:
+    '''
+    前回渡された手牌との差分（ツモ・打牌）だけを IncrementalHand に反映して machi_hai_13 と同じ結果を返す
+    
+    牌譜の再生や TileTracker / HandStabilizer の waits のように、1枚ずつ変わる手牌を続けて渡す用途向け
+    （手牌ごとに1つ作る）
+    '''
+    
+    def __init__(self):
+        self.hand = IncrementalHand()
+    
+    def __call__(self, hand: list[str]) -> List[str] | str:
+        shape, _ = self.ukeire(hand)
+        return shape
+    
+    def ukeire(self, hand: list[str]) -> tuple[List[str] | str, dict[str, int]]:
+        '''
+        machi_hai_13_ukeire と同じ結果を返す
+        '''
+        tiles_34 = names_to_34(hand)
+        try:
+            self.hand.update(tiles_34)
+        except ValueError:
+            # 同じ牌が5枚以上ある・15枚以上ある（誤検出など）手牌は差分で扱えないので毎回計算し直す
+            # （15枚以上なら machi_hai_13_ukeire と同じく ValueError になる）
+            self.hand = IncrementalHand()
+            return machi_hai_34(tiles_34)
+        return _machi_shape(*self.hand.waits())
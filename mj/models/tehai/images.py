@@ -0,0 +1,52 @@
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 検出器の前処理で共通に使う画像まわりの関数（torch / ultralytics に依存しない）
+
+
+def chunks(items: Iterable, size: int) -> Iterator[list]:
+    """items を size 件ずつのリストに区切って返す"""
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_image(source) -> np.ndarray:
+    """パス・PIL.Image・ndarray を ultralytics と同じ BGR の ndarray にそろえる"""
+    if isinstance(source, (str, Path)):
+        frame = cv2.imread(str(source))
+        if frame is None:
+            raise FileNotFoundError(f"画像を読み込めません: {source}")
+        return frame
+    if isinstance(source, Image.Image):
+        return np.ascontiguousarray(np.asarray(source.convert("RGB"))[:, :, ::-1])
+    return source
+
+
+def letterbox(frame: np.ndarray, size: int, color: int = 114):
+    """アスペクト比を保ったまま size x size に縮小し、余白を埋める（ultralytics の LetterBox と同じ配置）
+
+    Returns:
+        tuple:
+            - np.ndarray: 変換後の画像
+            - float: 縮小率
+            - tuple[int, int]: (左, 上) の余白
+    """
+    h, w = frame.shape[:2]
+    r = min(size / h, size / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    if (w, h) != (new_w, new_h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    frame = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(color, color, color))
+    return frame, r, (left, top)
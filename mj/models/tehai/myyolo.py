@@ -1,48 +1,262 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
 from ultralytics import YOLO
 
+from mj.models.tehai.crop import HandCropper
+from mj.models.tehai.images import chunks, load_image
+
+
+class TehaiDetector:
+    """重みを一度だけ読み込み、使い回す手牌検出器
+
+    Args:
+        model_path (str): モデルのパス
+        conf (float, optional): 検出の信頼度閾値（既定値）
+        iou (float, optional): IoUの閾値（既定値）
+        warmup (bool, optional): 読み込み直後にダミー画像で一度推論しておくか
+        imgsz (int, optional): ウォームアップに使う画像サイズ
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        conf: float = 0.5,
+        iou: float = 0.5,
+        warmup: bool = True,
+        imgsz: int = 640,
+    ):
+        self.model_path = str(model_path)
+        self.conf = conf
+        self.iou = iou
+        self.model = YOLO(self.model_path)
+        self.names = self.model.names
+        # ultralytics のモデルはスレッドセーフではないので推論は直列にする
+        self._lock = threading.Lock()
+        if warmup:
+            self.warmup(imgsz)
+
+    def warmup(self, imgsz: int = 640) -> None:
+        """ダミー画像で一度推論し、初回推論の初期化コストを先に払っておく"""
+        dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        with self._lock:
+            self.model.predict(source=dummy, conf=self.conf, iou=self.iou, save=False, verbose=False)
+
+    def predict(self, source, conf: float | None = None, iou: float | None = None):
+        """ultralytics の生の推論結果（1枚ぶん）を返す
+
+        Args:
+            source: 画像のパス、ndarray（ultralytics の仕様どおり BGR として扱われる）、PIL.Image
+        """
+        with self._lock:
+            return self.model.predict(
+                source=source,
+                conf=self.conf if conf is None else conf,
+                iou=self.iou if iou is None else iou,
+                save=False,
+                verbose=False,
+            )[0]
+
+    def detect(self, source, conf: float | None = None, iou: float | None = None, show: bool = False):
+        """画像内の牌を検出し、MYYOLO と同じ形式で返す
+
+        Returns:
+            tuple:
+                - list[dict]: 検出された牌の情報を含む辞書
+                - list[str]: 検出された牌の名前のリスト
+        """
+        result = self.predict(source, conf=conf, iou=iou)
+        if show: result.show(font_size=3, line_width=2)
+        return to_tile_infos(result, self.names)
+
+    def predict_batch(
+        self,
+        images: Iterable,
+        batch_size: int = 16,
+        workers: int = 4,
+        conf: float | None = None,
+        iou: float | None = None,
+    ) -> Iterator:
+        """複数画像をバッチにまとめて推論し、ultralytics の生の推論結果を入力順に返す
+
+        画像の読み込み・デコードはスレッドで並列に行い、
+        1つのバッチを推論している間に次のバッチの読み込みを進める
+
+        Args:
+            images: 画像（パス、ndarray、PIL.Image）のリストまたはイテレータ
+            batch_size (int, optional): 1回の推論にまとめる枚数
+            workers (int, optional): 読み込みに使うスレッド数
+        """
+        batches = chunks(images, max(1, batch_size))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = [pool.submit(load_image, x) for x in next(batches, [])]
+            while pending:
+                frames = [f.result() for f in pending]
+                nxt = next(batches, None)
+                pending = [pool.submit(load_image, x) for x in nxt] if nxt else []
+                with self._lock:
+                    results = self.model.predict(
+                        source=frames,
+                        conf=self.conf if conf is None else conf,
+                        iou=self.iou if iou is None else iou,
+                        save=False,
+                        verbose=False,
+                    )
+                yield from results
+
+    def detect_batch(
+        self,
+        images: Iterable,
+        batch_size: int = 16,
+        workers: int = 4,
+        conf: float | None = None,
+        iou: float | None = None,
+    ) -> Iterator[tuple[list[dict], list[str]]]:
+        """複数画像の牌を検出し、画像ごとに MYYOLO と同じ形式 (tile_infos, tile_names) を入力順に返す"""
+        for result in self.predict_batch(images, batch_size=batch_size, workers=workers, conf=conf, iou=iou):
+            yield to_tile_infos(result, self.names)
+
+
+def to_tile_infos(result, cls_names):
+    """ultralytics の推論結果を左から順に並べた牌の情報に整形する
+
+    Returns:
+        tuple:
+            - list[dict]: {'point': 左端x, 'conf': 信頼度, 'class': 牌の名前, 'box': [x1, y1, x2, y2]}
+            - list[str]: 検出された牌の名前のリスト
+    """
+    tile_infos = []
+    for box in result.boxes:
+        cls_name = cls_names[int(box.cls[0])]
+        conf = float(box.conf[0])
+        xyxy = [float(v) for v in box.xyxy[0]]
+        tile_infos.append({
+            'point':xyxy[0],
+            'conf':conf,
+            'class':cls_name,
+            'box':xyxy
+        })
+
+    tile_infos.sort(key=lambda x:x['point'])
+    tile_names = [h['class'] for h in tile_infos]
+    return tile_infos, tile_names
+
+
+# モデルのパス（またはアップロードされた重みのハッシュ）→ 検出器
+# _DETECTORS_LOCK は辞書の出し入れの間だけ持ち、重みの読み込みはキーごとのロックで行う
+# （読み込みに時間がかかっても、ほかのキーの検出器はすぐに返せる）
+_DETECTORS: OrderedDict[str, TehaiDetector] = OrderedDict()
+_DETECTORS_LOCK = threading.Lock()
+_LOAD_LOCKS: dict[str, threading.Lock] = {}
+# アップロードされた重みから作った検出器を覚えておく数（最近使われていないものから捨てる）
+UPLOADED_DETECTORS_MAX = 4
+_UPLOADED_PREFIX = "sha256:"
+
+
+def _cached_detector(key: str) -> TehaiDetector | None:
+    with _DETECTORS_LOCK:
+        detector = _DETECTORS.get(key)
+        if detector is not None:
+            _DETECTORS.move_to_end(key)
+        return detector
+
+
+def _load_detector(key: str, load: Callable[[], TehaiDetector]) -> TehaiDetector:
+    detector = _cached_detector(key)
+    if detector is not None:
+        return detector
+    with _DETECTORS_LOCK:
+        lock = _LOAD_LOCKS.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            # 同じキーを待っていた間にほかのスレッドが読み込んでいればそれを使う
+            detector = _cached_detector(key)
+            if detector is None:
+                detector = load()
+                with _DETECTORS_LOCK:
+                    _DETECTORS[key] = detector
+                    uploaded = [k for k in _DETECTORS if k.startswith(_UPLOADED_PREFIX)]
+                    for old in uploaded[:-UPLOADED_DETECTORS_MAX]:
+                        del _DETECTORS[old]
+    finally:
+        with _DETECTORS_LOCK:
+            _LOAD_LOCKS.pop(key, None)
+    return detector
+
+
+def has_detector(model_path: str) -> bool:
+    """そのキーの検出器を覚えているか（get_detector_from_bytes のキーは捨てられていることがある）"""
+    with _DETECTORS_LOCK:
+        return str(model_path) in _DETECTORS
+
+
+def get_detector(model_path: str, warmup: bool = True) -> TehaiDetector:
+    """モデルのパスごとに1つの検出器を作り、以降は同じものを返す
+    （get_detector_from_bytes が返したキーを渡した場合はその検出器を返す。
+      すでに捨てられていれば KeyError なので、重みを渡し直す）
+    """
+    key = str(model_path)
+    if key.startswith(_UPLOADED_PREFIX):
+        detector = _cached_detector(key)
+        if detector is None:
+            raise KeyError(f"uploaded weights are no longer loaded: {key}")
+        return detector
+    return _load_detector(key, lambda: TehaiDetector(key, warmup=warmup))
+
+
+def get_detector_from_bytes(data: bytes, warmup: bool = True) -> TehaiDetector:
+    """アップロードされた重み（.pt のバイト列）から検出器を作り、内容のハッシュをキーに使い回す
+
+    ultralytics はファイルからしか重みを読めないため、読み込みの間だけ一時ファイルを置き、
+    読み込み後すぐに削除する（同じ重みなら2回目以降はファイルを作らない）
+    返した検出器の model_path は get_detector にそのまま渡せるキーになる
+    （覚えておくのは最近使われた UPLOADED_DETECTORS_MAX 個まで）
+    """
+    key = f"{_UPLOADED_PREFIX}{hashlib.sha256(data).hexdigest()}"
+
+    def load() -> TehaiDetector:
+        fd, tmp_path = tempfile.mkstemp(suffix=".pt")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            detector = TehaiDetector(tmp_path, warmup=warmup)
+        finally:
+            os.remove(tmp_path)
+        detector.model_path = key
+        return detector
+
+    return _load_detector(key, load)
+
+
 def MYYOLO(
-    model_path: str, 
-    image_path: str,
+    model_path: str,
+    image_path,
     conf: float = 0.5,
     iou: float = 0.5,
-    show: bool = False
+    show: bool = False,
+    crop: bool = False
 ):
     """指定されたモデルを使用して指定画像内の牌を検出し、結果を整形して返す
+    （重みは get_detector で一度だけ読み込まれる）
 
     Args:
         model_path (str): モデルのパス
-        image_path (str): ファイルのパス
+        image_path (str | np.ndarray | PIL.Image.Image): 画像（ファイルのパス、ndarray、PIL画像）
         conf (float, optional): 検出の信頼度閾値
         iou (float, optional): IoUの閾値
+        show (bool, optional): 検出結果を表示するか（crop=True なら切り出した帯の検出結果）
+        crop (bool, optional): 手牌の帯だけを切り出して検出するか（座標は元画像のまま返る）
     Returns:
         tuple:
             - list[dict]: 検出された牌の情報を含む辞書
             - list[str]: 検出された牌の名前のリスト
     """
-    
-    model = YOLO(model_path)
-    result = model.predict(
-        source=image_path,
-        conf=conf,
-        iou=iou,
-        save=False
-    )[0]
-    if show: result.show(font_size=3, line_width=2)
-    cls_names = model.names
-    
-    boxes = result.boxes
-    tile_infos = []
-    
-    for box in boxes:
-        cls_name = cls_names[int(box.cls[0])]
-        conf = box.conf[0]
-        ltop = box.xyxy[0][0]
-        tile_infos.append({
-            'point':ltop,
-            'conf':conf,
-            'class':cls_name
-        })
-    
-    tile_infos.sort(key=lambda x:x['point'])
-    tile_names = [h['class'] for h in tile_infos]
-    return tile_infos, tile_names
\ No newline at end of file
+    if crop:
+        return HandCropper(track=False).detect(get_detector(model_path), image_path, conf=conf, iou=iou, show=show)
+    return get_detector(model_path).detect(image_path, conf=conf, iou=iou, show=show)
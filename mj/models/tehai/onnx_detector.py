@@ -0,0 +1,328 @@
+"""ONNX Runtime による CPU 推論の手牌検出器
+
+torch / ultralytics を読み込まずに、書き出した ONNX モデルで MYYOLO と同じ形式の結果を返す
+（ultralytics はモデルの書き出しと PyTorch 版との比較のときだけ使う）
+
+    # 書き出し（weights/best.pt → weights/best.onnx）
+    python -m mj.models.tehai.onnx_detector export --weights mj/models/tehai/weights/best.pt
+
+    # PyTorch 版との一致確認
+    python -m mj.models.tehai.onnx_detector parity --weights mj/models/tehai/weights/best.pt \\
+        --onnx mj/models/tehai/weights/best.onnx mj/models/tehai/showcase/*.png
+"""
+import argparse
+import ast
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from mj.models.tehai.images import chunks, letterbox, load_image
+
+# クラスごとの NMS をまとめて行うためのずらし幅（ultralytics と同じ値）
+_MAX_WH = 7680
+_MAX_DET = 300
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as exc:  # pragma: no cover - optional dependency
+        raise ImportError(
+            "ONNX 推論には onnxruntime が必要です: uv pip install onnxruntime"
+        ) from exc
+    return onnxruntime
+
+
+class OnnxTehaiDetector:
+    """ONNX モデルを CPU で推論する手牌検出器（TehaiDetector と同じ detect / detect_batch を持つ）
+
+    Args:
+        model_path (str): ONNX モデルのパス
+        conf (float, optional): 検出の信頼度閾値（既定値）
+        iou (float, optional): IoUの閾値（既定値）
+        intra_op_threads (int, optional): 演算内スレッド数（0 なら onnxruntime に任せる）
+        providers (list[str], optional): 実行プロバイダ（例: ["OpenVINOExecutionProvider"]）
+        names (dict[int, str], optional): クラス名（省略時はモデルのメタデータから読む）
+        warmup (bool, optional): 読み込み直後にダミー画像で一度推論しておくか
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        conf: float = 0.5,
+        iou: float = 0.5,
+        intra_op_threads: int = 0,
+        providers: list[str] | None = None,
+        names: dict[int, str] | None = None,
+        warmup: bool = True,
+    ):
+        ort = _import_onnxruntime()
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.model_path = str(model_path)
+        self.conf = conf
+        self.iou = iou
+        self.session = ort.InferenceSession(
+            self.model_path,
+            sess_options=options,
+            providers=providers or ["CPUExecutionProvider"],
+        )
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.imgsz = inp.shape[2] if isinstance(inp.shape[2], int) else 640
+        # バッチ次元が固定ならまとめて推論できない
+        self.dynamic_batch = not isinstance(inp.shape[0], int)
+        self.names = names or _names_from_metadata(self.session)
+        self._lock = threading.Lock()
+        if warmup:
+            self.warmup()
+
+    def warmup(self) -> None:
+        """ダミー画像で一度推論し、初回推論の初期化コストを先に払っておく"""
+        self._infer([np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)], self.conf, self.iou)
+
+    def _infer(self, frames: list[np.ndarray], conf: float, iou: float) -> list[tuple]:
+        """BGR 画像のリストを推論し、画像ごとに元画像座標の (xyxy, 信頼度, クラス) を返す"""
+        batch, metas = preprocess(frames, self.imgsz)
+        with self._lock:
+            if self.dynamic_batch or len(frames) == 1:
+                outputs = self.session.run(None, {self.input_name: batch})[0]
+            else:
+                outputs = np.concatenate([
+                    self.session.run(None, {self.input_name: batch[i:i + 1]})[0]
+                    for i in range(len(frames))
+                ])
+        return [_postprocess(out, meta, conf, iou) for out, meta in zip(outputs, metas)]
+
+    def predict(self, source, conf: float | None = None, iou: float | None = None):
+        """1枚を推論し、元画像座標の (xyxy (n, 4), 信頼度 (n,), クラス番号 (n,)) を返す"""
+        return self._infer(
+            [load_image(source)],
+            self.conf if conf is None else conf,
+            self.iou if iou is None else iou,
+        )[0]
+
+    def detect(self, source, conf: float | None = None, iou: float | None = None, show: bool = False):
+        """画像内の牌を検出し、MYYOLO と同じ形式で返す
+
+        Returns:
+            tuple:
+                - list[dict]: 検出された牌の情報を含む辞書
+                - list[str]: 検出された牌の名前のリスト
+        """
+        frame = load_image(source)
+        boxes, scores, classes = self._infer(
+            [frame],
+            self.conf if conf is None else conf,
+            self.iou if iou is None else iou,
+        )[0]
+        if show: _show(frame, boxes, classes, self.names)
+        return _to_tile_infos(boxes, scores, classes, self.names)
+
+    def detect_batch(
+        self,
+        images: Iterable,
+        batch_size: int = 16,
+        workers: int = 4,
+        conf: float | None = None,
+        iou: float | None = None,
+    ) -> Iterator[tuple[list[dict], list[str]]]:
+        """複数画像の牌を検出し、画像ごとに MYYOLO と同じ形式を入力順に返す"""
+        conf = self.conf if conf is None else conf
+        iou = self.iou if iou is None else iou
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for batch in chunks(images, max(1, batch_size)):
+                frames = list(pool.map(load_image, batch))
+                for boxes, scores, classes in self._infer(frames, conf, iou):
+                    yield _to_tile_infos(boxes, scores, classes, self.names)
+
+
+def preprocess(frames: list[np.ndarray], imgsz: int):
+    """BGR 画像を letterbox して (N, 3, imgsz, imgsz) の float32 にまとめる
+
+    Returns:
+        tuple:
+            - np.ndarray: モデルへの入力
+            - list[tuple]: 画像ごとの (縮小率, (左, 上) の余白, (高さ, 幅))
+    """
+    blobs, metas = [], []
+    for frame in frames:
+        boxed, ratio, pad = letterbox(frame, imgsz)
+        blobs.append(boxed[:, :, ::-1].transpose(2, 0, 1))
+        metas.append((ratio, pad, frame.shape[:2]))
+    return np.ascontiguousarray(np.stack(blobs), dtype=np.float32) / 255.0, metas
+
+
+def _names_from_metadata(session) -> dict[int, str]:
+    meta = session.get_modelmeta().custom_metadata_map
+    if "names" not in meta:
+        raise ValueError("モデルにクラス名のメタデータがありません。names を指定してください。")
+    return {int(k): v for k, v in ast.literal_eval(meta["names"]).items()}
+
+
+def _postprocess(pred: np.ndarray, meta: tuple, conf: float, iou: float):
+    """(4 + クラス数, 候補数) の出力を NMS して元画像の座標に戻す"""
+    ratio, (left, top), (h, w) = meta
+    pred = pred.T
+    cls_scores = pred[:, 4:]
+    classes = cls_scores.argmax(axis=1)
+    scores = cls_scores[np.arange(len(pred)), classes]
+    keep = scores > conf
+    if not keep.any():
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.intp)
+    pred, scores, classes = pred[keep], scores[keep], classes[keep]
+
+    xywh = pred[:, :4].copy()
+    # 左上基準の (x, y, w, h) をクラスごとにずらして NMS
+    xywh[:, 0] -= xywh[:, 2] / 2
+    xywh[:, 1] -= xywh[:, 3] / 2
+    shifted = xywh.copy()
+    shifted[:, :2] += classes[:, None] * _MAX_WH
+    idx = cv2.dnn.NMSBoxes(shifted.tolist(), scores.tolist(), conf, iou)
+    idx = np.asarray(idx, dtype=np.intp).reshape(-1)[:_MAX_DET]
+
+    boxes = np.empty((len(idx), 4), dtype=np.float32)
+    boxes[:, 0] = xywh[idx, 0]
+    boxes[:, 1] = xywh[idx, 1]
+    boxes[:, 2] = xywh[idx, 0] + xywh[idx, 2]
+    boxes[:, 3] = xywh[idx, 1] + xywh[idx, 3]
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - left) / ratio).clip(0, w)
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - top) / ratio).clip(0, h)
+    return boxes, scores[idx], classes[idx]
+
+
+def _to_tile_infos(boxes, scores, classes, cls_names):
+    tile_infos = [
+        {'point': float(box[0]), 'conf': float(score), 'class': cls_names[int(c)], 'box': [float(v) for v in box]}
+        for box, score, c in zip(boxes, scores, classes)
+    ]
+    tile_infos.sort(key=lambda x:x['point'])
+    tile_names = [h['class'] for h in tile_infos]
+    return tile_infos, tile_names
+
+
+def _show(frame, boxes, classes, cls_names) -> None:
+    canvas = frame.copy()
+    for box, c in zip(boxes.astype(int), classes):
+        cv2.rectangle(canvas, tuple(box[:2]), tuple(box[2:]), (0, 0, 255), 2)
+        cv2.putText(canvas, cls_names[int(c)], (box[0], max(0, box[1] - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+    Image.fromarray(canvas[:, :, ::-1]).show()
+
+
+_DETECTORS: dict[tuple, OnnxTehaiDetector] = {}
+_DETECTORS_LOCK = threading.Lock()
+
+
+def get_onnx_detector(model_path: str, intra_op_threads: int = 0) -> OnnxTehaiDetector:
+    """モデルのパスとスレッド数ごとに1つの検出器を作り、以降は同じものを返す"""
+    key = (str(model_path), intra_op_threads)
+    with _DETECTORS_LOCK:
+        detector = _DETECTORS.get(key)
+        if detector is None:
+            detector = OnnxTehaiDetector(key[0], intra_op_threads=intra_op_threads)
+            _DETECTORS[key] = detector
+    return detector
+
+
+def MYYOLO_ONNX(
+    model_path: str,
+    image_path,
+    conf: float = 0.5,
+    iou: float = 0.5,
+    show: bool = False
+):
+    """MYYOLO と同じ引数・戻り値で、ONNX モデルを CPU で推論する
+
+    Args:
+        model_path (str): ONNX モデルのパス
+        image_path (str | np.ndarray | PIL.Image.Image): 画像（ファイルのパス、ndarray、PIL画像）
+        conf (float, optional): 検出の信頼度閾値
+        iou (float, optional): IoUの閾値
+    Returns:
+        tuple:
+            - list[dict]: 検出された牌の情報を含む辞書
+            - list[str]: 検出された牌の名前のリスト
+    """
+    return get_onnx_detector(model_path).detect(image_path, conf=conf, iou=iou, show=show)
+
+
+def export_onnx(weights_path: str, imgsz: int = 640, dynamic: bool = False, opset: int | None = None) -> str:
+    """PyTorch の重みを ONNX に書き出し、書き出したファイルのパスを返す（ultralytics が必要）"""
+    from ultralytics import YOLO
+
+    kwargs = {'format': 'onnx', 'imgsz': imgsz, 'dynamic': dynamic, 'simplify': True}
+    if opset is not None:
+        kwargs['opset'] = opset
+    return str(YOLO(weights_path).export(**kwargs))
+
+
+def parity_check(
+    weights_path: str,
+    onnx_path: str,
+    images: Iterable,
+    conf: float = 0.5,
+    iou: float = 0.5,
+    intra_op_threads: int = 0,
+) -> dict:
+    """同じ画像を PyTorch 版と ONNX 版で検出し、牌の並びと位置のずれを比べる
+
+    Returns:
+        dict: {'images': 枚数, 'matched': 牌の並びが一致した枚数,
+               'max_point_diff': 一致した画像での左端xの最大のずれ(px), 'mismatches': [(画像の番号, PyTorch, ONNX)]}
+    """
+    from mj.models.tehai.myyolo import TehaiDetector
+
+    torch_detector = TehaiDetector(weights_path, conf=conf, iou=iou)
+    onnx_detector = OnnxTehaiDetector(onnx_path, conf=conf, iou=iou, intra_op_threads=intra_op_threads)
+    report = {'images': 0, 'matched': 0, 'max_point_diff': 0.0, 'mismatches': []}
+    for i, image in enumerate(images):
+        frame = load_image(image)
+        t_infos, t_names = torch_detector.detect(frame)
+        o_infos, o_names = onnx_detector.detect(frame)
+        report['images'] += 1
+        if t_names != o_names:
+            report['mismatches'].append((i, t_names, o_names))
+            continue
+        report['matched'] += 1
+        for t, o in zip(t_infos, o_infos):
+            report['max_point_diff'] = max(report['max_point_diff'], abs(t['point'] - o['point']))
+    return report
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="手牌検出モデルの ONNX 書き出しと一致確認")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="PyTorch の重みを ONNX に書き出す")
+    p_export.add_argument("--weights", required=True)
+    p_export.add_argument("--imgsz", type=int, default=640)
+    p_export.add_argument("--dynamic", action="store_true", help="バッチ次元を可変にする")
+    p_export.add_argument("--opset", type=int, default=None)
+
+    p_parity = sub.add_parser("parity", help="PyTorch 版と ONNX 版の検出結果を比べる")
+    p_parity.add_argument("--weights", required=True)
+    p_parity.add_argument("--onnx", required=True)
+    p_parity.add_argument("--conf", type=float, default=0.5)
+    p_parity.add_argument("--iou", type=float, default=0.5)
+    p_parity.add_argument("--threads", type=int, default=0)
+    p_parity.add_argument("images", nargs="+")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        print(export_onnx(args.weights, imgsz=args.imgsz, dynamic=args.dynamic, opset=args.opset))
+        return
+
+    report = parity_check(args.weights, args.onnx, args.images, conf=args.conf, iou=args.iou, intra_op_threads=args.threads)
+    print(f"一致: {report['matched']}/{report['images']}  左端xの最大のずれ: {report['max_point_diff']:.2f}px")
+    for i, t_names, o_names in report['mismatches']:
+        print(f"  [{args.images[i]}] PyTorch={t_names} ONNX={o_names}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from ultralytics import YOLO
+from mj.models.tehai.myyolo import TehaiDetector
 import os
 
 # 推論
@@ -6,9 +6,9 @@ folder_path = 'dataset/mj/images/test/'
 file_names = os.listdir(folder_path)
 file_pathes = [folder_path+f for f in file_names if '.db' not in f]
 
-model = YOLO('best.pt')
-results = model(file_pathes)
-class_names = model.names
+detector = TehaiDetector('best.pt', conf=0.25, iou=0.7)
+results = detector.predict_batch(file_pathes, batch_size=16, workers=4)
+class_names = detector.names
 
 with open("res.txt","w") as o:
     for result,name in zip(results,file_names):
@@ -0,0 +1,316 @@
+"""手牌検出モデルの INT8 量子化と、FP32 との精度・速度の比較レポート
+
+    # 動的量子化（重みだけ INT8、校正データ不要）
+    python -m mj.models.tehai.quantize dynamic --onnx mj/models/tehai/weights/best.onnx
+
+    # 静的量子化（make_dataset.py が作る val 画像で活性値の範囲を校正）
+    python -m mj.models.tehai.quantize static --onnx mj/models/tehai/weights/best.onnx \\
+        --calib dataset/mj/images/val
+
+    # 37クラスごとの精度と1枚あたりの推論時間を FP32 と比べる
+    python -m mj.models.tehai.quantize report --fp32 mj/models/tehai/weights/best.onnx \\
+        --int8 mj/models/tehai/weights/best.int8.onnx --images dataset/mj/images/val
+
+量子化したモデルは OnnxTehaiDetector / MYYOLO_ONNX にそのまま渡せる
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from mj.models.tehai.images import load_image
+from mj.models.tehai.onnx_detector import OnnxTehaiDetector, _import_onnxruntime, preprocess
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp')
+# 量子化で崩れやすく、常に結果を確認しておきたいクラス（赤5は通常の5と見た目の差が色だけ）
+WATCH_CLASSES = ('0m', '0p', '0s')
+
+
+def _default_out(onnx_path: str, tag: str) -> str:
+    path = Path(onnx_path)
+    return str(path.with_name(f"{path.stem}.{tag}{path.suffix}"))
+
+
+def _copy_metadata(src_path: str, dst_path: str) -> None:
+    """クラス名などのメタデータを量子化後のモデルに引き継ぐ"""
+    import onnx
+
+    src = onnx.load(src_path, load_external_data=False)
+    dst = onnx.load(dst_path)
+    keys = {p.key for p in dst.metadata_props}
+    for prop in src.metadata_props:
+        if prop.key not in keys:
+            dst.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(dst, dst_path)
+
+
+def _pre_process(onnx_path: str, out_path: str) -> str:
+    """量子化の前に形状推論と定数畳み込みを済ませたモデルを out_path の隣に作る"""
+    from onnxruntime.quantization import quant_pre_process
+
+    pre_path = _default_out(out_path, "pre")
+    quant_pre_process(onnx_path, pre_path, skip_symbolic_shape=True)
+    return pre_path
+
+
+def list_images(folder: str, limit: int | None = None) -> list[str]:
+    paths = sorted(str(p) for p in Path(folder).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    return paths[:limit] if limit else paths
+
+
+def quantize_dynamic_model(onnx_path: str, out_path: str | None = None) -> str:
+    """重みを INT8 にする動的量子化（活性値は推論時に範囲を求める）"""
+    _import_onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out_path = out_path or _default_out(onnx_path, "dynamic")
+    pre_path = _pre_process(onnx_path, out_path)
+    try:
+        quantize_dynamic(pre_path, out_path, weight_type=QuantType.QUInt8)
+    finally:
+        Path(pre_path).unlink(missing_ok=True)
+    _copy_metadata(onnx_path, out_path)
+    return out_path
+
+
+def quantize_static_model(
+    onnx_path: str,
+    calib_dir: str,
+    out_path: str | None = None,
+    imgsz: int = 640,
+    samples: int = 200,
+) -> str:
+    """calib_dir の画像で活性値の範囲を校正し、重みと活性値を INT8 にする静的量子化（QDQ 形式）"""
+    _import_onnxruntime()
+    from onnxruntime.quantization import (
+        CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static,
+    )
+
+    images = list_images(calib_dir, samples)
+    if not images:
+        raise FileNotFoundError(f"校正用の画像がありません: {calib_dir}")
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self, input_name: str):
+            self.input_name = input_name
+            self.paths = iter(images)
+
+        def get_next(self):
+            path = next(self.paths, None)
+            if path is None:
+                return None
+            batch, _ = preprocess([load_image(path)], imgsz)
+            return {self.input_name: batch}
+
+    ort = _import_onnxruntime()
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    out_path = out_path or _default_out(onnx_path, "int8")
+    pre_path = _pre_process(onnx_path, out_path)
+    try:
+        quantize_static(
+            pre_path,
+            out_path,
+            _Reader(input_name),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    finally:
+        Path(pre_path).unlink(missing_ok=True)
+    _copy_metadata(onnx_path, out_path)
+    return out_path
+
+
+def load_labels(label_path: Path, shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    """YOLO 形式のラベル（cls cx cy w h、0..1）を画素単位の xyxy とクラス番号にする"""
+    h, w = shape
+    if not label_path.exists():
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.intp)
+    rows = np.loadtxt(label_path, ndmin=2, dtype=np.float32)
+    if rows.size == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.intp)
+    cx, cy, bw, bh = rows[:, 1] * w, rows[:, 2] * h, rows[:, 3] * w, rows[:, 4] * h
+    boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+    return boxes, rows[:, 0].astype(np.intp)
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def _match(pred_boxes, pred_scores, pred_cls, gt_boxes, gt_cls, iou_thr: float, stats: np.ndarray) -> None:
+    """クラスごとに信頼度の高い順で正解と対応づけ、stats[:, (TP, FP, 正解数)] に足し込む"""
+    np.add.at(stats[:, 2], gt_cls, 1)
+    for c in np.unique(pred_cls):
+        p = np.flatnonzero(pred_cls == c)
+        p = p[np.argsort(-pred_scores[p])]
+        g = np.flatnonzero(gt_cls == c)
+        if not len(g):
+            stats[c, 1] += len(p)
+            continue
+        ious = _iou(pred_boxes[p], gt_boxes[g])
+        used = np.zeros(len(g), dtype=bool)
+        for row in ious:
+            row = np.where(used, -1.0, row)
+            j = int(row.argmax())
+            if row[j] >= iou_thr:
+                used[j] = True
+                stats[c, 0] += 1
+            else:
+                stats[c, 1] += 1
+
+
+def _evaluate(detector: OnnxTehaiDetector, images: list[str], labels_dir: Path, iou_thr: float, n_classes: int):
+    stats = np.zeros((n_classes, 3), dtype=np.int64)
+    elapsed = 0.0
+    for path in images:
+        frame = load_image(path)
+        start = time.perf_counter()
+        boxes, scores, classes = detector.predict(frame)
+        elapsed += time.perf_counter() - start
+        gt_boxes, gt_cls = load_labels(labels_dir / f"{Path(path).stem}.txt", frame.shape[:2])
+        _match(boxes, scores, classes, gt_boxes, gt_cls, iou_thr, stats)
+    return stats, elapsed * 1000 / max(1, len(images))
+
+
+def _prf(tp: int, fp: int, n_gt: int) -> tuple[float, float, float]:
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / n_gt if n_gt else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def compare_report(
+    fp32_path: str,
+    int8_path: str,
+    images: Iterable[str],
+    labels_dir: str,
+    conf: float = 0.5,
+    iou: float = 0.5,
+    match_iou: float = 0.5,
+    intra_op_threads: int = 0,
+    warn_drop: float = 0.02,
+) -> dict:
+    """FP32 と INT8 のモデルで同じ画像を検出し、クラスごとの精度と1枚あたりの推論時間を比べる
+
+    Args:
+        labels_dir (str): YOLO 形式のラベルのフォルダ（画像と同じファイル名の .txt）
+        match_iou (float, optional): 正解と対応づける IoU の閾値
+        warn_drop (float, optional): INT8 の F1 がこれ以上下がったクラスを警告する
+
+    Returns:
+        dict: {'latency_ms': {'fp32', 'int8'}, 'classes': [{'class', 'support', 'fp32': {...}, 'int8': {...}, 'f1_drop'}],
+               'warnings': [str]}
+    """
+    images = list(images)
+    fp32 = OnnxTehaiDetector(fp32_path, conf=conf, iou=iou, intra_op_threads=intra_op_threads)
+    int8 = OnnxTehaiDetector(int8_path, conf=conf, iou=iou, intra_op_threads=intra_op_threads, names=fp32.names)
+    n_classes = len(fp32.names)
+    fp32_stats, fp32_ms = _evaluate(fp32, images, Path(labels_dir), match_iou, n_classes)
+    int8_stats, int8_ms = _evaluate(int8, images, Path(labels_dir), match_iou, n_classes)
+
+    classes, warnings = [], []
+    for c in range(n_classes):
+        name = fp32.names[c]
+        p32, r32, f32 = _prf(*fp32_stats[c])
+        p8, r8, f8 = _prf(*int8_stats[c])
+        drop = f32 - f8
+        classes.append({
+            'class': name,
+            'support': int(fp32_stats[c, 2]),
+            'fp32': {'precision': p32, 'recall': r32, 'f1': f32},
+            'int8': {'precision': p8, 'recall': r8, 'f1': f8},
+            'f1_drop': drop,
+        })
+        if not fp32_stats[c, 2]:
+            if name in WATCH_CLASSES:
+                warnings.append(f"{name}: 評価画像に正解がないため確認できません")
+        elif drop >= warn_drop:
+            warnings.append(f"{name}: F1 {f32:.3f} → {f8:.3f}（-{drop:.3f}）")
+
+    return {
+        'images': len(images),
+        'latency_ms': {'fp32': fp32_ms, 'int8': int8_ms},
+        'classes': classes,
+        'warnings': warnings,
+    }
+
+
+def format_report(report: dict) -> str:
+    lat = report['latency_ms']
+    speedup = lat['fp32'] / lat['int8'] if lat['int8'] else 0.0
+    lines = [
+        f"画像: {report['images']}枚  推論時間: FP32 {lat['fp32']:.1f}ms / INT8 {lat['int8']:.1f}ms（x{speedup:.2f}）",
+        f"{'class':>6} {'n':>5}  {'P32':>5} {'R32':>5} {'F1_32':>5}  {'P8':>5} {'R8':>5} {'F1_8':>5}  {'dF1':>6}",
+    ]
+    for row in report['classes']:
+        a, b = row['fp32'], row['int8']
+        mark = ' *' if row['class'] in WATCH_CLASSES else ''
+        lines.append(
+            f"{row['class']:>6} {row['support']:>5}  "
+            f"{a['precision']:.3f} {a['recall']:.3f} {a['f1']:.3f}  "
+            f"{b['precision']:.3f} {b['recall']:.3f} {b['f1']:.3f}  {b['f1'] - a['f1']:+.3f}{mark}"
+        )
+    if report['warnings']:
+        lines.append("警告（INT8 で精度が落ちたクラス）:")
+        lines.extend(f"  {w}" for w in report['warnings'])
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="手牌検出モデルの INT8 量子化と比較レポート")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_dynamic = sub.add_parser("dynamic", help="動的量子化（重みのみ INT8）")
+    p_dynamic.add_argument("--onnx", required=True)
+    p_dynamic.add_argument("--out", default=None)
+
+    p_static = sub.add_parser("static", help="val 画像で校正する静的量子化")
+    p_static.add_argument("--onnx", required=True)
+    p_static.add_argument("--calib", default="dataset/mj/images/val")
+    p_static.add_argument("--out", default=None)
+    p_static.add_argument("--imgsz", type=int, default=640)
+    p_static.add_argument("--samples", type=int, default=200)
+
+    p_report = sub.add_parser("report", help="FP32 と INT8 のクラスごとの精度と推論時間を比べる")
+    p_report.add_argument("--fp32", required=True)
+    p_report.add_argument("--int8", required=True)
+    p_report.add_argument("--images", default="dataset/mj/images/val")
+    p_report.add_argument("--labels", default=None, help="省略時は images の images を labels に置き換えたフォルダ")
+    p_report.add_argument("--conf", type=float, default=0.5)
+    p_report.add_argument("--iou", type=float, default=0.5)
+    p_report.add_argument("--threads", type=int, default=0)
+    p_report.add_argument("--warn-drop", type=float, default=0.02)
+    p_report.add_argument("--json", default=None, help="レポートを JSON でも保存する")
+
+    args = parser.parse_args(argv)
+    if args.command == "dynamic":
+        print(quantize_dynamic_model(args.onnx, args.out))
+        return
+    if args.command == "static":
+        print(quantize_static_model(args.onnx, args.calib, args.out, imgsz=args.imgsz, samples=args.samples))
+        return
+
+    labels = args.labels or args.images.replace("images", "labels")
+    report = compare_report(
+        args.fp32, args.int8, list_images(args.images), labels,
+        conf=args.conf, iou=args.iou, intra_op_threads=args.threads, warn_drop=args.warn_drop,
+    )
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
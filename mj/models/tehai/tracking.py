@@ -0,0 +1,207 @@
+"""フレーム間で検出結果を使い回すための追跡と、検出結果のちらつきを抑える多数決
+
+手牌は数フレームの間ほとんど変わらないので、
+- 前回検出した牌それぞれの小さな縮小画像と、手牌の帯全体の縮小画像が前回とほぼ同じなら
+  （画素の差の平均で判定）検出を省いて前回の結果を返す（TileTracker）
+- 検出し直しても牌の組み合わせ（多重集合）が同じなら待ちの計算を省く（TileTracker）
+- 信頼度の低い牌がフレームごとに入れ替わらないよう、直近数フレームで多数決する（HandStabilizer）
+"""
+from collections import Counter
+from typing import Callable
+
+import cv2
+import numpy as np
+
+from mj.machi import machi_hai_13
+from mj.models.tehai.crop import tiles_bounds
+
+# 牌1枚ぶんの縮小画像の大きさ (幅, 高さ)
+TILE_THUMB = (12, 16)
+# 帯全体の縮小画像の高さ（幅は牌の枚数に合わせる）
+BAND_THUMB_HEIGHT = 12
+
+
+def _gray(frame: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+
+def _thumb(gray: np.ndarray, box, size) -> np.ndarray:
+    h, w = gray.shape[:2]
+    x0, y0, x1, y1 = (int(round(v)) for v in box)
+    x0, y0, x1, y1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+    if x1 <= x0 or y1 <= y0:
+        return np.zeros(size[::-1], dtype=np.float32)
+    return cv2.resize(gray[y0:y1, x0:x1], size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def hand_signature(frame: np.ndarray, tile_infos: list[dict]):
+    """牌ごとの縮小画像 (n, 16, 12) と、まわりに牌1枚ぶんほど広げた帯の縮小画像（ツモ牌や鳴きの出現を見る）"""
+    region = tiles_bounds(tile_infos)
+    if region is None:
+        return None
+    gray = _gray(frame)
+    tiles = np.stack([_thumb(gray, t['box'], TILE_THUMB) for t in tile_infos])
+    x0, y0, x1, y1 = region
+    pad = (y1 - y0) // 2
+    band_w = max(8, 4 * len(tile_infos))
+    band = _thumb(gray, (x0 - 2 * pad, y0 - pad, x1 + 2 * pad, y1 + pad), (band_w, BAND_THUMB_HEIGHT))
+    return tiles, band
+
+
+def signature_distance(a, b) -> float:
+    """2つの hand_signature の差（牌ごとの差の最大と、帯の縦1列ごとの差の最大の大きいほう）"""
+    tiles_a, band_a = a
+    tiles_b, band_b = b
+    if tiles_a.shape != tiles_b.shape or band_a.shape != band_b.shape:
+        return float('inf')
+    tile_diff = np.abs(tiles_a - tiles_b).mean(axis=(1, 2)).max()
+    band_diff = np.abs(band_a - band_b).mean(axis=0).max()
+    return float(max(tile_diff, band_diff))
+
+
+class TileTracker:
+    """前回の検出結果を使い回しつつ、手牌と待ちを返す
+
+    Args:
+        detect (Callable): フレームを受け取り (tile_infos, tile_names) を返す関数（MYYOLO / HandCropper.detect など）
+        max_distance (float, optional): signature_distance がこれ以下なら「変わっていない」とみなす（画素値 0..255 の差）
+        max_reuse (int, optional): 連続で使い回すフレーム数の上限（ずれが溜まらないよう定期的に検出し直す）
+        waits (Callable, optional): 牌の名前のリストから待ちを求める関数（None なら求めない）
+    """
+
+    def __init__(
+        self,
+        detect: Callable,
+        max_distance: float = 8.0,
+        max_reuse: int = 30,
+        waits: Callable | None = machi_hai_13,
+    ):
+        self.detect = detect
+        self.max_distance = max_distance
+        self.max_reuse = max_reuse
+        self.waits_fn = waits
+        self.reset()
+
+    def reset(self) -> None:
+        self.tile_infos: list[dict] = []
+        self.tile_names: list[str] = []
+        self.shape = None
+        self._signature = None
+        self._multiset: Counter | None = None
+        self._reused = 0
+        self.stats = {'frames': 0, 'detected': 0, 'reused': 0, 'waits': 0}
+
+    def update(self, frame: np.ndarray) -> dict:
+        """1フレームぶん進める
+
+        Returns:
+            dict: {'infos': tile_infos, 'names': tile_names, 'shape': machi_hai_13 の結果,
+                   'reused': 検出を省いたか, 'changed': 牌の組み合わせが前回から変わったか}
+        """
+        self.stats['frames'] += 1
+        if self._signature is not None and self._reused < self.max_reuse:
+            sig = hand_signature(frame, self.tile_infos)
+            if sig is not None and signature_distance(sig, self._signature) <= self.max_distance:
+                self._reused += 1
+                self.stats['reused'] += 1
+                return self._result(reused=True, changed=False)
+
+        tile_infos, tile_names = self.detect(frame)
+        self.stats['detected'] += 1
+        self._reused = 0
+        self.tile_infos, self.tile_names = tile_infos, tile_names
+        self._signature = hand_signature(frame, tile_infos)
+
+        multiset = Counter(tile_names)
+        changed = multiset != self._multiset
+        if changed:
+            self._multiset = multiset
+            if self.waits_fn is not None:
+                self.shape = self.waits_fn(tile_names)
+                self.stats['waits'] += 1
+        return self._result(reused=False, changed=changed)
+
+    def _result(self, reused: bool, changed: bool) -> dict:
+        return {
+            'infos': self.tile_infos,
+            'names': self.tile_names,
+            'shape': self.shape,
+            'reused': reused,
+            'changed': changed,
+        }
+
+
+class HandStabilizer:
+    """直近 K フレームの検出結果を牌の位置（左からの順番）ごとに信頼度で重み付けして多数決し、
+    多数決の結果が変わったときだけ新しい手牌として扱う
+
+    Args:
+        window (int, optional): 多数決に使うフレーム数 K
+        min_share (float, optional): 各位置で1位の牌がこの割合以上の票を得ていなければ前の手牌を保つ
+        waits (Callable, optional): 手牌が変わったときに待ちを求める関数（None なら求めない）
+    """
+
+    def __init__(self, window: int = 5, min_share: float = 0.6, waits: Callable | None = machi_hai_13):
+        self.window = max(1, window)
+        self.min_share = min_share
+        self.waits_fn = waits
+        self.reset()
+
+    def reset(self) -> None:
+        self.history: list[list[dict]] = []
+        self.tile_infos: list[dict] = []
+        self.tile_names: list[str] = []
+        self.shape = None
+        self.stats = {'frames': 0, 'changes': 0}
+
+    def _vote(self) -> list[dict] | None:
+        # 枚数も信頼度の合計で多数決し、その枚数のフレームだけで位置ごとに票を数える
+        by_len: dict[int, float] = {}
+        for infos in self.history:
+            by_len[len(infos)] = by_len.get(len(infos), 0.0) + sum(t['conf'] for t in infos) / max(1, len(infos))
+        n = max(by_len, key=by_len.get)
+        frames = [infos for infos in self.history if len(infos) == n]
+        if n == 0:
+            return []
+
+        stable = []
+        for slot in range(n):
+            votes: dict[str, float] = {}
+            confs: dict[str, list[float]] = {}
+            for infos in frames:
+                t = infos[slot]
+                votes[t['class']] = votes.get(t['class'], 0.0) + t['conf']
+                confs.setdefault(t['class'], []).append(t['conf'])
+            name = max(votes, key=votes.get)
+            if votes[name] < self.min_share * sum(votes.values()):
+                return None
+            info = dict(frames[-1][slot])
+            info['class'] = name
+            info['conf'] = sum(confs[name]) / len(confs[name])
+            stable.append(info)
+        return stable
+
+    def update(self, tile_infos: list[dict]) -> dict:
+        """1フレームぶんの検出結果（左から順に並んだ tile_infos）を加える
+
+        Returns:
+            dict: {'infos': 安定した tile_infos, 'names': 安定した牌の名前, 'shape': 待ち,
+                   'changed': 安定した手牌が今回変わったか}
+        """
+        self.stats['frames'] += 1
+        self.history.append(sorted(tile_infos, key=lambda t: t['point']))
+        del self.history[:-self.window]
+
+        stable = self._vote()
+        changed = False
+        if stable is not None:
+            names = [t['class'] for t in stable]
+            if names != self.tile_names or not self.stats['changes']:
+                changed = True
+                self.tile_names = names
+                self.stats['changes'] += 1
+                if self.waits_fn is not None:
+                    self.shape = self.waits_fn(names)
+            # 名前が同じでも位置や信頼度は最新の多数決にそろえる
+            self.tile_infos = stable
+        return {'infos': self.tile_infos, 'names': self.tile_names, 'shape': self.shape, 'changed': changed}
@@ -0,0 +1,535 @@
+from typing import Sequence
+
+# 数牌1色ぶん（9種）の枚数を5進数の整数にエンコードしたものをキーとして、
+# その色単体で取りうる (面子, 塔子, 対子, 孤立牌フラグ) のパレート最適な組を引く表
+#
+# 孤立牌フラグ:
+#   0 → 孤立牌なし
+#   1 → 孤立牌が4枚持ちの牌のみ（mahjong.shanten の四枚使い補正の対象）
+#   2 → それ以外の孤立牌あり
+#
+# mahjong.shanten.Shanten の探索は色ごとに独立しているので、
+# 色ごとの葉の集合を掛け合わせれば元の探索と同じ向聴数になる
+
+SUIT_SIZE = 9
+NUMBER_TILES = 27
+HONOR_TILES = range(27, 34)
+SUIT_OFFSETS = (0, 9, 18)
+TERMINAL_HONOR_INDICES = (0, 8, 9, 17, 18, 26, 27, 28, 29, 30, 31, 32, 33)
+POW5 = tuple(5 ** i for i in range(SUIT_SIZE))
+AGARI_STATE = -1
+
+_ISO_NONE, _ISO_QUADS, _ISO_OTHER = 0, 1, 2
+# 孤立牌フラグの良さ（大きいほど補正を受けにくい）
+_ISO_RANK = {_ISO_QUADS: 0, _ISO_NONE: 1, _ISO_OTHER: 2}
+
+_SUIT_TABLE: dict[int, tuple[tuple[int, int, int, int], ...]] = {}
+
+
+def encode_suit(counts: Sequence[int]) -> int:
+    '''
+    数牌1色ぶんの枚数を5進数の整数に変換する
+
+    :param counts: Sequence[int], 長さ9の枚数列
+
+    :return: int, 5進数エンコードされたキー
+    '''
+    key = 0
+    for i in range(SUIT_SIZE - 1, -1, -1):
+        key = key * 5 + counts[i]
+    return key
+
+
+def decode_suit(key: int) -> list[int]:
+    '''
+    encode_suit の逆変換
+    '''
+    counts = []
+    for _ in range(SUIT_SIZE):
+        key, c = divmod(key, 5)
+        counts.append(c)
+    return counts
+
+
+def _dominates(a: tuple, b: tuple) -> bool:
+    return (
+        a[0] >= b[0] and a[1] >= b[1] and a[2] >= b[2]
+        and _ISO_RANK[a[3]] >= _ISO_RANK[b[3]]
+    )
+
+
+def _pareto(items) -> tuple[tuple[int, int, int, int], ...]:
+    front: list[tuple] = []
+    for item in sorted(set(items), reverse=True):
+        if any(_dominates(f, item) for f in front):
+            continue
+        front = [f for f in front if not _dominates(item, f)]
+        front.append(item)
+    return tuple(front)
+
+
+def _scan_suit(counts: list[int]) -> tuple[tuple[int, int, int, int], ...]:
+    '''
+    mahjong.shanten.Shanten._run を1色ぶんに限定して移植したもの
+    '''
+    c = list(counts)
+    four = [x == 4 for x in c]
+    leaves = set()
+
+    def iso_of(k: int, iso: int) -> int:
+        return max(iso, _ISO_QUADS if four[k] else _ISO_OTHER)
+
+    def run(d: int, m: int, t: int, p: int, iso: int) -> None:
+        while d < SUIT_SIZE and not c[d]:
+            d += 1
+        if d >= SUIT_SIZE:
+            leaves.add((m, t, p, iso))
+            return
+
+        if c[d] == 4:
+            c[d] -= 3
+            if d < 7 and c[d + 2]:
+                if c[d + 1]:
+                    c[d] -= 1; c[d + 1] -= 1; c[d + 2] -= 1
+                    run(d + 1, m + 2, t, p, iso)
+                    c[d] += 1; c[d + 1] += 1; c[d + 2] += 1
+                c[d] -= 1; c[d + 2] -= 1
+                run(d + 1, m + 1, t + 1, p, iso)
+                c[d] += 1; c[d + 2] += 1
+            if d < 8 and c[d + 1]:
+                c[d] -= 1; c[d + 1] -= 1
+                run(d + 1, m + 1, t + 1, p, iso)
+                c[d] += 1; c[d + 1] += 1
+            c[d] -= 1
+            run(d + 1, m + 1, t, p, iso_of(d, iso))
+            c[d] += 1
+            c[d] += 3
+
+            c[d] -= 2
+            if d < 7 and c[d + 2]:
+                if c[d + 1]:
+                    c[d] -= 1; c[d + 1] -= 1; c[d + 2] -= 1
+                    run(d, m + 1, t, p + 1, iso)
+                    c[d] += 1; c[d + 1] += 1; c[d + 2] += 1
+                c[d] -= 1; c[d + 2] -= 1
+                run(d + 1, m, t + 1, p + 1, iso)
+                c[d] += 1; c[d + 2] += 1
+            if d < 8 and c[d + 1]:
+                c[d] -= 1; c[d + 1] -= 1
+                run(d + 1, m, t + 1, p + 1, iso)
+                c[d] += 1; c[d + 1] += 1
+            c[d] += 2
+
+        if c[d] == 3:
+            c[d] -= 3
+            run(d + 1, m + 1, t, p, iso)
+            c[d] += 3
+
+            c[d] -= 2
+            if d < 7 and c[d + 1] and c[d + 2]:
+                c[d] -= 1; c[d + 1] -= 1; c[d + 2] -= 1
+                run(d + 1, m + 1, t, p + 1, iso)
+                c[d] += 1; c[d + 1] += 1; c[d + 2] += 1
+            else:
+                if d < 7 and c[d + 2]:
+                    c[d] -= 1; c[d + 2] -= 1
+                    run(d + 1, m, t + 1, p + 1, iso)
+                    c[d] += 1; c[d + 2] += 1
+                if d < 8 and c[d + 1]:
+                    c[d] -= 1; c[d + 1] -= 1
+                    run(d + 1, m, t + 1, p + 1, iso)
+                    c[d] += 1; c[d + 1] += 1
+            c[d] += 2
+
+            if d < 7 and c[d + 2] >= 2 and c[d + 1] >= 2:
+                c[d] -= 2; c[d + 1] -= 2; c[d + 2] -= 2
+                run(d, m + 2, t, p, iso)
+                c[d] += 2; c[d + 1] += 2; c[d + 2] += 2
+
+        if c[d] == 2:
+            c[d] -= 2
+            run(d + 1, m, t, p + 1, iso)
+            c[d] += 2
+            if d < 7 and c[d + 2] and c[d + 1]:
+                c[d] -= 1; c[d + 1] -= 1; c[d + 2] -= 1
+                run(d, m + 1, t, p, iso)
+                c[d] += 1; c[d + 1] += 1; c[d + 2] += 1
+
+        if c[d] == 1:
+            if d < 6 and c[d + 1] == 1 and c[d + 2] and c[d + 3] != 4:
+                c[d] -= 1; c[d + 1] -= 1; c[d + 2] -= 1
+                run(d + 2, m + 1, t, p, iso)
+                c[d] += 1; c[d + 1] += 1; c[d + 2] += 1
+            else:
+                c[d] -= 1
+                run(d + 1, m, t, p, iso_of(d, iso))
+                c[d] += 1
+                if d < 7 and c[d + 2]:
+                    if c[d + 1]:
+                        c[d] -= 1; c[d + 1] -= 1; c[d + 2] -= 1
+                        run(d + 1, m + 1, t, p, iso)
+                        c[d] += 1; c[d + 1] += 1; c[d + 2] += 1
+                    c[d] -= 1; c[d + 2] -= 1
+                    run(d + 1, m, t + 1, p, iso)
+                    c[d] += 1; c[d + 2] += 1
+                if d < 8 and c[d + 1]:
+                    c[d] -= 1; c[d + 1] -= 1
+                    run(d + 1, m, t + 1, p, iso)
+                    c[d] += 1; c[d + 1] += 1
+
+    run(0, 0, 0, 0, _ISO_NONE)
+    return _pareto(leaves)
+
+
+def suit_table(key: int) -> tuple[tuple[int, int, int, int], ...]:
+    '''
+    5進数キーに対応する1色ぶんの分解候補を返す（初回のみ計算して表に載せる）
+    '''
+    entry = _SUIT_TABLE.get(key)
+    if entry is None:
+        entry = _scan_suit(decode_suit(key))
+        _SUIT_TABLE[key] = entry
+    return entry
+
+
+def precompute_suit_tables(max_tiles: int = 14) -> int:
+    '''
+    1色の枚数合計が max_tiles 以下となる全パターンを表に載せる
+
+    :param max_tiles: int, 1色あたりの最大枚数
+
+    :return: int, 表のエントリ数
+    '''
+    def walk(pos: int, key: int, remain: int) -> None:
+        if pos == SUIT_SIZE:
+            suit_table(key)
+            return
+        for c in range(min(4, remain) + 1):
+            walk(pos + 1, key + c * POW5[pos], remain - c)
+
+    walk(0, 0, max_tiles)
+    return len(_SUIT_TABLE)
+
+
+def _honor_part(tiles_34: Sequence[int]) -> tuple[tuple[int, int, int, int], int]:
+    '''
+    字牌部分を (面子, 塔子, 対子, 孤立牌フラグ) と字牌の4枚持ちの種類数にまとめる
+    '''
+    m = p = quads = 0
+    has_quad = has_single = False
+    for i in HONOR_TILES:
+        c = tiles_34[i]
+        if c == 4:
+            m += 1
+            quads += 1
+            has_quad = True
+        elif c == 3:
+            m += 1
+        elif c == 2:
+            p += 1
+        elif c == 1:
+            has_single = True
+    iso = _ISO_OTHER if has_single else (_ISO_QUADS if has_quad else _ISO_NONE)
+    return (m, 0, p, iso), quads
+
+
+def _jidahai(quads: int, count_of_tiles: int) -> int:
+    if quads and count_of_tiles % 3 == 2:
+        return quads - 1
+    return quads
+
+
+def _merge(a, b) -> tuple[tuple[int, int, int, int], ...]:
+    return _pareto(
+        (x[0] + y[0], x[1] + y[1], x[2] + y[2], max(x[3], y[3]))
+        for x in a for y in b
+    )
+
+
+def _evaluate(rest, suit, init_mentsu: int, jidahai: int) -> int:
+    '''
+    rest と suit の組合せのうち最小の向聴数（mahjong.shanten の _update_result 相当）
+    '''
+    best = 8
+    for rm, rt, rp, riso in rest:
+        rm += init_mentsu
+        for sm, st, sp, siso in suit:
+            m, t, p = rm + sm, rt + st, rp + sp
+            ret = 8 - m * 2 - t - p
+            kouho = m + t
+            if p:
+                kouho += p - 1
+            elif max(riso, siso) == _ISO_QUADS:
+                ret += 1
+            if kouho > 4:
+                ret += kouho - 4
+            if ret != AGARI_STATE and ret < jidahai:
+                ret = jidahai
+            if ret < best:
+                best = ret
+    return best
+
+
+def _chiitoitsu(pairs: int, kinds: int) -> int:
+    if pairs == 7:
+        return AGARI_STATE
+    return 6 - pairs + (7 - kinds if kinds < 7 else 0)
+
+
+def _kokushi(terminals: int, completed: int) -> int:
+    return 13 - terminals - (1 if completed else 0)
+
+
+_TERMINAL_HONOR_SET = frozenset(TERMINAL_HONOR_INDICES)
+
+# _Decomposition.rest の結果を手牌をまたいで共有する表（溢れたら作り直す）
+REST_CACHE_SIZE = 1 << 18
+_REST_CACHE: dict[tuple, tuple] = {}
+
+
+class _Decomposition:
+    '''
+    34配列を色ごとのキーに分解した状態（待ち計算の間だけ使う）
+    '''
+
+    def __init__(self, tiles_34: Sequence[int]):
+        self.tiles = list(tiles_34)
+        self.count = sum(self.tiles)
+        if self.count > 14:
+            raise ValueError(f"Too many tiles = {self.count}")
+        self.keys = [encode_suit(self.tiles[o:o + SUIT_SIZE]) for o in SUIT_OFFSETS]
+        self.suits = [suit_table(k) for k in self.keys]
+        self.honor, self.quads = _honor_part(self.tiles)
+        self.pairs = sum(1 for x in self.tiles if x >= 2)
+        self.kinds = sum(1 for x in self.tiles if x >= 1)
+        self.terminals = sum(1 for i in TERMINAL_HONOR_INDICES if self.tiles[i])
+        self.completed = sum(1 for i in TERMINAL_HONOR_INDICES if self.tiles[i] >= 2)
+        self._rest: dict[int, tuple] = {}
+
+    def rest(self, skip: int):
+        '''
+        skip 番目の色（3 は字牌）以外を掛け合わせた分解候補
+        '''
+        cached = self._rest.get(skip)
+        if cached is None:
+            # 掛け合わせの結果は他の色のキーだけで決まるので、別の手牌とも共有する
+            key = (skip, *(k for s, k in enumerate(self.keys) if s != skip), self.honor if skip != 3 else None)
+            cached = _REST_CACHE.get(key)
+            if cached is None:
+                cached = ((0, 0, 0, _ISO_NONE),)
+                for s in range(3):
+                    if s != skip:
+                        cached = _merge(cached, self.suits[s])
+                if skip != 3:
+                    cached = _merge(cached, (self.honor,))
+                if len(_REST_CACHE) >= REST_CACHE_SIZE:
+                    _REST_CACHE.clear()
+                _REST_CACHE[key] = cached
+            self._rest[skip] = cached
+        return cached
+
+    def part(self, i: int):
+        '''
+        i 番目の色（3 は字牌）の分解候補
+        '''
+        return self.suits[i] if i < 3 else (self.honor,)
+
+    def shanten(self, part: int = 0) -> int:
+        '''
+        向聴数（part 番目の色とそれ以外の掛け合わせで求める。どの色を選んでも値は同じ）
+        '''
+        init_mentsu = (14 - self.count) // 3
+        jidahai = _jidahai(self.quads, self.count)
+        regular = _evaluate(self.rest(part), self.part(part), init_mentsu, jidahai)
+        return min(
+            regular,
+            _chiitoitsu(self.pairs, self.kinds),
+            _kokushi(self.terminals, self.completed),
+        )
+
+    def shanten_with(self, idx: int) -> int:
+        '''
+        idx の牌を1枚加えた場合の向聴数（変化する色だけ引き直す）
+        '''
+        count = self.count + 1
+        init_mentsu = (14 - count) // 3
+        before = self.tiles[idx]
+        if idx < NUMBER_TILES:
+            s, pos = divmod(idx, SUIT_SIZE)
+            suit = suit_table(self.keys[s] + POW5[pos])
+            regular = _evaluate(self.rest(s), suit, init_mentsu, _jidahai(self.quads, count))
+        else:
+            self.tiles[idx] += 1
+            honor, quads = _honor_part(self.tiles)
+            self.tiles[idx] -= 1
+            regular = _evaluate(self.rest(3), (honor,), init_mentsu, _jidahai(quads, count))
+
+        chiitoitsu = _chiitoitsu(self.pairs + (before == 1), self.kinds + (before == 0))
+        kokushi = self.terminals, self.completed
+        if idx in _TERMINAL_HONOR_SET:
+            kokushi = self.terminals + (before == 0), self.completed + (before == 1)
+        return min(regular, chiitoitsu, _kokushi(*kokushi))
+
+    def ukeire(self, current: int) -> dict[int, int]:
+        '''
+        1枚加えると向聴数が current より進む牌と、その残り枚数
+        '''
+        ukeire: dict[int, int] = {}
+        if current < 0:
+            return ukeire
+        # 4枚持ちがなければ、前後2つ以内に牌のない牌を足しても面子手の向聴数は進まないので
+        # 七対子・国士無双だけで判定する（4枚持ちがあると孤立牌フラグの補正が変わりうる）
+        prune = max(self.tiles) < 4
+        for idx in range(34):
+            before = self.tiles[idx]
+            if before > 3:
+                continue
+            if prune and not before and self._isolated(idx):
+                chiitoitsu = _chiitoitsu(self.pairs, self.kinds + 1)
+                terminal = idx in _TERMINAL_HONOR_SET
+                kokushi = _kokushi(self.terminals + terminal, self.completed)
+                if min(chiitoitsu, kokushi) < current:
+                    ukeire[idx] = 4
+                continue
+            if self.shanten_with(idx) < current:
+                ukeire[idx] = 4 - before
+        return ukeire
+
+    def _isolated(self, idx: int) -> bool:
+        if idx >= NUMBER_TILES:
+            return True
+        start = idx - idx % SUIT_SIZE
+        lo, hi = max(start, idx - 2), min(start + SUIT_SIZE - 1, idx + 2)
+        return not any(self.tiles[lo:hi + 1])
+
+
+class IncrementalHand(_Decomposition):
+    '''
+    ツモ・打牌で1枚ずつ変わる手牌の向聴数と待ちを、変わった色だけ引き直して求める
+
+    - 色ごとの分解候補と、2色ずつ・3色ずつ掛け合わせた結果をキャッシュしておき、
+      1枚の出し入れでは変わった色を含むものだけを捨てる
+    - 向聴数は「変わった色」と「それ以外（キャッシュが残っている）」の掛け合わせ1回で求まる
+    - 待ちは calculate_waits と同じく34種を1枚ずつ足して調べるが、掛け合わせはキャッシュから引く
+
+    :param tiles_34: Sequence[int] | None, 初期の34配列（None なら空の手牌）
+    '''
+
+    def __init__(self, tiles_34: Sequence[int] | None = None):
+        super().__init__(tiles_34 if tiles_34 is not None else [0] * 34)
+        self._pair_cache: dict[tuple[int, int], tuple] = {}
+        self._last = 0
+        self._shanten: int | None = None
+        self._ukeire: dict[int, int] | None = None
+
+    def _pair(self, a: int, b: int):
+        cached = self._pair_cache.get((a, b))
+        if cached is None:
+            cached = _merge(self.part(a), self.part(b))
+            self._pair_cache[(a, b)] = cached
+        return cached
+
+    def rest(self, skip: int):
+        cached = self._rest.get(skip)
+        if cached is None:
+            a, b, c = (i for i in range(4) if i != skip)
+            # キャッシュに残っている2色の組があればそれに残りの1色を掛ける
+            order = ((a, b, c), (a, c, b), (b, c, a))
+            x, y, z = next((o for o in order if o[:2] in self._pair_cache), order[0])
+            cached = _merge(self._pair(x, y), self.part(z))
+            self._rest[skip] = cached
+        return cached
+
+    def _change(self, idx: int, delta: int) -> None:
+        before = self.tiles[idx]
+        after = before + delta
+        if not 0 <= after <= 4:
+            raise ValueError(f"tile count out of range: {idx} x{after}")
+        if self.count + delta > 14:
+            raise ValueError(f"Too many tiles = {self.count + delta}")
+        self.tiles[idx] = after
+        self.count += delta
+        self.pairs += (after >= 2) - (before >= 2)
+        self.kinds += (after >= 1) - (before >= 1)
+        if idx in _TERMINAL_HONOR_SET:
+            self.terminals += (after >= 1) - (before >= 1)
+            self.completed += (after >= 2) - (before >= 2)
+        if idx < NUMBER_TILES:
+            part, pos = divmod(idx, SUIT_SIZE)
+            self.keys[part] += delta * POW5[pos]
+            self.suits[part] = suit_table(self.keys[part])
+        else:
+            part = 3
+            self.honor, self.quads = _honor_part(self.tiles)
+        # 変わった色を含まない組だけ残す（rest(part) は part を含まないのでそのまま使える）
+        self._pair_cache = {k: v for k, v in self._pair_cache.items() if part not in k}
+        self._rest = {part: self._rest[part]} if part in self._rest else {}
+        self._last = part
+        self._shanten = None
+        self._ukeire = None
+
+    def add(self, idx: int) -> None:
+        '''
+        idx の牌を1枚加える（ツモ）
+        '''
+        self._change(idx, 1)
+
+    def remove(self, idx: int) -> None:
+        '''
+        idx の牌を1枚除く（打牌）
+        '''
+        self._change(idx, -1)
+
+    def update(self, tiles_34: Sequence[int]) -> None:
+        '''
+        tiles_34 との差分だけを出し入れして同じ手牌にする（先に除いてから加える）
+        '''
+        diff = [(idx, int(c) - have) for idx, (c, have) in enumerate(zip(tiles_34, self.tiles)) if c != have]
+        for idx, d in diff:
+            for _ in range(-d):
+                self.remove(idx)
+        for idx, d in diff:
+            for _ in range(d):
+                self.add(idx)
+
+    def shanten(self, part: int | None = None) -> int:
+        if part is not None:
+            return super().shanten(part)
+        if self._shanten is None:
+            self._shanten = super().shanten(self._last)
+        return self._shanten
+
+    def waits(self) -> tuple[int, dict[int, int]]:
+        '''
+        calculate_waits と同じ (向聴数, {牌の34インデックス: 残り枚数}) を返す
+        '''
+        current = self.shanten()
+        if self._ukeire is None:
+            self._ukeire = self.ukeire(current)
+        return current, dict(self._ukeire)
+
+
+def calculate_shanten(tiles_34: Sequence[int]) -> int:
+    '''
+    表引きで向聴数を返す（mahjong.shanten.Shanten.calculate_shanten と同じ値）
+
+    :param tiles_34: Sequence[int], 34配列
+
+    :return: int, 向聴数（和了は -1）
+    '''
+    return _Decomposition(tiles_34).shanten()
+
+
+def calculate_waits(tiles_34: Sequence[int]) -> tuple[int, dict[int, int]]:
+    '''
+    向聴数と、向聴数を進める牌（聴牌なら待ち牌）を一度の分解でまとめて返す
+
+    :param tiles_34: Sequence[int], 34配列
+
+    :return: tuple
+        - int: 向聴数（和了は -1）
+        - dict[int, int]: {牌の34インデックス: 残り枚数(受け入れ枚数)}、和了の場合は空
+    '''
+    dec = _Decomposition(tiles_34)
+    current = dec.shanten()
+    return current, dec.ukeire(current)
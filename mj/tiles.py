@@ -0,0 +1,162 @@
+from array import array
+from typing import Iterable
+
+from mj.utils import ALL_TILES_NO_RED_TILES
+
+# 整数の牌ID（0..36）
+#
+# - 0..33  → 34配列のインデックスと同じ（ALL_TILES_NO_RED_TILES の並び: 1s..9s, 1p..9p, 1m..9m, 字牌）
+# - 34..36 → 赤5（0s, 0p, 0m）、34配列上は各色の5として扱う
+#
+# この並びは tiles_to_mahjong_array_strings → TilesConverter が作る配列と一致する
+
+TILE_NAMES = (*ALL_TILES_NO_RED_TILES, '0s', '0p', '0m')
+NAME_TO_ID = {name: i for i, name in enumerate(TILE_NAMES)}
+RED_IDS = (34, 35, 36)
+N_TILE_IDS = len(TILE_NAMES)
+
+# 牌ID → 34配列のインデックス
+BASE34 = tuple(i if i < 34 else (i - 34) * 9 + 4 for i in range(N_TILE_IDS))
+# 34配列のインデックス → 赤5の牌ID（5以外は None）
+RED_OF = {BASE34[r]: r for r in RED_IDS}
+
+
+def is_red(tile: int) -> bool:
+    return tile >= 34
+
+
+def names_to_ids(names: Iterable[str]) -> list[int]:
+    '''
+    牌の名前のリストを牌IDのリストに変換する（知らない名前は無視）
+    '''
+    ids = []
+    for name in names:
+        t = NAME_TO_ID.get(name)
+        if t is not None:
+            ids.append(t)
+    return ids
+
+
+def ids_to_names(ids: Iterable[int]) -> list[str]:
+    return [TILE_NAMES[t] for t in ids]
+
+
+def ids_to_34(ids: Iterable[int]) -> list[int]:
+    '''
+    牌IDのリストを34配列に変換する（赤5は5として数える）
+    '''
+    tiles_34 = [0] * 34
+    for t in ids:
+        tiles_34[BASE34[t]] += 1
+    return tiles_34
+
+
+def names_to_34(names: Iterable[str]) -> list[int]:
+    '''
+    牌の名前のリストを直接34配列に変換する
+    tiles_to_mahjong_array_strings(need_aka=False) → TilesConverter.string_to_34_array と同じ結果
+    '''
+    tiles_34 = [0] * 34
+    for name in names:
+        t = NAME_TO_ID.get(name)
+        if t is not None:
+            tiles_34[BASE34[t]] += 1
+    return tiles_34
+
+
+def ids_to_136(ids: Iterable[int], has_aka: bool = False) -> list[int]:
+    '''
+    牌IDのリストを136配列に変換する
+    TilesConverter.string_to_136_array と同じく色ごとにまとめ、色の中では入力順を保つ
+
+    赤ありなら赤5は各色の5の1枚目（例: 16）、通常の5は2枚目以降に割り当てる
+    赤なしなら赤5は通常の5として扱う
+    '''
+    groups: list[list[int]] = [[], [], [], []]
+    seen = [0] * 34
+    for t in ids:
+        base = BASE34[t]
+        if has_aka and t >= 34:
+            groups[base // 9 if base < 27 else 3].append(base * 4)
+            continue
+        start = 1 if has_aka and base in RED_OF else 0
+        groups[base // 9 if base < 27 else 3].append(base * 4 + start + seen[base])
+        seen[base] += 1
+    return groups[0] + groups[1] + groups[2] + groups[3]
+
+
+class TileHand:
+    '''
+    34種の枚数と赤5の枚数を array で持つ手牌
+    '''
+
+    __slots__ = ('counts', 'reds')
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.counts = array('B', bytes(34))
+        self.reds = array('B', bytes(3))
+        for t in ids:
+            self.add(t)
+
+    @classmethod
+    def from_names(cls, names: Iterable[str]) -> 'TileHand':
+        return cls(names_to_ids(names))
+
+    def add(self, tile: int) -> None:
+        self.counts[BASE34[tile]] += 1
+        if tile >= 34:
+            self.reds[tile - 34] += 1
+
+    def remove(self, tile: int) -> None:
+        '''
+        1枚取り除く（赤5を指定した場合は赤を、通常の5を指定した場合は通常の5を優先して減らす）
+        '''
+        base = BASE34[tile]
+        if not self.counts[base]:
+            raise ValueError(f"tile not in hand: {TILE_NAMES[tile]}")
+        red = RED_OF.get(base)
+        if red is not None:
+            n_red = self.reds[red - 34]
+            if tile >= 34 and not n_red:
+                raise ValueError(f"tile not in hand: {TILE_NAMES[tile]}")
+            if tile >= 34 or self.counts[base] == n_red:
+                self.reds[red - 34] -= 1
+        self.counts[base] -= 1
+
+    def copy(self) -> 'TileHand':
+        hand = TileHand()
+        hand.counts[:] = self.counts
+        hand.reds[:] = self.reds
+        return hand
+
+    def __len__(self) -> int:
+        return sum(self.counts)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TileHand) and self.counts == other.counts and self.reds == other.reds
+
+    def __hash__(self) -> int:
+        return hash((self.counts.tobytes(), self.reds.tobytes()))
+
+    def ids(self) -> list[int]:
+        '''
+        牌IDを34配列の順に並べたリスト（赤5は同じ色の5の先頭）
+        '''
+        ids = []
+        for base, c in enumerate(self.counts):
+            if not c:
+                continue
+            red = RED_OF.get(base)
+            n_red = self.reds[red - 34] if red is not None else 0
+            ids.extend([red] * n_red)
+            ids.extend([base] * (c - n_red))
+        return ids
+
+    def names(self) -> list[str]:
+        return ids_to_names(self.ids())
+
+    def to_34(self) -> list[int]:
+        return list(self.counts)
+
+    def to_136(self, has_aka: bool = False) -> list[int]:
+        return ids_to_136(self.ids(), has_aka=has_aka)
@@ -1,5 +1,5 @@
-from mahjong.tile import TilesConverter
 from mahjong.meld import Meld
+from mj.tiles import ids_to_136, names_to_ids
 from mj.utils import tiles_to_mahjong_array_strings, RED_TILES
 from typing import List, TypedDict, Literal
 
@@ -39,10 +39,7 @@ def convert_to_melds(actions: List[ActionDict]) -> List[Meld]:
                 tiles.insert(2, {'tile': candidates.pop(), 'fromOther': False})
                 act['action_type'] = 'chkan'
 
-        sou, pin, man, honors = tile_infos_to_string(tiles)
-        path = TilesConverter.string_to_136_array(
-            man=man, pin=pin, sou=sou, honors=honors
-        )
+        path = ids_to_136(names_to_ids(t['tile'] for t in tiles))
 
         opened = any(t.get('fromOther') for t in tiles)
         meld_const = meld_type_map[act['action_type']]
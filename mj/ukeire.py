@@ -0,0 +1,172 @@
+from functools import lru_cache
+from typing import Iterable
+
+from mj.machi import INDEX_TO_TILE
+from mj.shanten_table import calculate_shanten, calculate_waits
+from mj.tiles import BASE34, NAME_TO_ID, names_to_34
+
+# 牌効率（受け入れ枚数）で打牌を決めるための関数群
+#
+# - 受け入れ: 打牌後の13枚の向聴数を進める牌の種類と、見えていない残り枚数
+# - 二次受け入れ: 受け入れ牌をツモったあと、向聴数を保つ最善の打牌をした場合の受け入れ枚数を
+#   ツモる牌の残り枚数で重み付けして足したもの（聴牌からの打牌では 0）
+# - 同じ13枚の向聴数・受け入れ牌は何度も現れるので lru_cache で使い回す
+
+@lru_cache(maxsize=65536)
+def _shanten(tiles_34: tuple[int, ...]) -> int:
+    return calculate_shanten(tiles_34)
+
+
+@lru_cache(maxsize=65536)
+def cached_waits(tiles_34: tuple[int, ...]) -> tuple[int, tuple[int, ...]]:
+    '''
+    calculate_waits の結果を (向聴数, 受け入れ牌の34インデックスのタプル) にして覚えておく
+    '''
+    current, ukeire = calculate_waits(tiles_34)
+    return current, tuple(ukeire)
+
+
+def visible_to_34(visible: Iterable[str] | None) -> list[int]:
+    '''
+    場に見えている牌（河、ドラ表示牌、他家の鳴き）の名前のリストを34配列にする
+    '''
+    return names_to_34(visible or [])
+
+
+def _remaining(idx: int, seen: list[int], visible: list[int]) -> int:
+    return max(0, 4 - seen[idx] - visible[idx])
+
+
+def _ukeire_count(accepts: tuple[int, ...], seen: list[int], visible: list[int]) -> int:
+    return sum(_remaining(t, seen, visible) for t in accepts)
+
+
+def _second_ukeire(hand_13: list[int], discard: int, shanten: int, accepts: tuple[int, ...], visible: list[int]) -> int:
+    '''
+    受け入れ牌 t をツモったあと、向聴数が shanten - 1 になる打牌のうち受け入れ最大のものを選び、
+    その受け入れ枚数を t の残り枚数で重み付けして足す
+    '''
+    # 自分の手と、さっき切った牌は見えている
+    seen_13 = list(hand_13)
+    seen_13[discard] += 1
+    total = 0
+    for t in accepts:
+        weight = _remaining(t, seen_13, visible)
+        if not weight:
+            continue
+        hand_14 = list(hand_13)
+        hand_14[t] += 1
+        seen_14 = list(seen_13)
+        seen_14[t] += 1
+        best = 0
+        for d in range(34):
+            # ツモった牌をそのまま切ると向聴数は戻るので調べない
+            if not hand_14[d] or d == t:
+                continue
+            hand_14[d] -= 1
+            key = tuple(hand_14)
+            if _shanten(key) == shanten - 1:
+                _, accepts_2 = cached_waits(key)
+                best = max(best, _ukeire_count(accepts_2, seen_14, visible))
+            hand_14[d] += 1
+        total += weight * best
+    return total
+
+
+def discard_table(
+    hand: list[str],
+    visible: Iterable[str] | None = None,
+    second: int = 5,
+) -> list[dict]:
+    '''
+    14枚（3n+2枚）の手牌から切れる牌ごとに、打牌後の向聴数・受け入れ・二次受け入れを求める
+
+    :param hand: list[str], 牌の名前のリスト（MYYOLO の tile_names など。赤5は5として数える）
+    :param visible: Iterable[str] | None, 場に見えている牌の名前（受け入れ枚数から除く）
+    :param second: int, 二次受け入れを求める候補の数（向聴数が最小の打牌のうち受け入れの多い順。0 なら求めない）
+
+    :return: list[dict], 良い順に並べた打牌候補
+        - 'discard': 切る牌の名前
+        - 'shanten': 打牌後の向聴数
+        - 'ukeire': 受け入れ枚数の合計
+        - 'tiles': {牌の名前: 残り枚数}
+        - 'ukeire2': 二次受け入れ（計算しなかった候補は None）
+    '''
+    tiles_34 = names_to_34(hand)
+    if sum(tiles_34) % 3 != 2:
+        raise ValueError(f"hand must have 3n+2 tiles: {sum(tiles_34)}")
+    visible_34 = visible_to_34(visible)
+
+    candidates = []
+    for name in dict.fromkeys(hand):
+        tile_id = NAME_TO_ID.get(name)
+        if tile_id is None:
+            continue
+        idx = BASE34[tile_id]
+        hand_13 = list(tiles_34)
+        hand_13[idx] -= 1
+        shanten, accepts = cached_waits(tuple(hand_13))
+        candidates.append({
+            'discard': name,
+            'shanten': shanten,
+            'ukeire': _ukeire_count(accepts, tiles_34, visible_34),
+            'tiles': {INDEX_TO_TILE[t]: _remaining(t, tiles_34, visible_34) for t in accepts},
+            'ukeire2': None,
+            '_idx': idx,
+            '_hand': hand_13,
+            '_accepts': accepts,
+        })
+
+    candidates.sort(key=lambda c: (c['shanten'], -c['ukeire'], c['_idx']))
+    if second and candidates:
+        best = candidates[0]['shanten']
+        # 5 と赤5のように同じ牌を切る候補は1度だけ計算する
+        done: dict[int, int] = {}
+        for c in candidates:
+            if c['shanten'] != best or (len(done) >= second and c['_idx'] not in done):
+                break
+            if c['_idx'] not in done:
+                done[c['_idx']] = (
+                    _second_ukeire(c['_hand'], c['_idx'], c['shanten'], c['_accepts'], visible_34)
+                    if c['shanten'] > 0 else 0
+                )
+            c['ukeire2'] = done[c['_idx']]
+
+    # 同じ評価なら赤5は残し、牌の並び順で決める
+    candidates.sort(key=lambda c: (
+        c['shanten'],
+        -c['ukeire'],
+        -(c['ukeire2'] or 0),
+        c['discard'].startswith('0'),
+        c['_idx'],
+    ))
+    for c in candidates:
+        del c['_idx'], c['_hand'], c['_accepts']
+    return candidates
+
+
+def recommend_discard(hand: list[str], visible: Iterable[str] | None = None) -> dict | None:
+    '''
+    discard_table の先頭（最も良い打牌）を返す（候補がなければ None）
+    '''
+    table = discard_table(hand, visible)
+    return table[0] if table else None
+
+
+def greedy_discard(hand_14: list[int], visible_34: list[int]) -> int:
+    '''
+    34配列の14枚から、向聴数が最小で受け入れ（自分の手と visible_34 を除いた残り枚数）が最大になる打牌を返す
+
+    二次受け入れは見ない（シミュレーションの中で何度も呼ぶ用途向け）。同じ評価なら牌の並び順で先のもの
+    '''
+    best, best_key = -1, None
+    for d in range(34):
+        if not hand_14[d]:
+            continue
+        hand_14[d] -= 1
+        shanten, accepts = cached_waits(tuple(hand_14))
+        hand_14[d] += 1
+        key = (shanten, -_ukeire_count(accepts, hand_14, visible_34))
+        if best_key is None or key < best_key:
+            best, best_key = d, key
+    return best
@@ -0,0 +1,327 @@
+"""録画した対局動画から手牌の変化を牌譜の Step 形式で書き出すバッチ処理
+
+    python -m mj.video_kifu videos/ --out kifu_out/ --workers 4 --interval 0.5
+
+- 動画ごとに別プロセスで VideoStream（block）→ HandCropper → TileTracker → HandStabilizer を回し、
+  多数決した手牌が変わったときだけイベントを1行書く
+- 出力は動画ごとに <out>/<動画名>.jsonl（または .parquet）。書き終わってから名前を付け替えるので、
+  途中で止めても次回は書き終わった動画を飛ばして続きから処理できる
+- 1行は {"video", "time", "frame", "waits", "step"}。step は Kifu API の Step と同じ形
+  （index, actor, action, tile, hands, points, doraIndicators, note）で、字牌は E/S/W/N/P/F/C で表す
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from mj.machi import IncrementalMachi
+from mj.video_stream import BLOCK, DECODE_MODES, VideoStream
+
+VIDEO_SUFFIXES = ('.mp4', '.mov', '.avi', '.mkv')
+# mj の字牌の名前 → 牌譜（Kifu API）の表記
+KIFU_HONORS = {'to': 'E', 'na': 'S', 'sh': 'W', 'pe': 'N', 'hk': 'P', 'ht': 'F', 'ty': 'C'}
+
+# ワーカープロセスごとに1つだけ読み込む検出器
+_DETECTOR = None
+# 解析に失敗したフレームがこの割合を超えた動画は失敗として出力しない（重みの取り違えなど）
+MAX_ERROR_RATIO = 0.5
+
+
+def to_kifu_tile(name: str) -> str:
+    return KIFU_HONORS.get(name, name)
+
+
+def hand_events(prev: list[str] | None, cur: list[str]) -> list[tuple[str, str | None]]:
+    """前後の手牌の差から (action, tile) の列を求める
+
+    1枚増えたらツモ（draw）、1枚減ったら打牌（discard）、1枚入れ替わったらツモと打牌、
+    それ以外（鳴きや認識の揺れ）は手牌の更新（update）として扱う
+    """
+    if prev is None:
+        return [('start', None)]
+    added = list((Counter(cur) - Counter(prev)).elements())
+    removed = list((Counter(prev) - Counter(cur)).elements())
+    if len(added) == 1 and not removed:
+        return [('draw', added[0])]
+    if len(removed) == 1 and not added:
+        return [('discard', removed[0])]
+    if len(added) == 1 and len(removed) == 1:
+        return [('draw', added[0]), ('discard', removed[0])]
+    return [('update', None)]
+
+
+def _init_worker(weights: str, backend: str, threads: int) -> None:
+    global _DETECTOR
+    if backend == 'onnx':
+        from mj.models.tehai.onnx_detector import OnnxTehaiDetector
+        _DETECTOR = OnnxTehaiDetector(weights, intra_op_threads=threads)
+    else:
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        from mj.models.tehai.myyolo import TehaiDetector
+        _DETECTOR = TehaiDetector(weights)
+
+
+def analyze_video(
+    path: str,
+    detector=None,
+    every_n: int = 1,
+    interval_sec: float | None = 0.5,
+    target_width: int | None = None,
+    stable_window: int = 3,
+    actor: str = 'E',
+    conf: float = 0.5,
+    iou: float = 0.5,
+    decode: str = 'grab',
+    decode_threads: int | None = None,
+    hw_accel: bool = False,
+):
+    """1本の動画を解析し、手牌が変わるたびに1行ぶんの dict を返すジェネレータ（最後に統計の dict を返す）
+
+    detector を省くと run_batch のワーカーで読み込んだ検出器を使う（どちらもなければ ValueError）。
+    統計の 'errors' は解析に失敗したフレーム数、'error' は最初の失敗の内容
+    """
+    from mj.models.tehai.crop import HandCropper
+    from mj.models.tehai.tracking import HandStabilizer, TileTracker
+
+    detector = _DETECTOR if detector is None else detector
+    if detector is None:
+        raise ValueError("検出器がありません: analyze_video に detector を渡してください（TehaiDetector など）")
+    cropper = HandCropper()
+    tracker = TileTracker(lambda f: cropper.detect(detector, f, conf=conf, iou=iou), waits=None)
+    stabilizer = HandStabilizer(window=stable_window, waits=IncrementalMachi())
+    stream = VideoStream(
+        path,
+        lambda f: stabilizer.update(tracker.update(f)['infos']),
+        queue_depth=4,
+        every_n=every_n,
+        interval_sec=interval_sec,
+        policy=BLOCK,
+        target_width=target_width,
+        decode=decode,
+        decode_threads=decode_threads,
+        hw_accel=hw_accel,
+    )
+
+    video = Path(path).name
+    prev: list[str] | None = None
+    index = 0
+    first_error = None
+    start = time.perf_counter()
+    for item in stream:
+        if 'error' in item:
+            first_error = first_error or item['error']
+            continue
+        stable = item['result']
+        # 手牌が映っていないあいだは直前の手牌を覚えたままにする
+        if not stable['changed'] or not stable['names']:
+            continue
+        names = stable['names']
+        shape = stable['shape']
+        waits = [to_kifu_tile(w) for w in shape] if isinstance(shape, list) else []
+        for action, tile in hand_events(prev, names):
+            yield {
+                'video': video,
+                'time': round(item['time'], 3),
+                'frame': item['index'],
+                'waits': waits,
+                'step': {
+                    'index': index,
+                    'actor': actor,
+                    'action': action,
+                    'tile': to_kifu_tile(tile) if tile else None,
+                    'hands': {actor: [to_kifu_tile(t) for t in names]},
+                    'points': {},
+                    'doraIndicators': [],
+                    'note': shape if isinstance(shape, str) else None,
+                },
+            }
+            index += 1
+        prev = names
+
+    seconds = time.perf_counter() - start
+    stats = stream.stats_snapshot()
+    stats.update({
+        'video': video,
+        'opened': stream.opened,
+        'events': index,
+        'error': first_error,
+        'seconds': seconds,
+        # seek で飛ばしたフレームも動画を進めた分として数える
+        'frames': stats['read'] + stats['skipped'],
+        'frames_per_sec': (stats['read'] + stats['skipped']) / seconds if seconds else 0.0,
+        'analyzed_per_sec': stats['processed'] / seconds if seconds else 0.0,
+    })
+    return stats
+
+
+def _write_jsonl(rows, path: Path) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def _write_parquet(rows, path: Path) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:  # pragma: no cover - optional dependency
+        raise ImportError("Parquet で書き出すには pyarrow が必要です: uv pip install pyarrow") from exc
+    flat = [
+        {
+            'video': r['video'], 'time': r['time'], 'frame': r['frame'], 'waits': r['waits'],
+            **{k: v for k, v in r['step'].items() if k not in ('hands', 'points')},
+            'hand': next(iter(r['step']['hands'].values())),
+        }
+        for r in rows
+    ]
+    pq.write_table(pa.Table.from_pylist(flat), path)
+
+
+def _failed_too_often(stats: dict) -> bool:
+    attempted = stats['processed'] + stats['errors']
+    return attempted > 0 and stats['errors'] / attempted > MAX_ERROR_RATIO
+
+
+def _run_one(path: str, out_path: str, fmt: str, options: dict) -> dict:
+    rows = []
+    gen = analyze_video(path, detector=_DETECTOR, **options)
+    while True:
+        try:
+            rows.append(next(gen))
+        except StopIteration as stop:
+            stats = stop.value
+            break
+    out = Path(out_path)
+    part = out.with_name(out.name + '.part')
+    # 開けなかった動画と、解析の失敗が多すぎた動画は出力せず、次回もう一度処理する
+    if not stats['opened'] or _failed_too_often(stats):
+        part.unlink(missing_ok=True)
+        if stats['opened']:
+            raise RuntimeError(
+                f"解析に失敗したフレームが多すぎます（{stats['errors']}/{stats['processed'] + stats['errors']}）: "
+                f"{stats['error']}"
+            )
+        return stats
+    (_write_parquet if fmt == 'parquet' else _write_jsonl)(rows, part)
+    os.replace(part, out)
+    return stats
+
+
+def list_videos(folder: str) -> list[Path]:
+    return sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in VIDEO_SUFFIXES)
+
+
+def run_batch(
+    video_dir: str,
+    out_dir: str,
+    weights: str,
+    backend: str = 'pt',
+    workers: int = 2,
+    threads: int = 0,
+    fmt: str = 'jsonl',
+    **options,
+) -> dict:
+    """フォルダ内の動画を workers 個のプロセスで解析し、動画ごとに牌譜のイベント列を書き出す
+
+    出力が既にある動画は飛ばす（途中で止めても続きから処理できる）
+
+    Returns:
+        dict: {'videos': 処理した本数, 'skipped': 飛ばした本数, 'failed': [(動画, エラー)],
+               'frames': 読んだフレーム数, 'analyzed': 解析したフレーム数, 'errors': 解析に失敗したフレーム数, 'seconds': 経過秒数, 'frames_per_sec'}
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    suffix = '.parquet' if fmt == 'parquet' else '.jsonl'
+    todo, skipped = [], 0
+    for video in list_videos(video_dir):
+        target = out / f"{video.stem}{suffix}"
+        if target.exists():
+            skipped += 1
+            continue
+        todo.append((str(video), str(target)))
+
+    summary = {'videos': 0, 'skipped': skipped, 'failed': [], 'frames': 0, 'analyzed': 0, 'errors': 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=max(1, workers),
+        initializer=_init_worker,
+        initargs=(weights, backend, threads),
+    ) as pool:
+        futures = {pool.submit(_run_one, v, t, fmt, options): v for v, t in todo}
+        for future in as_completed(futures):
+            video = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                summary['failed'].append((video, str(e)))
+                print(f"[失敗] {video}: {e}", flush=True)
+                continue
+            if not stats['opened']:
+                summary['failed'].append((video, "動画を開けませんでした"))
+                print(f"[失敗] {video}: 動画を開けませんでした", flush=True)
+                continue
+            summary['videos'] += 1
+            summary['frames'] += stats['frames']
+            summary['analyzed'] += stats['processed']
+            summary['errors'] += stats['errors']
+            elapsed = time.perf_counter() - start
+            print(
+                f"[{summary['videos']}/{len(todo)}] {stats['video']}: {stats['events']}件 "
+                f"{stats['frames_per_sec']:.1f} fps（解析 {stats['analyzed_per_sec']:.1f} fps）"
+                f"｜全体 {summary['frames'] / elapsed:.1f} fps",
+                flush=True,
+            )
+    summary['seconds'] = time.perf_counter() - start
+    summary['frames_per_sec'] = summary['frames'] / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="対局動画のフォルダから手牌の変化を牌譜の Step 形式で書き出す")
+    parser.add_argument("video_dir")
+    parser.add_argument("--out", required=True, help="出力フォルダ")
+    parser.add_argument("--weights", default="mj/models/tehai/weights/best.pt")
+    parser.add_argument("--backend", choices=("pt", "onnx"), default="pt")
+    parser.add_argument("--workers", type=int, default=2, help="動画を並列に処理するプロセス数")
+    parser.add_argument("--threads", type=int, default=0, help="プロセスごとの推論スレッド数（0 は既定）")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--every-n", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=0.5, help="解析する間隔（動画内の秒）")
+    parser.add_argument("--width", type=int, default=None, help="解析前に縮小する幅")
+    parser.add_argument("--window", type=int, default=3, help="多数決のフレーム数")
+    parser.add_argument("--decode", choices=DECODE_MODES, default="grab", help="解析しないフレームの読み飛ばし方")
+    parser.add_argument("--decode-threads", type=int, default=None, help="FFmpeg のデコードスレッド数")
+    parser.add_argument("--hw-accel", action="store_true", help="使えればハードウェアデコードを使う")
+    parser.add_argument("--actor", default="E", help="手牌の持ち主の席（E/S/W/N）")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(
+        args.video_dir,
+        args.out,
+        args.weights,
+        backend=args.backend,
+        workers=args.workers,
+        threads=args.threads,
+        fmt=args.format,
+        every_n=args.every_n,
+        interval_sec=args.interval or None,
+        target_width=args.width,
+        stable_window=args.window,
+        actor=args.actor,
+        decode=args.decode,
+        decode_threads=args.decode_threads,
+        hw_accel=args.hw_accel,
+    )
+    print(
+        f"完了: {summary['videos']}本（スキップ {summary['skipped']}本、失敗 {len(summary['failed'])}本）"
+        f" {summary['frames']}フレーム / {summary['seconds']:.1f}秒 = {summary['frames_per_sec']:.1f} fps"
+    )
+
+
+if __name__ == "__main__":
+    main()
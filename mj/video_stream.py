@@ -0,0 +1,387 @@
+"""動画を読みながら1フレームずつ解析する汎用のストリーミング処理
+
+読み込みスレッド → フレームのキュー → 推論スレッド → 結果のキュー → 利用側
+という流れを Streamlit から切り離したもの（画面表示・バッチ処理・サーバーで共通に使う）
+
+    stream = VideoStream("game.mp4", detector.detect, every_n=5, policy="block")
+    for item in stream:
+        print(item['index'], item['time'], item['result'])
+
+- queue_depth: 各キューに溜められる件数
+- every_n / interval_sec: 何フレームごと／何秒ごと（動画内の時刻）に解析するか
+- policy: キューが詰まったとき "drop" なら古いものを捨てて最新を残し、"block" なら空くまで待つ
+  （画面表示は "drop"、取りこぼしたくないバッチ処理は "block"）
+- decode: 解析しないフレームは grab だけで済ませ（"grab"）、間隔が長ければ位置を指定して飛ばす（"seek"）
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
+
+import cv2
+import numpy as np
+
+DROP = "drop"
+BLOCK = "block"
+POLICIES = (DROP, BLOCK)
+
+# 読み込み・推論の終わりを知らせる目印
+_END = object()
+
+
+# フレームの読み方
+# - "read": 全フレームをデコードして画像にする（以前の FrameGrabber と同じ）
+# - "grab": 全フレームを grab し、解析するフレームだけ retrieve で画像にする
+# - "seek": 次に解析するフレームが seek_min_gap 以上先なら位置を指定して飛ばす（間隔が長いとき向け）
+DECODE_MODES = ("read", "grab", "seek")
+
+def open_capture(path: str, threads: int | None = None, hw_accel: bool = False) -> cv2.VideoCapture:
+    """FFmpeg で開けなければ OpenCV の既定のバックエンドで開き直す
+
+    Args:
+        threads (int, optional): FFmpeg のデコードスレッド数（None なら OpenCV の既定、0 は自動）
+        hw_accel (bool, optional): 使えればハードウェアデコードを使う
+    """
+    params = []
+    if hw_accel:
+        params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    if threads is not None and hasattr(cv2, "CAP_PROP_N_THREADS"):
+        params += [cv2.CAP_PROP_N_THREADS, threads]
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, params)
+    if not cap.isOpened():
+        cap = cv2.VideoCapture(path)
+    return cap
+
+
+class FrameSampler:
+    """解析するフレームを選ぶ（every_n フレームごと、かつ前回から interval_sec 秒以上）"""
+
+    def __init__(self, every_n: int = 1, interval_sec: float | None = None):
+        self.every_n = max(1, int(every_n))
+        self.interval_sec = interval_sec
+        self._last_t: float | None = None
+
+    def accept(self, index: int, t: float) -> bool:
+        if index % self.every_n:
+            return False
+        if self.interval_sec:
+            if self._last_t is not None and t - self._last_t < self.interval_sec:
+                return False
+            self._last_t = t
+        return True
+
+
+def _put(q: queue.Queue, item, policy: str, stop_evt: threading.Event) -> bool:
+    """policy に従って item を入れる（"drop" で古いものを捨てたら True を返す）"""
+    if policy == BLOCK:
+        while not stop_evt.is_set():
+            try:
+                q.put(item, timeout=0.05)
+                return False
+            except queue.Full:
+                continue
+        return False
+    dropped = False
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped = True
+            except queue.Empty:
+                pass
+
+
+def _put_end(q: queue.Queue, stop_evt: threading.Event) -> None:
+    """終わりの目印は policy に関係なく必ず届ける
+    （溜まっているものが受け取られるのを待ち、止められたときだけ古いものを捨てる）
+    """
+    while not stop_evt.is_set():
+        try:
+            q.put(_END, timeout=0.05)
+            return
+        except queue.Full:
+            continue
+    while True:
+        try:
+            q.put_nowait(_END)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class VideoStream:
+    """動画を読み込みながら detect を各フレームに適用し、結果を入力順に返す
+
+    Args:
+        source (str | int): 動画のパス、URL、カメラ番号
+        detect (Callable[[np.ndarray], Any]): 1フレームを受け取り解析結果を返す関数
+        queue_depth (int, optional): フレーム・結果それぞれのキューの長さ
+        every_n (int, optional): 何フレームごとに解析するか
+        interval_sec (float, optional): 解析する間隔（動画内の時刻で何秒ごとか）
+        policy (str, optional): キューが詰まったときの動き（"drop" / "block"）
+        target_width (int, optional): 解析前にこの幅へ縮小する
+        rgb (bool, optional): detect に RGB で渡すか（既定は OpenCV のまま BGR）
+        realtime (bool, optional): 動画の再生速度に合わせて読み込むか（画面表示向け）
+        keep_frames (bool, optional): 結果に解析したフレームを含めるか
+        decode (str, optional): フレームの読み方（"read" / "grab" / "seek"、DECODE_MODES を参照）
+        decode_threads (int, optional): FFmpeg のデコードスレッド数（None なら OpenCV の既定）
+        hw_accel (bool, optional): 使えればハードウェアデコードを使う
+        seek_min_gap (int, optional): "seek" で位置を指定して飛ばす最小のフレーム数
+
+    各フレームの結果は dict:
+        {'index': フレーム番号, 'time': 動画内の時刻(秒), 'frame': ndarray | None,
+         'result': detect の戻り値, 'infer_ms': 解析時間(ms)}
+        失敗したときは 'result' / 'infer_ms' の代わりに 'error': str
+    """
+
+    def __init__(
+        self,
+        source: str | int,
+        detect: Callable[[np.ndarray], Any],
+        queue_depth: int = 1,
+        every_n: int = 1,
+        interval_sec: float | None = None,
+        policy: str = DROP,
+        target_width: int | None = None,
+        rgb: bool = False,
+        realtime: bool = False,
+        keep_frames: bool = False,
+        decode: str = "grab",
+        decode_threads: int | None = None,
+        hw_accel: bool = False,
+        seek_min_gap: int = 30,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}: {policy}")
+        if decode not in DECODE_MODES:
+            raise ValueError(f"decode must be one of {DECODE_MODES}: {decode}")
+        self.source = source
+        self.detect = detect
+        self.sampler = FrameSampler(every_n, interval_sec)
+        self.policy = policy
+        self.target_width = target_width
+        self.rgb = rgb
+        self.realtime = realtime
+        self.keep_frames = keep_frames
+        self.decode = decode
+        self.decode_threads = decode_threads
+        self.hw_accel = hw_accel
+        self.seek_min_gap = max(2, seek_min_gap)
+        self.frame_q: queue.Queue = queue.Queue(maxsize=max(1, queue_depth))
+        self.result_q: queue.Queue = queue.Queue(maxsize=max(1, queue_depth))
+        self.stop_evt = threading.Event()
+        self.ready = threading.Event()
+        self.opened = False
+        self.fps = 0.0
+        self.last_frame: np.ndarray | None = None
+        self.stats = {'read': 0, 'retrieved': 0, 'skipped': 0, 'sampled': 0, 'dropped': 0, 'processed': 0, 'errors': 0}
+        # 読み込みと推論の両方のスレッドが stats を数えるので、足すときと写すときはロックを取る
+        self._stats_lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def stats_snapshot(self) -> dict:
+        """stats をロックを取って写したもの（スレッドが動いている間に読むとき用）"""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    # --- 起動・停止 ---
+
+    def start(self, timeout: float | None = 3.0) -> VideoStream:
+        """読み込みと推論のスレッドを起動し、動画が開けたかどうかが分かるまで待つ"""
+        if self._threads:
+            return self
+        self._threads = [
+            threading.Thread(target=self._grab, daemon=True),
+            threading.Thread(target=self._infer, daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        self.ready.wait(timeout=timeout)
+        return self
+
+    def stop(self) -> None:
+        self.stop_evt.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+
+    def __enter__(self) -> VideoStream:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # --- 読み込み ---
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        if self.target_width:
+            h, w = frame.shape[:2]
+            scale = self.target_width / max(1, w)
+            if scale != 1.0:
+                frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        if self.rgb:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
+
+    def _grab(self) -> None:
+        if isinstance(self.source, str):
+            cap = open_capture(self.source, threads=self.decode_threads, hw_accel=self.hw_accel)
+        else:
+            cap = cv2.VideoCapture(self.source)
+        self.opened = bool(cap is not None and cap.isOpened())
+        self.fps = float(cap.get(cv2.CAP_PROP_FPS) or 0.0) if self.opened else 0.0
+        self.ready.set()
+        if not self.opened:
+            _put_end(self.frame_q, self.stop_evt)
+            return
+
+        start = time.perf_counter()
+        index = 0
+        # "seek" で飛ばしたフレームは次の grab が成功してから数える（動画の終わりを越えて飛ばしたときに多く数えない）
+        skip_from: int | None = None
+        try:
+            while not self.stop_evt.is_set():
+                if self.decode == "read":
+                    ok, frame = cap.read()
+                    self._count('retrieved', ok)
+                else:
+                    # 解析しないフレームは grab だけして BGR 画像への変換・コピーを省く
+                    ok, frame = cap.grab(), None
+                if not ok:
+                    if skip_from is not None:
+                        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+                        self._count('skipped', max(0, min(total, index) - skip_from))
+                    break
+                if skip_from is not None:
+                    self._count('skipped', index - skip_from)
+                    skip_from = None
+                self._count('read')
+                i, index = index, index + 1
+                t = self._timestamp(cap, i)
+                if self.realtime:
+                    wait = t - (time.perf_counter() - start)
+                    if wait > 0:
+                        self.stop_evt.wait(wait)
+                if not self.sampler.accept(i, t):
+                    continue
+                if frame is None:
+                    ok, frame = cap.retrieve()
+                    if not ok:
+                        continue
+                    self._count('retrieved')
+                if self.decode == "seek":
+                    target = self._seek(cap, i, index)
+                    if target != index:
+                        skip_from, index = index, target
+                frame = self._prepare(frame)
+                self.last_frame = frame
+                self._count('sampled')
+                if _put(self.frame_q, (i, t, frame), self.policy, self.stop_evt):
+                    self._count('dropped')
+        finally:
+            cap.release()
+            _put_end(self.frame_q, self.stop_evt)
+
+    def _seek(self, cap: cv2.VideoCapture, current: int, index: int) -> int:
+        """次に解析するフレームまで十分離れていれば位置を指定して飛ばし、次に読むフレーム番号を返す"""
+        gap = self.sampler.every_n
+        if self.sampler.interval_sec and self.fps > 0:
+            gap = max(gap, math.ceil(self.sampler.interval_sec * self.fps))
+            gap = math.ceil(gap / self.sampler.every_n) * self.sampler.every_n
+        if gap < self.seek_min_gap:
+            return index
+        target = current + gap
+        if not cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+            return index
+        return target
+
+    def _timestamp(self, cap: cv2.VideoCapture, index: int) -> float:
+        msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if msec and msec > 0:
+            return msec / 1000.0
+        return index / self.fps if self.fps > 0 else float(index)
+
+    # --- 推論 ---
+
+    def _infer(self) -> None:
+        while not self.stop_evt.is_set():
+            try:
+                item = self.frame_q.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if item is _END:
+                break
+            index, t, frame = item
+            payload = {'index': index, 'time': t, 'frame': frame if self.keep_frames else None}
+            t0 = time.perf_counter()
+            try:
+                payload['result'] = self.detect(frame)
+                payload['infer_ms'] = int((time.perf_counter() - t0) * 1000)
+                self._count('processed')
+            except Exception as e:
+                payload['error'] = f"Infer error: {e}"
+                self._count('errors')
+            if _put(self.result_q, payload, self.policy, self.stop_evt):
+                self._count('dropped')
+        _put_end(self.result_q, self.stop_evt)
+
+    # --- 受け取り ---
+
+    def poll(self) -> dict | None:
+        """溜まっている結果を1件返す（なければ None、待たない）"""
+        try:
+            item = self.result_q.get_nowait()
+        except queue.Empty:
+            return None
+        if item is _END:
+            _put_end(self.result_q, self.stop_evt)
+            return None
+        return item
+
+    @property
+    def finished(self) -> bool:
+        """読み込み・推論がすべて終わったか"""
+        return bool(self._threads) and not any(t.is_alive() for t in self._threads)
+
+    def _next(self, timeout: float) -> Any:
+        while True:
+            try:
+                return self.result_q.get(timeout=timeout)
+            except queue.Empty:
+                if self.stop_evt.is_set():
+                    return _END
+
+    def __iter__(self) -> Iterator[dict]:
+        self.start()
+        try:
+            while True:
+                item = self._next(0.05)
+                if item is _END:
+                    return
+                yield item
+        finally:
+            self.stop()
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        self.start()
+        try:
+            while True:
+                item = await asyncio.to_thread(self._next, 0.05)
+                if item is _END:
+                    return
+                yield item
+        finally:
+            self.stop()